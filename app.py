@@ -1,90 +1,70 @@
 #!/usr/bin/env python3
 # ─────────────── app.py ───────────────
 
+import startup  # первым: отсчёт фаз старта (см. startup.py) начинается с его импорта
 import os
 import json
 import time
 from datetime import datetime, timedelta, timezone
-import functools
 from functools import wraps
-from typing import Optional
+from typing import Any, Dict, List, Optional
 import logging
-import base64
-from collections import deque
-from urllib3.util.retry import Retry
 from dotenv import load_dotenv
-import requests
+import httpx
 from flask import (
     Flask, render_template, redirect,
     url_for, flash, request, abort,
     jsonify, Response, make_response, g, send_from_directory
 )
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt, set_access_cookies, get_jwt_identity, unset_jwt_cookies, verify_jwt_in_request
+from flask_jwt_extended import JWTManager, create_access_token, set_access_cookies, get_jwt_identity, unset_jwt_cookies
 from flask_wtf import FlaskForm, CSRFProtect
 from werkzeug.security import generate_password_hash, check_password_hash
 from wtforms import StringField, PasswordField, SelectField, SubmitField
 from wtforms.validators import DataRequired, Length
-from requests.adapters import HTTPAdapter
-from requests.exceptions import RequestException, HTTPError
 import logging.config
+import log_pipeline
+import profiling
+import page_cache
+import assets
+import audit
+import auth
+import invalidation
+import json_codec
+import mirror
+import profiles
+import rate_limit
+import reconcile
+import similarity
+from assets import is_fingerprinted
+from page_cache import cache_page
+from json_codec import json_response
+from proxies import client_ip
+from rate_limit import rate_limited
 import subprocess
 import hmac
 import hashlib
 import uuid
-import ipaddress
 
 from config import (
     SECRET_KEY, WTF_CSRF_SECRET_KEY, JWT_SECRET_KEY, 
     GITHUB_SECRET, SUPABASE_URL, SUPABASE_KEY
 )
-from supabase_client import db
-
-# Cloudflare IP ranges
-CLOUDFLARE_IPV4 = [
-    "173.245.48.0/20",
-    "103.21.244.0/22",
-    "103.22.200.0/22",
-    "103.31.4.0/22",
-    "141.101.64.0/18",
-    "108.162.192.0/18",
-    "190.93.240.0/20",
-    "188.114.96.0/20",
-    "197.234.240.0/22",
-    "198.41.128.0/17",
-    "162.158.0.0/15",
-    "104.16.0.0/13",
-    "104.24.0.0/14",
-    "172.64.0.0/13",
-    "131.0.72.0/22"
-]
-
-CLOUDFLARE_IPV6 = [
-    "2400:cb00::/32",
-    "2606:4700::/32",
-    "2803:f800::/32",
-    "2405:b500::/32",
-    "2405:8100::/32",
-    "2a06:98c0::/29",
-    "2c0f:f248::/32"
-]
+from supabase_client import BackendUnavailable, db, mirror_age as supabase_mirror_age
+from http_client import outbound
+from metrics import REGISTRY as METRICS_REGISTRY, REQUEST_SECONDS, REQUESTS_TOTAL, IN_FLIGHT
+from mojang import (
+    get_uuid_from_nickname, get_name_from_uuid,
+    avatar_url, to_data_uri
+)
 
-def is_cloudflare_ip(ip):
-    """Check if an IP address belongs to Cloudflare's ranges."""
-    try:
-        ip_obj = ipaddress.ip_address(ip)
-        ranges = CLOUDFLARE_IPV6 if ip_obj.version == 6 else CLOUDFLARE_IPV4
-        return any(ip_obj in ipaddress.ip_network(range) for range in ranges)
-    except ValueError:
-        return False
+startup.mark('imports')
 
 def get_real_ip():
-    """Get the real client IP address, handling Cloudflare proxy."""
-    if request.headers.get('CF-Connecting-IP'):
-        return request.headers.get('CF-Connecting-IP')
-    elif request.headers.get('X-Forwarded-For'):
-        # Get the first IP in X-Forwarded-For
-        return request.headers.get('X-Forwarded-For').split(',')[0].strip()
-    return request.remote_addr
+    """Real client IP: forwarding headers count only from Cloudflare / trusted proxies (proxies.py)."""
+    if 'real_ip' not in g:
+        g.real_ip = client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'),
+                              request.headers.get('CF-Connecting-IP'))
+    return g.real_ip
 
 # ─────────────── Конфигурация Flask ───────────────
 load_dotenv()
@@ -102,21 +82,26 @@ app.config['GITHUB_SECRET'] = GITHUB_SECRET
 # if not os.path.exists('logs'):
 #     os.mkdir('logs')
 
+# Запись в stdout и форматирование вынесены в отдельный поток (log_pipeline.py):
+# обработчик запроса только кладёт LogRecord в очередь. Вывод — JSON по строке на запись,
+# поля запроса (real_ip, method, path, status_code, duration_ms) попадают в него через extra.
+LOG_SAMPLE_RATES = {
+    'locations.report': 100,      # каждый отчёт о позиции игрока
+    'update_nicknames.entry': 10, # по записи на каждый ник в ЧС
+}
+
 LOG_CONFIG = {
     'version': 1,
     'disable_existing_loggers': False,
     'formatters': {
         'default': {
             'format': '%(asctime)s %(levelname)-8s [%(name)s] %(message)s'
-        },
-        'request': {
-            'format': '%(asctime)s %(levelname)-8s [%(real_ip)s] %(method)s %(path)s %(status_code)s %(message)s'
         }
     },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'default',
+            '()': 'log_pipeline.queue_handler',
+            'sample_rates': LOG_SAMPLE_RATES,
             'level': 'INFO'
         },
         # 'info_file': {
@@ -146,6 +131,7 @@ LOG_CONFIG = {
     }
 }
 logging.config.dictConfig(LOG_CONFIG)
+METRICS_REGISTRY.add_collector(log_pipeline.collect_metrics)
 
 # также направляем werkzeug (Flask's HTTP request log) в ту же систему
 logging.getLogger('werkzeug').handlers = logging.getLogger().handlers
@@ -153,16 +139,12 @@ logging.getLogger('werkzeug').setLevel(logging.INFO)
 # ─────────────── Расширения ───────────────
 csrf = CSRFProtect(app)
 jwt = JWTManager(app)
+auth.init_app(app, jwt)
+startup.mark('config')
 
-# ─────────────── Параметры rate-limiting и HTTP-клиент ───────────────
-_MAX_CALLS = 600
-_WINDOW_SEC = 10 * 60
-_call_times = deque()
-_session = requests.Session()
-retries = Retry(total=3, backoff_factor=1, status_forcelist=[500,502,503,504], raise_on_status=False)
-_adapter = HTTPAdapter(max_retries=retries)
-_session.mount("https://", _adapter)
-_session.mount("http://", _adapter)
+# ─────────────── HTTP-клиент ───────────────
+# Все исходящие запросы идут через общий пул соединений (см. http_client.py),
+# лимит Mojang 600/10мин и кэши ников живут в mojang.py
 
 
 # ─────────────── Формы ───────────────
@@ -235,118 +217,13 @@ def custom_invalid_csrf(reason):
 
 @app.context_processor
 def inject_user():
-    current_user = None
-    current_role = None
-    try:
-        # Если токен есть — подставит в контекст, если нет — не бросит исключение
-        verify_jwt_in_request(optional=True)
-        current_user = get_jwt_identity()
-        claims = get_jwt()
-        current_role = claims.get('role')
-    except Exception:
-        pass
+    # Токен уже проверен в этом запросе (role_required) или проверяется здесь один раз
+    claims = auth.current_claims()
     return {
-        'current_user': current_user,
-        'current_role': current_role
+        'current_user': claims.get('sub'),
+        'current_role': claims.get('role')
     }
 
-def _throttle():
-    now = time.time()
-    while _call_times and _call_times[0] <= now - _WINDOW_SEC:
-        _call_times.popleft()
-    if len(_call_times) >= _MAX_CALLS:
-        time.sleep(_WINDOW_SEC - (now - _call_times[0]) + 0.1)
-        return _throttle()
-    _call_times.append(now)
-
-
-@functools.lru_cache(maxsize=512)
-def get_uuid_from_nickname(nickname: str) -> Optional[str]:
-    """
-    Получить Minecraft UUID по нику через Mojang API.
-    — Кэш на 512 записей.
-    — Учитывает лимит 600/10мин.
-    — Разные уровни логирования для 404 и 429.
-    """
-    name = nickname.strip()
-    if not name:
-        return None
-
-    _throttle()
-    url = f"https://api.mojang.com/users/profiles/minecraft/{name}"
-
-    try:
-        resp = _session.get(url, timeout=5)
-        # Обрабатываем 429 вручную
-        if resp.status_code == 429:
-            retry_after = resp.headers.get("Retry-After")
-            delay = float(retry_after) if retry_after else 5.0
-            app.logger.warning(f"429 for '{name}', retrying after {delay}s")
-            time.sleep(delay)
-            return get_uuid_from_nickname(name)  # повторяем после задержки
-
-        resp.raise_for_status()
-        data = resp.json()
-        uuid = data.get("id")
-        if not uuid:
-            app.logger.info(f"Nickname '{name}' not found (empty response).")
-        return uuid
-
-    except HTTPError as e:
-        status = e.response.status_code if e.response else None
-        if status == 404:
-            # Никнейм не существует
-            app.logger.debug(f"UUID for '{name}' not found (404).")
-        else:
-            app.logger.error(f"Mojang API HTTP {status} for '{name}'")
-    except ValueError as e:
-        app.logger.error(f"JSON parse error for '{name}': {e}")
-    except RequestException as e:
-        app.logger.error(f"Network error retrieving UUID for '{name}': {e}")
-    return None
-
-
-@functools.lru_cache(maxsize=512)
-def get_name_from_uuid(uuid: str) -> Optional[str]:
-    """
-    Получить текущий ник по UUID через Minecraft Services API.
-    Эндпоинт: https://api.minecraftservices.com/minecraft/profile/lookup/{uuid}
-    """
-    u = uuid.replace('-', '').strip()
-    if not u:
-        return None
-
-    _throttle()
-    url = f"https://api.minecraftservices.com/minecraft/profile/lookup/{u}"
-
-    try:
-        resp = _session.get(url, timeout=5)
-        # 429: учитываем Retry-After
-        if resp.status_code == 429:
-            ra = resp.headers.get("Retry-After")
-            delay = float(ra) if ra else 5.0
-            app.logger.warning(f"429 for '{u}', retry after {delay}s")
-            time.sleep(delay)
-            return get_name_from_uuid(u)
-
-        resp.raise_for_status()
-        data = resp.json()
-        name = data.get("name")
-        if not name:
-            app.logger.info(f"No name field in response for '{u}'")
-        return name
-
-    except HTTPError as e:
-        status = e.response.status_code if e.response else None
-        if status == 404:
-            app.logger.debug(f"UUID '{u}' not found (404).")
-        else:
-            app.logger.error(f"HTTP {status} for lookup/{u}")
-    except (ValueError, RequestException) as e:
-        app.logger.error(f"Error fetching name for '{u}': {e}")
-    return None
-
-
 # Декоратор для проверки входа в админ панель
 def role_required(*allowed_roles):
     """
@@ -354,9 +231,9 @@ def role_required(*allowed_roles):
     """
     def decorator(fn):
         @wraps(fn)
-        @jwt_required()
         def wrapper(*args, **kwargs):
-            claims = get_jwt()
+            # Вместо @jwt_required(): декодируем один раз, claims остаются в g для шаблона и аудита
+            claims = auth.verify_request()
             user_role = claims.get('role', '').lower()
             # если не в списке allowed_roles и не owner — 403
             if user_role not in [r.lower() for r in allowed_roles] and user_role != 'owner':
@@ -384,19 +261,15 @@ def role_required(*allowed_roles):
 
 
 # --- Helper for Audit Logging ---
-def log_admin_action(action_type: str, target_type: Optional[str] = None, target_identifier: Optional[str] = None, details: Optional[str] = None):
+def log_admin_action(action_type: str, target_type: Optional[str] = None, target_identifier: Optional[str] = None,
+                     details: Optional[str] = None, items: Optional[List[Dict[str, Any]]] = None):
+    """Queue an audit record for the current admin (written in the background, see audit.py)."""
     try:
-        # Ensure we are in a request context with a JWT
-        verify_jwt_in_request(optional=True) # Use optional to avoid error if called outside a protected route, though it should be.
+        # Вызывается из вью под @role_required — токен уже проверен, второй раз не декодируем
         current_user_identity = get_jwt_identity()
         if current_user_identity:
-            db.add_audit_log(
-                admin_username=current_user_identity,
-                action_type=action_type,
-                target_type=target_type,
-                target_identifier=str(target_identifier) if target_identifier is not None else None,
-                details=details
-            )
+            audit.record(current_user_identity, action_type, target_type=target_type,
+                         target_identifier=target_identifier, details=details, items=items)
         else:
             app.logger.warning("Attempted to log admin action without a JWT identity (e.g. user not logged in or no token).")
     except Exception as e:
@@ -406,22 +279,25 @@ def log_admin_action(action_type: str, target_type: Optional[str] = None, target
 
 # --- Маршруты публичного сайта ---
 @app.route("/", methods=["GET", "POST"])
+@rate_limited
 def index():
     form = CheckForm()
     result = None
     if form.validate_on_submit():
         name = form.nickname.data.strip()
-        entry = db.get_blacklist_entry(name)
+        former = None
+        try:
+            entry = db.get_blacklist_entry(name)
+        except BackendUnavailable:
+            # Ни Supabase, ни зеркало не ответили — «не в ЧС» здесь было бы ложью
+            result = {"message": "Проверка временно недоступна, попробуйте позже.", "color": "orange"}
+            return render_template("index.html", form=form, result=result), 503
+        if not entry:
+            entry = former = db.get_blacklist_entry_by_past_nickname(name)
         if entry:
-            new_uuid = get_uuid_from_nickname(name)
-            if new_uuid and new_uuid.lower() != entry['uuid'].lower():
-                db.update_blacklist_entry(entry['id'], {
-                    'uuid': new_uuid,
-                    'nickname': name
-                })
-                entry['uuid'] = new_uuid
-                entry['nickname'] = name
-            result = {"message": f"{name}, вы в ЧС!", "reason": entry['reason'], "color": "red"}
+            reconcile.enqueue(entry)  # сверка с Mojang — в фоне, ответ из сохранённых данных
+            message = f"{name}, вы в ЧС!" if not former else f"{name} — прошлый ник игрока {entry['nickname']} из ЧС!"
+            result = {"message": message, "reason": entry['reason'], "color": "red"}
         else:
             result = {"message": f"{name}, вы не в ЧС!", "color": "green"}
         db.add_check_log(check_source='main_page_check') # Log the check
@@ -429,6 +305,7 @@ def index():
 
 
 @app.route("/fullist")
+@cache_page
 def fullist():
     return render_template(
         "fullist.html",
@@ -438,16 +315,19 @@ def fullist():
 
 
 @app.route("/ave")
+@cache_page
 def ave():
     return render_template("ave.html")
 
 
 @app.route("/contacts")
+@cache_page
 def contacts():
     return render_template("contacts.html")
 
 
 @app.route("/offline")
+@cache_page
 def offline():
     return render_template("offline.html")
 
@@ -534,20 +414,22 @@ def admin_panel():
         nick = form.nickname.data.strip()
         reason = form.reason.data.strip()
         uuid_val = get_uuid_from_nickname(nick) # Renamed to avoid conflict with uuid module
-        
+
         if not uuid_val:
             flash("Не удалось получить UUID.", "warning")
-        elif db.get_blacklist_entry(nick): # Checks by nickname, which could lead to issues if nickname changed.
-            flash("Уже в черном списке.", "info")
         else:
-            # It might be better to check by UUID if it's the primary identifier
-            existing_by_uuid = db.client.table('blacklist_entry').select('id').eq('uuid', uuid_val).execute()
-            if existing_by_uuid.data:
-                flash(f"Пользователь с UUID {uuid_val} уже в черном списке.", "info")
-            elif db.add_blacklist_entry(nick, uuid_val, reason):
-                log_admin_action("ADD_BLACKLIST", target_type="blacklist_entry", target_identifier=nick, details=f"UUID: {uuid_val}, Reason: {reason}")
+            # Проверка дубликатов по нику и UUID, вставка и аудит — одним вызовом в одной транзакции
+            outcome = db.add_or_reject_blacklist_entry(nick, uuid_val, reason, admin_username=get_jwt_identity())
+            if outcome['status'] == 'added':
                 flash("Запись добавлена в ЧС.", "success")
                 return redirect(url_for('admin_panel'))
+            elif outcome['status'] == 'queued':
+                flash("База недоступна: запись сохранена и будет добавлена в ЧС, когда связь восстановится.", "warning")
+                return redirect(url_for('admin_panel'))
+            elif outcome['status'] == 'exists' and outcome.get('conflict') == 'uuid':
+                flash(f"Пользователь с UUID {uuid_val} уже в черном списке.", "info")
+            elif outcome['status'] == 'exists':
+                flash("Уже в черном списке.", "info")
             else:
                 flash("Ошибка при добавлении записи.", "danger")
     
@@ -617,6 +499,7 @@ def delete_user(user_id):
         flash("Нельзя удалить себя.", "warning")
     else:
         if db.delete_admin_user(user_id):
+            auth.revoke(user_to_delete['username'])  # его токены перестают действовать сразу
             log_admin_action("DELETE_ADMIN_USER", target_type="admin_user", target_identifier=user_to_delete['username'])
             flash("Пользователь удалён.", "success")
         else:
@@ -686,7 +569,7 @@ def admin_whitelist():
 def api_get_all_whitelisted_uuids():
     try:
         uuids = db.get_all_whitelisted_uuids()
-        return jsonify(uuids) # Returns a simple JSON array of UUID strings
+        return json_response(uuids) # Simple JSON array of UUID strings; streamed when large
     except Exception as e:
         app.logger.error(f"Error in /api/whitelist/all: {e}")
         return jsonify({"error": "Failed to fetch whitelist", "message": str(e)}), 500
@@ -702,7 +585,7 @@ def update_nicknames_route():
             updated_count = 0
             failed_fetch_count = 0
             no_change_count = 0
-            log_details = []
+            audit_items = []  # только изменения и сбои; неизменённые записи учтены в итоге
 
             if not entries:
                 flash("Черный список пуст. Нечего обновлять.", "info")
@@ -715,31 +598,35 @@ def update_nicknames_route():
                 entry_id = entry.get('id')
 
                 if not current_uuid or not entry_id:
-                    app.logger.warning(f"Skipping entry due to missing uuid or id: {entry}")
+                    app.logger.warning("Skipping entry due to missing uuid or id: %s", entry)
                     failed_fetch_count += 1
-                    log_details.append(f"Skipped entry: missing uuid/id for {old_nickname or 'Unknown'}")
+                    audit_items.append({'target_identifier': old_nickname or entry_id, 'status': 'skipped',
+                                        'details': 'missing uuid/id'})
                     continue
 
                 new_nickname = get_name_from_uuid(current_uuid)
 
                 if new_nickname is None:
-                    app.logger.warning(f"Failed to fetch new nickname for UUID: {current_uuid} (old: {old_nickname})")
+                    app.logger.warning("Failed to fetch new nickname for UUID: %s (old: %s)", current_uuid, old_nickname)
                     failed_fetch_count += 1
-                    log_details.append(f"Failed fetch for UUID {current_uuid} (was {old_nickname})")
+                    audit_items.append({'target_identifier': current_uuid, 'status': 'failed',
+                                        'details': f"Was {old_nickname}"})
                     continue
 
                 if new_nickname != old_nickname:
-                    db.update_blacklist_entry_nickname(entry_id, new_nickname)
+                    if db.update_blacklist_entry_nickname(entry_id, new_nickname) and old_nickname:
+                        db.add_nickname_history(current_uuid, old_nickname)
                     updated_count += 1
-                    log_details.append(f"Updated: {old_nickname} -> {new_nickname} (UUID: {current_uuid})")
-                    app.logger.info(f"Updated nickname for UUID {current_uuid}: {old_nickname} -> {new_nickname}")
+                    audit_items.append({'target_identifier': current_uuid, 'status': 'updated',
+                                        'details': f"{old_nickname} -> {new_nickname}"})
+                    app.logger.info("Updated nickname for UUID %s: %s -> %s", current_uuid, old_nickname, new_nickname,
+                                    extra={'sample': 'update_nicknames.entry'})
                 else:
                     no_change_count +=1
-                    log_details.append(f"No change: {old_nickname} (UUID: {current_uuid})")
             
             summary_message = f"Обновление никнеймов завершено. Обновлено: {updated_count}. Не удалось получить: {failed_fetch_count}. Без изменений: {no_change_count}."
             flash(summary_message, "success" if updated_count > 0 or no_change_count > 0 else "warning")
-            log_admin_action(action_type="update_nicknames", details=summary_message + " Details: " + "; ".join(log_details))
+            log_admin_action(action_type="update_nicknames", details=summary_message, items=audit_items)
 
         except Exception as e:
             app.logger.error(f"Error updating nicknames: {e}", exc_info=True)
@@ -771,6 +658,26 @@ def sitemap():
         mimetype='application/xml'
     )
 
+# Статика, которую service worker кладёт в кэш при установке (ссылки с хешем подставляются в шаблоне)
+SW_PRECACHE_ASSETS = [
+    'css/theme.css',
+    'css/style.css',
+    'js/ave-effects.js',
+    'js/filter-list.js',
+    'js/random_video.js',
+    'js/sw-register.js',
+    'manifest.json',
+    'icons/favicon.ico',
+]
+
+
+@app.route('/sw.js', methods=['GET'])
+@cache_page
+def service_worker():
+    body = render_template('sw.js', precache_assets=SW_PRECACHE_ASSETS)
+    return Response(body, mimetype='application/javascript')
+
+
 @app.route('/robots.txt', methods=['GET'])
 def robots():
     return send_from_directory(
@@ -794,37 +701,46 @@ def shmok():
 
 
 @app.route('/api/check', methods=['GET'])
+@rate_limited
 def api_check():
     nickname = request.args.get('nickname', '').strip()
     if not nickname:
         payload = {'error': 'Параметр nickname обязателен и не может быть пустым'}
-        text = json.dumps(payload, ensure_ascii=False)
-        return Response(text, status=400, mimetype='application/json')
+        return json_response(payload, status=400)
 
-    entry = db.get_blacklist_entry(nickname)
+    try:
+        entry = db.get_blacklist_entry(nickname)
+    except BackendUnavailable:
+        return json_response({'error': 'Проверка временно недоступна, попробуйте позже'}, status=503)
+    mirror_age = supabase_mirror_age()  # None, если ответил Supabase
+    matched_by = 'nickname'
+    if not entry:
+        # Переименовавшийся игрок: старый ник есть в nickname_history, Mojang не нужен
+        entry = db.get_blacklist_entry_by_past_nickname(nickname)
+        matched_by = 'past_nickname'
     if entry:
-        new_uuid = get_uuid_from_nickname(nickname)
-        if new_uuid and new_uuid.lower() != entry['uuid'].lower():
-            db.update_blacklist_entry(entry['id'], {
-                'uuid': new_uuid,
-                'nickname': nickname
-            })
-            entry['uuid'] = new_uuid
-            entry['nickname'] = nickname
-
+        reconcile.enqueue(entry)  # сверка с Mojang — в фоне, ответ из сохранённых данных
         payload = {
             'in_blacklist': True,
             'nickname': entry['nickname'],
             'uuid': entry['uuid'],
             'reason': entry['reason'],
-            'created_at': entry['created_at']
+            'created_at': entry['created_at'],
+            'last_verified_at': entry.get('last_verified_at'),
+            'matched_by': matched_by
         }
     else:
         payload = {'in_blacklist': False}
+    if mirror_age is not None:
+        # Ответ из локального зеркала: насколько оно отстаёт от Supabase
+        payload['source'] = 'mirror'
+        payload['mirror_age'] = round(mirror_age)
+    if request.args.get('similar', '').lower() in ('1', 'true', 'yes'):
+        # Похожие ники из ЧС (вероятные твинки), без самой найденной записи
+        payload['similar'] = similarity.find_similar(nickname, exclude=entry['id'] if entry else None)
 
     db.add_check_log(check_source='api_check') # Log the check
-    text = json.dumps(payload, ensure_ascii=False)
-    return Response(text, status=200, mimetype='application/json')
+    return json_response(payload)
 
 @app.route("/admin/map", methods=["GET"])
 @role_required("owner", "admin")
@@ -838,19 +754,32 @@ def admin_map():
 @app.route("/admin/audit_log", methods=["GET"])
 @role_required("owner")
 def admin_audit_log():
-    page = request.args.get('page', 1, type=int)
     per_page = 20 # Or make this configurable
-    
-    logs_data = db.get_audit_logs(page=page, per_page=per_page)
-    
-    return render_template("admin_audit_log.html", 
-                           logs=logs_data.get('items', []),
-                           page=logs_data.get('page'),
-                           per_page=logs_data.get('per_page'),
-                           total_items=logs_data.get('total_items'),
-                           has_more=logs_data.get('has_more'))
+    filters = {key: request.args.get(key, '').strip() or None
+               for key in ('admin_username', 'action_type', 'target_identifier')}
+
+    logs_data = db.get_audit_logs(before=request.args.get('before'), after=request.args.get('after'),
+                                  limit=per_page, **filters)
+    logs = logs_data['items']
+    # Время форматируем один раз здесь, а не фильтром на каждую ячейку шаблона
+    for log in logs:
+        log['timestamp_display'] = format_datetime_filter(log.get('timestamp')) if log.get('timestamp') else '-'
+
+    return render_template("admin_audit_log.html",
+                           logs=logs,
+                           filters={key: value for key, value in filters.items() if value},
+                           older=logs_data['older'],
+                           newer=logs_data['newer'],
+                           total_estimate=logs_data['total'])
+
+def conditional_json(response):
+    """ETag + 304 на If-None-Match: service worker ревалидирует кэш списка без повторной загрузки тела."""
+    response.add_etag(weak=True)
+    return response.make_conditional(request)
+
 
 @app.route('/api/fullist')
+@rate_limited
 def api_full_blacklist():
     try:
         page = int(request.args.get('page', 1))
@@ -867,7 +796,9 @@ def api_full_blacklist():
 
         # Get paginated results with search
         result = db.get_all_blacklist_entries(page=page, per_page=per_page, search=search_query)
-        return jsonify(result)
+        # Текущий ник из кэша и URL аватарки — клиенту не нужен запрос на каждую строку
+        profiles.enrich_entries(result['items'])
+        return conditional_json(jsonify(result))
 
     except Exception as e:
         app.logger.error(f"Error in api_full_blacklist: {str(e)}")
@@ -877,49 +808,150 @@ def api_full_blacklist():
         }), 500
 
 
+UUID_CACHE_SECONDS = 600       # ник может смениться не чаще раза в 30 дней
+UUID_MISS_CACHE_SECONDS = 60   # свободный ник могут занять в любой момент
+
+
 @app.route("/api/uuid/<nickname>", methods=["GET"])
+@rate_limited
 def api_uuid_lookup(nickname):
     """
-    Возвращает UUID игрока по его никнейму через Mojang API.
+    Возвращает UUID игрока по его никнейму: кэш -> записи ЧС -> Mojang (см. profiles.py).
+    Откуда взят ответ — в заголовке X-Profile-Source.
     """
     nickname = nickname.strip()
     if not nickname:
-        return Response(json.dumps({"error": "Ник не должен быть пустым"}, ensure_ascii=False),
-                        status=400, mimetype="application/json")
+        return json_response({"error": "Ник не должен быть пустым"}, status=400)
+    if not profiles.is_valid_nickname(nickname):
+        return json_response({"error": "Некорректный ник"}, status=400)
 
     try:
-        r = requests.get(f"https://api.mojang.com/users/profiles/minecraft/{nickname}", timeout=5)
-        if r.status_code == 200:
-            data = r.json()
-            return Response(json.dumps({"nickname": data["name"], "uuid": data["id"]}, ensure_ascii=False),
-                            mimetype="application/json")
-        else:
-            return Response(json.dumps({"error": "UUID не найден"}, ensure_ascii=False),
-                            status=404, mimetype="application/json")
-    except Exception as e:
-        app.logger.exception("Ошибка при обращении к Mojang API")
-        return Response(json.dumps({"error": "Ошибка при обращении к Mojang API"}, ensure_ascii=False),
-                        status=500, mimetype="application/json")
+        profile = profiles.resolve(nickname)
+    except LookupError:
+        return json_response({"error": "Ошибка при обращении к Mojang API"}, status=502)
+
+    if profile is None:
+        response = json_response({"error": "UUID не найден"}, status=404)
+        response.cache_control.max_age = UUID_MISS_CACHE_SECONDS
+    else:
+        response = json_response({"nickname": profile.nickname, "uuid": profile.uuid})
+        response.headers['X-Profile-Source'] = profile.source
+        response.cache_control.max_age = UUID_CACHE_SECONDS
+    response.cache_control.public = True
+    return conditional_json(response) if profile else response
+
+
+@app.route("/api/name-history/<player_uuid>", methods=["GET"])
+@rate_limited
+def api_name_history(player_uuid):
+    """
+    Прошлые ники игрока из nickname_history (замеченные при сверке с Mojang), новые первыми.
+    Ответ: {"uuid", "nickname": текущий ник или null, "history": [{"nickname", "changed_at"}]}
+    """
+    uuid_key = profiles.normalize_uuid(player_uuid)
+    if uuid_key is None:
+        return json_response({"error": "Invalid UUID format"}, status=400)
+
+    entry = db.get_blacklist_entry_by_uuid(uuid_key)
+    current = entry['nickname'] if entry else profiles.cached_nickname(uuid_key)
+    response = json_response({"uuid": uuid_key, "nickname": current, "history": db.get_nickname_history(uuid_key)})
+    response.cache_control.public = True
+    response.cache_control.max_age = UUID_CACHE_SECONDS
+    return conditional_json(response)
+
+
+@csrf.exempt
+@app.route("/api/uuid", methods=["POST"])
+@rate_limited
+def api_uuid_batch():
+    """
+    Пакетный поиск UUID: {"nicknames": ["Notch", ...]} (до profiles.BATCH_LIMIT ников).
+    Ответ: {"profiles": {"Notch": {"nickname", "uuid"} | null}, "invalid": [...], "unresolved": [...]};
+    null — ника не существует, unresolved — Mojang сейчас недоступен, стоит повторить позже.
+    """
+    data = request.get_json(silent=True)
+    nicknames = data.get("nicknames") if isinstance(data, dict) else data
+    if not isinstance(nicknames, list) or not all(isinstance(n, str) for n in nicknames):
+        return json_response({"error": "Ожидается {\"nicknames\": [\"...\"]}"}, status=400)
+    if len(nicknames) > profiles.BATCH_LIMIT:
+        return json_response({"error": f"Не больше {profiles.BATCH_LIMIT} ников за запрос"}, status=400)
+
+    nicknames = list(dict.fromkeys(n.strip() for n in nicknames if n.strip()))
+    invalid = [n for n in nicknames if not profiles.is_valid_nickname(n)]
+    resolved = profiles.resolve_many(nicknames)
+    found, unresolved = {}, []
+    for nickname in nicknames:
+        if nickname in invalid:
+            continue
+        key = nickname.lower()
+        if key not in resolved:
+            unresolved.append(nickname)
+            continue
+        profile = resolved[key]
+        found[nickname] = {"nickname": profile.nickname, "uuid": profile.uuid} if profile else None
+    return json_response({"profiles": found, "invalid": invalid, "unresolved": unresolved})
 
 
 @app.before_request
 def start_timer():
-    g.start_time = time.time()
+    g.start_time = time.perf_counter()
+    IN_FLIGHT.inc()
 
 
 @app.after_request
 def log_request(response):
-    duration = time.time() - getattr(g, 'start_time', time.time())
+    duration = time.perf_counter() - getattr(g, 'start_time', time.perf_counter())
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_SECONDS.observe((endpoint,), duration)
+    REQUESTS_TOTAL.inc((endpoint, response.status_code))
     extra = {
         'real_ip': get_real_ip(),
         'method': request.method,
         'path': request.path,
-        'status_code': response.status_code
+        'status_code': response.status_code,
+        'duration_ms': round(duration * 1000, 2)
     }
     logging.getLogger('request').info('Request processed', extra=extra)
     return response
 
 
+# Изменения, сделанные другими воркерами, применяем к своим кэшам до того, как запрос их прочтёт
+invalidation.init_app(app)
+# Кэш отрендеренных публичных страниц; регистрируется после start_timer, чтобы хиты попадали в метрики
+page_cache.init_app(app)
+# orjson для jsonify и сжатие JSON-ответов br/gzip по Accept-Encoding
+json_codec.init_app(app)
+# Token bucket на клиента для публичных API (@rate_limited) и отдельный бюджет на походы в Mojang
+rate_limit.init_app(app)
+
+
+@app.teardown_request
+def finish_timer(exc):
+    # teardown вызывается и при необработанных исключениях, поэтому gauge не «залипает»
+    if 'start_time' in g:
+        IN_FLIGHT.dec()
+
+
+def _is_owner() -> bool:
+    """Текущий запрос несёт валидный JWT с ролью owner."""
+    return auth.current_role() == 'owner'
+
+
+def _is_local_request() -> bool:
+    """Запрос пришёл с этой же машины напрямую, а не через прокси."""
+    return (request.remote_addr in ('127.0.0.1', '::1')
+            and not request.headers.get('X-Forwarded-For')
+            and not request.headers.get('CF-Connecting-IP'))
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus-метрики. Доступ: owner или запрос с localhost."""
+    if not _is_local_request() and not _is_owner():
+        abort(403)
+    return Response(METRICS_REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.errorhandler(Exception)
 def handle_unexpected_error(error):
     """Handle any uncaught exception"""
@@ -944,12 +976,72 @@ def swagger_ui():
     return redirect("/static/swagger/index.html")
 
 
+# ─────────────── Профилирование ───────────────
+# Запрос с заголовком X-Profile: 1 (или ?_profile=1) от owner выполняется под cProfile,
+# топ функций уходит в Server-Timing, полный отчёт — в /admin/profiles/<id>.
+profiling.init_app(app, is_owner=_is_owner)
+
+
+@app.route("/admin/profiles", methods=["GET"])
+@role_required("owner")
+def admin_profiles():
+    return jsonify({
+        'reports': profiling.reports(),
+        'armed': profiling.armed(),
+        'sampled_endpoints': profiling.sampled_endpoints(),
+    })
+
+
+@app.route("/admin/profiles/<report_id>", methods=["GET"])
+@role_required("owner")
+def admin_profile_report(report_id):
+    report = profiling.get_report(report_id)
+    if not report:
+        abort(404)
+    return Response(report['report'], mimetype='text/plain')
+
+
+@app.route("/admin/profiles/flamegraph", methods=["GET"])
+@role_required("owner")
+def admin_profile_flamegraph():
+    """Свёрнутые стеки непрерывного сэмплирования (PROFILE_SAMPLING_HZ) для flamegraph.pl/speedscope."""
+    return Response(profiling.flamegraph(request.args.get('endpoint')), mimetype='text/plain')
+
+
+@csrf.exempt
+@app.route("/admin/profiles/arm", methods=["POST"])
+@role_required("owner")
+def admin_profile_arm():
+    """Профилировать следующие N запросов к эндпоинту: {"endpoint": "admin_panel", "count": 5}."""
+    data = request.get_json(silent=True) or {}
+    endpoint = data.get('endpoint')
+    if endpoint not in app.view_functions:
+        return jsonify(error="Unknown endpoint"), 400
+    try:
+        count = max(0, min(int(data.get('count', 1)), 100))
+    except (TypeError, ValueError):
+        return jsonify(error="count must be an integer"), 400
+    profiling.arm(endpoint, count)
+    log_admin_action("ARM_PROFILER", target_type="endpoint", target_identifier=endpoint, details=f"Count: {count}")
+    return jsonify(armed=profiling.armed())
+
+
+@app.route("/admin/outbound_stats", methods=["GET"])
+@role_required("owner")
+def admin_outbound_stats():
+    """Счётчики пулов исходящих соединений: запросы, новые соединения, доля переиспользования."""
+    return jsonify(outbound.stats())
+
+
 # ─────────────── API: Периодические данные для PWA ───────────────
 @app.route("/api/latest-data", methods=["GET"])
+@rate_limited
 def api_latest_data():
     """
     Возвращает последние записи из черного списка для периодического кеширования.
     Опциональный параметр ?limit=<int> (макс. 100) задает число записей, по умолчанию 10.
+    ?since=<ISO datetime> — только записи, добавленные строго позже этого момента (дельта для фоновой синхронизации:
+    клиент передаёт created_at самой новой уже полученной записи, и пустой ответ значит «ничего нового»).
     """
     # Определяем параметр limit
     try:
@@ -958,8 +1050,15 @@ def api_latest_data():
         limit = 10
     limit = max(1, min(limit, 100))
 
+    since = request.args.get("since") or None
+    if since:
+        try:
+            datetime.fromisoformat(since.replace('Z', '+00:00'))
+        except ValueError:
+            return jsonify({"error": "since must be an ISO 8601 datetime"}), 400
+
     # Получаем последние записи
-    result = db.get_all_blacklist_entries(page=1, per_page=limit)
+    result = db.get_all_blacklist_entries(page=1, per_page=limit, created_after=since)
     entries = result.get('items', [])
 
     # Формируем JSON-пayload
@@ -973,11 +1072,55 @@ def api_latest_data():
         for e in entries
     ]
 
-    # Отдаем JSON без \u-эскейпов
-    return Response(
-        json.dumps(payload, ensure_ascii=False),
-        mimetype="application/json"
-    )
+    # JSON без \u-эскейпов; целиком, а не потоком — ETag считается по телу
+    return conditional_json(json_response(payload, stream=False))
+
+def build_location_rows(locations_data, players):
+    """
+    Склеивает точки игроков с никами и URL аватарок (players: uuid -> profiles.player_details)
+    и оставляет только последний час.
+    Используется и Flask-вью, и async API (async_api.py).
+    """
+    results = []
+    for loc in locations_data:
+        # Use client_timestamp if available and valid, otherwise fall back to created_at
+        timestamp_to_use = loc.get('client_timestamp') or loc.get('created_at')
+        # Ensure timestamp is in ISO format string for JSON serialization
+        if isinstance(timestamp_to_use, datetime):
+            iso_timestamp = timestamp_to_use.isoformat()
+        elif isinstance(timestamp_to_use, str):
+            iso_timestamp = timestamp_to_use
+        else:
+            iso_timestamp = datetime.utcnow().isoformat()
+        player_uuid = loc.get('uuid')
+        player = players.get(player_uuid) or {}
+        results.append({
+            "uuid": player_uuid,
+            "nickname": player.get("nickname", "Unknown"),
+            "avatar_url": player.get("avatar_url"),
+            "x": loc.get("x"),
+            "y": loc.get("y"),
+            "z": loc.get("z"),
+            "timestamp": iso_timestamp
+        })
+
+    # Filter results to only include those from the last hour
+    now_dt = datetime.utcnow().replace(tzinfo=None) # Naive datetime for comparison
+    one_hour_ago = now_dt - timedelta(hours=1)
+    final_results = []
+    for r in results:
+        ts_str = r.get("timestamp")
+        if ts_str:
+            try:
+                dt_obj = datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
+                if dt_obj.tzinfo:
+                    dt_obj = dt_obj.astimezone(timezone.utc).replace(tzinfo=None)
+                if dt_obj > one_hour_ago:
+                    final_results.append(r)
+            except ValueError as e:
+                app.logger.warning(f"Could not parse timestamp '{ts_str}' for location: {e}")
+    return final_results
+
 
 @csrf.exempt
 @app.route("/api/locations/view", methods=["GET"])
@@ -985,87 +1128,25 @@ def api_latest_data():
 def api_locations_view():
     try:
         # Fetch locations from the last hour, most recent first
-        response = db.client.table('player_locations')\
-            .select('uuid, x, y, z, client_timestamp, created_at')\
-            .order('created_at', desc=True)\
-            .limit(100)\
-            .execute()
-
-        if response.error:
-            app.logger.error(f"Error fetching locations from Supabase: {response.error.message}")
-            return jsonify({"error": "Failed to fetch locations", "details": response.error.message}), 500
+        locations_data = db.get_recent_player_locations(limit=100)
 
-        locations_data = response.data
-        results = []
-
-        # Get a unique set of UUIDs to fetch nicknames and avatars efficiently
+        # Ники: сначала кэш, промахи — параллельно через пул profiles; аватарки — URL Minotar,
+        # их кэширует браузер и service worker
         unique_uuids = list(set(loc['uuid'] for loc in locations_data if loc['uuid']))
-
-        nicknames_cache = {}
-        avatars_cache = {}
-
-        for u_id in unique_uuids:
-            nicknames_cache[u_id] = get_name_from_uuid(u_id) # Mojang API call
-            # Fetch avatar (simplified, assumes api_avatar logic or direct Minotar)
-            avatar_url = f"https://minotar.net/helm/{u_id}/32.png" # Smaller avatar for map
-            try:
-                avatar_resp = requests.get(avatar_url, timeout=2)
-                if avatar_resp.status_code == 200:
-                    b64_avatar = base64.b64encode(avatar_resp.content).decode('ascii')
-                    avatars_cache[u_id] = f"data:image/png;base64,{b64_avatar}"
-                else:
-                    avatars_cache[u_id] = None # Or a default placeholder avatar
-            except requests.RequestException:
-                avatars_cache[u_id] = None
-
-        for loc in locations_data:
-            # Use client_timestamp if available and valid, otherwise fall back to created_at
-            timestamp_to_use = loc.get('client_timestamp') or loc.get('created_at')
-            # Ensure timestamp is in ISO format string for JSON serialization
-            if isinstance(timestamp_to_use, datetime):
-                iso_timestamp = timestamp_to_use.isoformat()
-            elif isinstance(timestamp_to_use, str):
-                iso_timestamp = timestamp_to_use
-            else:
-                iso_timestamp = datetime.utcnow().isoformat()
-            player_uuid = loc.get('uuid')
-            results.append({
-                "uuid": player_uuid,
-                "nickname": nicknames_cache.get(player_uuid, "Unknown"),
-                "avatar_base64": avatars_cache.get(player_uuid),
-                "x": loc.get("x"),
-                "y": loc.get("y"),
-                "z": loc.get("z"),
-                "timestamp": iso_timestamp 
-            })
-
-        # Filter results to only include those from the last hour
-        now_dt = datetime.utcnow().replace(tzinfo=None) # Naive datetime for comparison
-        one_hour_ago = now_dt - timedelta(hours=1)
-        final_results = []
-        for r in results:
-            ts_str = r.get("timestamp")
-            if ts_str:
-                try:
-                    dt_obj = datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
-                    if dt_obj.tzinfo:
-                        dt_obj = dt_obj.astimezone(timezone.utc).replace(tzinfo=None)
-                    if dt_obj > one_hour_ago:
-                        final_results.append(r)
-                except ValueError as e:
-                    app.logger.warning(f"Could not parse timestamp '{ts_str}' for location: {e}")
-        return jsonify(final_results)
+        players = profiles.details_many(unique_uuids, size=profiles.MAP_AVATAR_SIZE)
+        return json_response(build_location_rows(locations_data, players))
     except Exception as e:
         app.logger.error(f"Unexpected error in /api/locations/view: {e}", exc_info=True)
         return jsonify({"error": "An unexpected error occurred.", "message": str(e)}), 500
 
 
 @app.route("/api/player-details/<player_uuid>", methods=["GET"])
+@rate_limited
 def api_player_details(player_uuid):
     """
-    Возвращает JSON с никнеймом и аватаркой игрока в Base64 по UUID.
+    Возвращает JSON с никнеймом и URL аватарки игрока по UUID.
     Ответ:
-      200: { "uuid": "...", "nickname": "...", "avatar_base64": "data:image/png;base64,..." }
+      200: { "uuid": "...", "nickname": "...", "avatar_url": "https://minotar.net/helm/.../32.png" }
       404: { "error": "Player details not found or UUID invalid" }
       500: { "error": "Internal error fetching player details" }
     """
@@ -1073,34 +1154,37 @@ def api_player_details(player_uuid):
         return jsonify(error="Invalid UUID format"), 400
 
     nickname = get_name_from_uuid(player_uuid)
-    # Avatar fetching logic (similar to /api/avatar/)
-    avatar_base64 = None
-    avatar_url = f"https://minotar.net/helm/{player_uuid}/32.png" # Using 32px for map consistency
-    try:
-        resp = requests.get(avatar_url, timeout=3) # Short timeout for combined endpoint
-        if resp.status_code == 200:
-            b64 = base64.b64encode(resp.content).decode('ascii')
-            avatar_base64 = f"data:image/png;base64,{b64}"
-        # Not found (404) for avatar is acceptable, nickname might still exist
-    except requests.RequestException as e:
-        app.logger.warning(f"Error fetching avatar for {player_uuid} in player-details: {e}")
-        # Continue without avatar if it fails, nickname is more critical here
-
-    if not nickname and not avatar_base64:
-        # Only return 404 if both are missing and it seems like a totally invalid/unknown UUID
-        # If Mojang API fails for nickname but avatar was found (or vice-versa), we might still return 200 with partial data.
-        # However, get_name_from_uuid returns None on API error or 404.
-        # Minotar returns 404 if UUID is unknown.
-        # So if both are None/failed, it's likely the UUID is bad or Mojang/Minotar are down.
+    if not nickname:
+        # get_name_from_uuid возвращает None и на неизвестный UUID, и на ошибку Mojang
         return jsonify(error="Player details not found or UUID invalid"), 404
+    # Аватарка — URL Minotar того же размера, что на карте: её кэширует браузер, сервер её не качает
+    return jsonify(profiles.player_details(player_uuid, nickname, size=profiles.MAP_AVATAR_SIZE)), 200
+
+@csrf.exempt
+@app.route("/api/player-details/batch", methods=["POST"])
+@rate_limited
+def api_player_details_batch():
+    """
+    Ники и URL аватарок для нескольких игроков за один запрос:
+    {"uuids": ["...", ...]} (до profiles.BATCH_LIMIT UUID).
+    Ответ: {"players": {"<uuid>": {"uuid", "nickname", "avatar_url"}}, "invalid": [...]};
+    nickname — null, если Mojang его не вернул или промахов кэша больше profiles.LOOKUP_LIMIT (их можно запросить снова).
+    """
+    data = request.get_json(silent=True)
+    uuids = data.get("uuids") if isinstance(data, dict) else data
+    if not isinstance(uuids, list) or not all(isinstance(u, str) for u in uuids):
+        return json_response({"error": "Ожидается {\"uuids\": [\"...\"]}"}, status=400)
+    if len(uuids) > profiles.BATCH_LIMIT:
+        return json_response({"error": f"Не больше {profiles.BATCH_LIMIT} UUID за запрос"}, status=400)
+
+    uuids = list(dict.fromkeys(u.strip() for u in uuids if u.strip()))
+    invalid = [u for u in uuids if profiles.normalize_uuid(u) is None]
+    players = profiles.details_many(u for u in uuids if u not in invalid)
+    return json_response({"players": players, "invalid": invalid})
 
-    return jsonify({
-        "uuid": player_uuid,
-        "nickname": nickname, # Will be null if not found
-        "avatar_base64": avatar_base64 # Will be null if not found or error
-    }), 200
 
 @app.route("/api/avatar/<user_uuid>", methods=["GET"])
+@rate_limited
 def api_avatar(user_uuid):
     """
     JSON API: возвращает PNG‑аватарку игрока в Base64.
@@ -1110,33 +1194,28 @@ def api_avatar(user_uuid):
       500: { "error": "Internal error fetching avatar" }
     """
     # Запрашиваем PNG с Minotar
-    url = f"https://minotar.net/helm/{user_uuid}/100.png"
     try:
-        resp = requests.get(url, timeout=5)
-    except requests.RequestException as e:
+        resp = outbound.get(avatar_url(user_uuid, size=100), timeout=5)
+    except httpx.HTTPError as e:
         app.logger.error(f"Error fetching avatar for {user_uuid}: {e}")
         return jsonify(error="Internal error fetching avatar"), 500
 
     if resp.status_code == 200:
         # Кодируем бинарный контент в Base64
-        b64 = base64.b64encode(resp.content).decode('ascii')
-        data_uri = f"data:image/png;base64,{b64}"
-        return jsonify(uuid=user_uuid, avatar_base64=data_uri), 200
+        return jsonify(uuid=user_uuid, avatar_base64=to_data_uri(resp.content)), 200
     elif resp.status_code == 404:
         return jsonify(error="Avatar not found"), 404
     else:
         app.logger.warning(f"Unexpected status {resp.status_code} for avatar {user_uuid}")
         return jsonify(error="Error fetching avatar"), resp.status_code
 
-@csrf.exempt
-@app.route("/api/locations/report", methods=["GET","POST"])
-def api_locations_report():
-    if request.method == "GET":
-        return jsonify(message="POST JSON {uuid, x, y, z, client_timestamp (optional, ISO format)} to me"), 200
-
-    data = request.get_json(silent=True)
+def parse_location_report(data):
+    """
+    Проверяет JSON отчёта о позиции игрока.
+    Возвращает (record для player_locations, None) или (None, текст ошибки).
+    """
     if not data:
-        return jsonify({"error": "Invalid or missing JSON"}), 400
+        return None, "Invalid or missing JSON"
 
     player_uuid = data.get("uuid") # Renamed to avoid conflict with uuid module
     x = data.get("x")
@@ -1145,49 +1224,38 @@ def api_locations_report():
     client_timestamp_str = data.get("client_timestamp") # Optional client-provided timestamp
 
     if not all([player_uuid, isinstance(x, int), isinstance(y, int), isinstance(z, int)]):
-        return jsonify({"error": "Fields uuid (string), x (int), y (int), z (int) are required and must be correct types."}), 400
+        return None, "Fields uuid (string), x (int), y (int), z (int) are required and must be correct types."
 
-    client_timestamp = None
+    record = {'uuid': player_uuid, 'x': x, 'y': y, 'z': z}
     if client_timestamp_str:
         try:
             client_timestamp = datetime.fromisoformat(client_timestamp_str.replace('Z', '+00:00'))
         except ValueError:
-            return jsonify({"error": "Invalid client_timestamp format. Please use ISO 8601 format."}), 400
-    
+            return None, "Invalid client_timestamp format. Please use ISO 8601 format."
+        record['client_timestamp'] = client_timestamp.isoformat()
+    # Без client_timestamp Supabase сам проставит created_at, а client_timestamp останется NULL
+    return record, None
+
+
+@csrf.exempt
+@app.route("/api/locations/report", methods=["GET","POST"])
+def api_locations_report():
+    if request.method == "GET":
+        return jsonify(message="POST JSON {uuid, x, y, z, client_timestamp (optional, ISO format)} to me"), 200
+
+    record, error = parse_location_report(request.get_json(silent=True))
+    if error:
+        return jsonify({"error": error}), 400
+
     try:
-        # Insert into Supabase
-        record = {
-            'uuid': player_uuid,
-            'x': x,
-            'y': y,
-            'z': z
-        }
-        if client_timestamp:
-            record['client_timestamp'] = client_timestamp.isoformat()
-        else:
-            # If no client_timestamp, Supabase will use default for created_at
-            # and client_timestamp column will be NULL if not set otherwise in DB schema
-            pass 
-            
-        # Use the Supabase client (db) to insert
-        # Assuming your Supabase client instance is `db` and has an insert method like:
-        # db.client.table('player_locations').insert(record).execute()
-        # The actual method depends on your `supabase_client.py` implementation.
-        # For now, I will assume a generic insert method on your `db` object.
-        # You might need to adjust this part based on your `SupabaseClient` class methods.
-        
-        # Let's assume db.add_player_location(record) or similar exists in supabase_client.py
-        # If not, we would do: db.client.table('player_locations').insert(record).execute()
-        # This requires knowing the structure of your `db` object from `supabase_client.py`
-        # For now, proceeding with the direct table insert approach:
-        response = db.client.table('player_locations').insert(record).execute()
-
-        if response.data:
-            app.logger.info(f"Reported location for {player_uuid}: X:{x} Y:{y} Z:{z} TS:{client_timestamp_str}")
+        if db.add_player_location(record):
+            app.logger.info("Reported location for %s: X:%s Y:%s Z:%s TS:%s",
+                            record['uuid'], record['x'], record['y'], record['z'], record.get('client_timestamp'),
+                            extra={'sample': 'locations.report'})
             return jsonify({"success": True, "message": "Location reported successfully."}), 200
         else:
-            app.logger.error(f"Failed to report location to Supabase: {response.error.message if response.error else 'Unknown error'}")
-            return jsonify({"error": "Failed to store location", "details": response.error.message if response.error else 'Unknown error'}), 500
+            app.logger.error("Failed to report location to Supabase")
+            return jsonify({"error": "Failed to store location", "details": "Unknown error"}), 500
 
     except Exception as e:
         app.logger.error(f"Error in /api/locations/report: {e}", exc_info=True)
@@ -1228,45 +1296,58 @@ def hook():
     
 from flask import request
 
-@app.after_request
-def set_security_headers(response):
-    csp = (
-        "default-src 'self'; "
-        "frame-src 'self' https://*; "
-        "connect-src 'self' https://*.supabase.co wss://*.supabase.co https://api.mojang.com https://api.namemc.com https://minotar.net https://api.minecraftservices.com https://static.cloudflareinsights.com https://cloudflareinsights.com/cdn-cgi/rum; "
-        "img-src 'self' data: https://minotar.net https://avatars.githubusercontent.com; "
-        "media-src 'self' data: blob: https://minotar.net; "
-        "script-src 'self' 'unsafe-inline' https://cdnjs.cloudflare.com https://cdn.jsdelivr.net https://static.cloudflareinsights.com 'unsafe-eval'; "
-        "worker-src 'self' blob:; "
-        "style-src 'self' 'unsafe-inline' https://cdnjs.cloudflare.com https://cdn.jsdelivr.net; "
-        "font-src 'self' data: https://cdnjs.cloudflare.com https://cdn.jsdelivr.net; "
-        "object-src 'none'; "
-        "base-uri 'self'; "
-        "frame-ancestors 'self'; "
-        "upgrade-insecure-requests;"
-    )
-    response.headers['Content-Security-Policy'] = csp
-    response.headers['X-Frame-Options'] = 'SAMEORIGIN'
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
-    response.headers['Permissions-Policy'] = 'geolocation=(), microphone=()'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    response.headers['Cross-Origin-Opener-Policy'] = 'same-origin'
-    response.headers['Cross-Origin-Embedder-Policy'] = 'require-corp'
-
-    if request.headers.get('CF-Visitor'):
-        response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains; preload'
-
-    if request.path.startswith('/static/'):
-        response.headers['Cache-Control'] = 'public, max-age=31536000'
-        response.headers['CF-Cache-Status'] = 'DYNAMIC'
-    elif request.path.startswith('/api/'):
-        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-        response.headers['CF-Cache-Status'] = 'DYNAMIC'
+CONTENT_SECURITY_POLICY = (
+    "default-src 'self'; "
+    "frame-src 'self' https://*; "
+    "connect-src 'self' https://*.supabase.co wss://*.supabase.co https://api.mojang.com https://api.namemc.com https://minotar.net https://api.minecraftservices.com https://static.cloudflareinsights.com https://cloudflareinsights.com/cdn-cgi/rum; "
+    "img-src 'self' data: https://minotar.net https://avatars.githubusercontent.com; "
+    "media-src 'self' data: blob: https://minotar.net; "
+    "script-src 'self' 'unsafe-inline' https://cdnjs.cloudflare.com https://cdn.jsdelivr.net https://static.cloudflareinsights.com 'unsafe-eval'; "
+    "worker-src 'self' blob:; "
+    "style-src 'self' 'unsafe-inline' https://cdnjs.cloudflare.com https://cdn.jsdelivr.net; "
+    "font-src 'self' data: https://cdnjs.cloudflare.com https://cdn.jsdelivr.net; "
+    "object-src 'none'; "
+    "base-uri 'self'; "
+    "frame-ancestors 'self'; "
+    "upgrade-insecure-requests;"
+)
+
+
+def security_headers(path: str, via_cloudflare: bool) -> dict:
+    """Заголовки безопасности и кэширования; общие для Flask и async API (asgi.py)."""
+    headers = {
+        'Content-Security-Policy': CONTENT_SECURITY_POLICY,
+        'X-Frame-Options': 'SAMEORIGIN',
+        'X-Content-Type-Options': 'nosniff',
+        'Referrer-Policy': 'strict-origin-when-cross-origin',
+        'Permissions-Policy': 'geolocation=(), microphone=()',
+        'X-XSS-Protection': '1; mode=block',
+        'Cross-Origin-Opener-Policy': 'same-origin',
+        'Cross-Origin-Embedder-Policy': 'require-corp',
+        'CF-Cache-Status': 'DYNAMIC',
+    }
+    if via_cloudflare:
+        headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains; preload'
+
+    if path.startswith('/static/') and is_fingerprinted(path):
+        headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    elif path.startswith('/static/'):
+        # Без хеша в имени файл может смениться при деплое — долго не кэшируем
+        headers['Cache-Control'] = 'public, max-age=3600'
+    elif path.startswith('/api/') or path == '/sw.js':
+        headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
     else:
-        response.headers['Cache-Control'] = 'public, max-age=3600'
-        response.headers['CF-Cache-Status'] = 'DYNAMIC'
+        headers['Cache-Control'] = 'public, max-age=3600'
+    return headers
 
+
+@app.after_request
+def set_security_headers(response):
+    headers = security_headers(request.path, bool(request.headers.get('CF-Visitor')))
+    if response.cache_control.public and request.path.startswith('/api/'):
+        # API-ответ сам объявил себя кэшируемым (например, /api/uuid/<ник>) — no-store не навязываем
+        headers.pop('Cache-Control')
+    response.headers.update(headers)
     return response
 
 
@@ -1292,6 +1373,11 @@ def format_datetime_filter(value, format='%Y-%m-%d %H:%M:%S'):
 
 app.jinja_env.filters['format_datetime'] = format_datetime_filter
 
+startup.mark('routes')
+# Манифест статики с хешами, asset_url() в шаблонах и отдача .br/.gz по Accept-Encoding
+assets.init_app(app)
+startup.mark('assets')
+
 if __name__ == '__main__':
     # Ensure all required directories exist
     # for directory in ['logs', 'tmp']:
@@ -0,0 +1,31 @@
+"""
+ASGI entry point: the async JSON API (async_api.py) mounted in front of the
+existing Flask app. Everything the async tier does not route falls through to
+Flask unchanged.
+
+    uvicorn asgi:application --workers 2
+
+passenger_wsgi.py keeps serving the plain WSGI app. The warm-up from
+startup.py runs in the lifespan hook, before uvicorn accepts connections.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+import startup
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from app import app as flask_app
+from async_api import routes
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if startup.WARMUP_ENABLED:
+        await asyncio.to_thread(startup.warm_up, flask_app)
+    flask_app.logger.info(startup.summary())
+    yield
+
+
+application = Starlette(routes=[*routes, Mount('/', app=WSGIMiddleware(flask_app))], lifespan=lifespan)
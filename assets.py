@@ -0,0 +1,295 @@
+"""
+Fingerprinted, precompressed static assets.
+
+At startup (or at deploy time via ``python -m assets``) every file under
+static/ gets a content hash, and templates link to ``css/style.<hash>.css``
+through the ``asset_url`` Jinja helper. Hashed URLs are immutable, so they
+can be cached for a year; changing a file changes its URL.
+
+Text assets also get ``.gz`` and, when the ``brotli`` package is installed,
+``.br`` variants written once into ASSETS_CACHE_DIR (content-addressed, so
+they survive restarts). The static view picks a variant by Accept-Encoding;
+nothing is compressed while serving a request.
+
+PNG and ICO images (the icons) get a ``.min`` variant when Pillow is
+installed: the same pixels re-encoded losslessly at maximum zlib effort,
+without metadata, and ICO frames stored as PNG instead of raw bitmaps. It
+is kept only when smaller and is served in place of the original.
+"""
+import gzip
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import re
+import threading
+import struct
+from typing import Dict, List, Optional, Set, Tuple
+
+from flask import Flask, abort, request, send_file, send_from_directory, url_for
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+try:
+    from PIL import Image
+    PILLOW_AVAILABLE = True
+except ImportError:
+    PILLOW_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+HASH_LENGTH = 10
+COMPRESSIBLE = frozenset({'.css', '.js', '.json', '.map', '.svg', '.html', '.txt', '.yaml', '.xml'})
+MIN_COMPRESS_BYTES = 1024
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))  # in order of preference
+RECOMPRESSIBLE = frozenset({'.png', '.ico'})
+OPTIMIZED_SUFFIX = '.min'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+CACHE_DIR = os.getenv('ASSETS_CACHE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '.assets')
+
+_HASHED_RE = re.compile(r'^(?P<stem>.+)\.(?P<digest>[0-9a-f]{%d})(?P<ext>\.[A-Za-z0-9]+)$' % HASH_LENGTH)
+
+
+def hashed_name(filename: str, digest: str) -> str:
+    stem, ext = os.path.splitext(filename)
+    return f'{stem}.{digest[:HASH_LENGTH]}{ext}'
+
+
+def is_fingerprinted(path: str) -> bool:
+    return bool(_HASHED_RE.match(path))
+
+
+# ── Пересжатие картинок без потерь ──
+def _same_pixels(a: 'Image.Image', b: 'Image.Image') -> bool:
+    return a.size == b.size and a.convert('RGBA').tobytes() == b.convert('RGBA').tobytes()
+
+
+def _png(data: bytes) -> bytes:
+    """PNG at maximum zlib effort without metadata; the input back if that is not smaller or not identical."""
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    # Сохраняется только прозрачность: iCCP, tEXt, eXIf, sRGB, gAMA и pHYs не переносятся
+    image.info = {k: v for k, v in image.info.items() if k == 'transparency'}
+    out = io.BytesIO()
+    image.save(out, 'PNG', optimize=True)
+    packed = out.getvalue()
+    if len(packed) >= len(data) or not _same_pixels(image, Image.open(io.BytesIO(packed))):
+        return data
+    return packed
+
+
+def _ico(data: bytes) -> bytes:
+    """ICO with every frame stored as the smallest lossless PNG; frames that do not shrink are kept as they are."""
+    _, kind, count = struct.unpack_from('<HHH', data)
+    entries: List[Tuple[bytes, bytes]] = []  # (первые 8 байт записи каталога, данные кадра)
+    for i in range(count):
+        header = data[6 + 16 * i:14 + 16 * i]
+        size, offset = struct.unpack_from('<II', data, 14 + 16 * i)
+        frame = data[offset:offset + size]
+        if frame.startswith(PNG_SIGNATURE):
+            frame = _png(frame)
+        else:
+            # BMP-кадр: Pillow читает его как ICO из одной записи, без пересчёта размеров
+            bitmap = Image.open(io.BytesIO(struct.pack('<HHH', 0, kind, 1) + header
+                                           + struct.pack('<II', size, 22) + frame))
+            bitmap.load()
+            out = io.BytesIO()
+            bitmap.save(out, 'PNG', optimize=True)
+            packed = out.getvalue()
+            if len(packed) < len(frame) and _same_pixels(bitmap, Image.open(io.BytesIO(packed))):
+                frame = packed
+        entries.append((header, frame))
+    directory, frames = struct.pack('<HHH', 0, kind, count), b''
+    offset = 6 + 16 * count
+    for header, frame in entries:
+        directory += header + struct.pack('<II', len(frame), offset + len(frames))
+        frames += frame
+    return directory + frames
+
+
+def recompress_image(data: bytes, ext: str) -> bytes:
+    """Lossless, metadata-free re-encoding of a PNG or ICO file; never larger than ``data``."""
+    packed = _png(data) if ext == '.png' else _ico(data)
+    return packed if len(packed) < len(data) else data
+
+
+class AssetManifest:
+    def __init__(self, static_folder: str, cache_dir: str = CACHE_DIR):
+        self.static_folder = static_folder
+        self.cache_dir = cache_dir
+        self.files: Dict[str, str] = {}      # logical name -> hashed name
+        self.sources: Dict[str, str] = {}    # hashed name -> logical name
+        self.variants: Dict[str, Set[str]] = {}  # hashed name -> available encodings
+        self.optimized: Set[str] = set()     # hashed names with a .min copy
+        self.version = ''
+
+    def scan(self) -> 'AssetManifest':
+        """Hash every static file; cheap enough to run on each start."""
+        files = {}
+        for root, _, names in os.walk(self.static_folder):
+            for name in names:
+                path = os.path.join(root, name)
+                logical = os.path.relpath(path, self.static_folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    files[logical] = hashed_name(logical, hashlib.sha256(f.read()).hexdigest())
+        self.files = dict(sorted(files.items()))
+        self.sources = {hashed: logical for logical, hashed in self.files.items()}
+        self.version = hashlib.sha256(json.dumps(self.files).encode()).hexdigest()[:HASH_LENGTH]
+        self._find_variants()
+        return self
+
+    def variant_path(self, hashed: str, suffix: str) -> str:
+        return os.path.join(self.cache_dir, hashed + suffix)
+
+    def _find_variants(self) -> None:
+        variants = {}
+        for hashed in self.sources:
+            found = {enc for enc, suffix in ENCODINGS if os.path.exists(self.variant_path(hashed, suffix))}
+            if found:
+                variants[hashed] = found
+        self.variants = variants
+        self.optimized = {hashed for hashed in self.sources
+                          if os.path.exists(self.variant_path(hashed, OPTIMIZED_SUFFIX))}
+
+    def _write_variant(self, hashed: str, suffix: str, data: bytes) -> None:
+        target = self.variant_path(hashed, suffix)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f'{target}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, target)  # атомарно: несколько воркеров могут сжимать одновременно
+
+    def compress(self) -> int:
+        """Write the missing .gz/.br variants; returns how many files were written."""
+        written = 0
+        for logical, hashed in self.files.items():
+            if os.path.splitext(logical)[1].lower() not in COMPRESSIBLE:
+                continue
+            source = os.path.join(self.static_folder, logical)
+            if os.path.getsize(source) < MIN_COMPRESS_BYTES:
+                continue
+            with open(source, 'rb') as f:
+                data = f.read()
+            for encoding, suffix in ENCODINGS:
+                if encoding in self.variants.get(hashed, ()):
+                    continue
+                if encoding == 'br':
+                    if not BROTLI_AVAILABLE:
+                        continue
+                    packed = brotli.compress(data, quality=11)
+                else:
+                    packed = gzip.compress(data, compresslevel=9, mtime=0)
+                if len(packed) >= len(data):
+                    continue
+                self._write_variant(hashed, suffix, packed)
+                self.variants.setdefault(hashed, set()).add(encoding)
+                written += 1
+        return written
+
+    def optimize(self) -> int:
+        """Write the missing .min image variants; returns how many files were written."""
+        if not PILLOW_AVAILABLE:
+            return 0
+        written = 0
+        for logical, hashed in self.files.items():
+            ext = os.path.splitext(logical)[1].lower()
+            if ext not in RECOMPRESSIBLE or hashed in self.optimized:
+                continue
+            with open(os.path.join(self.static_folder, logical), 'rb') as f:
+                data = f.read()
+            try:
+                packed = recompress_image(data, ext)
+            except (OSError, ValueError, struct.error) as e:
+                logger.warning("Could not recompress %s: %s", logical, e)
+                continue
+            if len(packed) >= len(data):
+                continue
+            self._write_variant(hashed, OPTIMIZED_SUFFIX, packed)
+            self.optimized.add(hashed)
+            written += 1
+        return written
+
+    def url_name(self, filename: str) -> str:
+        return self.files.get(filename, filename)
+
+
+manifest: Optional[AssetManifest] = None
+
+
+def asset_url(filename: str, **kwargs) -> str:
+    """Jinja helper: URL of the fingerprinted copy, or the plain static URL for unknown files."""
+    name = manifest.url_name(filename) if manifest else filename
+    return url_for('static', filename=name, **kwargs)
+
+
+def _serve_static(filename: str):
+    logical = manifest.sources.get(filename) if manifest else None
+    if logical is None:
+        # Старые ссылки без хеша продолжают работать, но кэшируются коротко (см. security_headers)
+        return send_from_directory(manifest.static_folder if manifest else '', filename)
+
+    source = os.path.join(manifest.static_folder, logical)
+    for encoding, suffix in ENCODINGS:
+        if encoding in manifest.variants.get(filename, ()) and request.accept_encodings[encoding]:
+            response = send_file(manifest.variant_path(filename, suffix),
+                                 mimetype=mimetypes.guess_type(logical)[0] or 'application/octet-stream',
+                                 conditional=True, etag=True)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        if filename in manifest.optimized:
+            response = send_file(manifest.variant_path(filename, OPTIMIZED_SUFFIX),
+                                 mimetype=mimetypes.guess_type(logical)[0] or 'application/octet-stream',
+                                 conditional=True, etag=True)
+        elif not os.path.isfile(source):
+            abort(404)
+        else:
+            response = send_file(source, conditional=True, etag=True)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app: Flask, compress_in_background: bool = True) -> AssetManifest:
+    global manifest
+    manifest = AssetManifest(app.static_folder).scan()
+    app.jinja_env.globals['asset_url'] = asset_url
+    app.jinja_env.globals['asset_version'] = manifest.version
+    app.view_functions['static'] = _serve_static
+
+    def _compress():
+        try:
+            written = manifest.compress()
+            optimized = manifest.optimize()
+        except OSError as e:
+            # Например, read-only FS на Vercel: отдаём без сжатия, CDN сожмёт сам
+            logger.warning("Static asset compression skipped: %s", e)
+            return
+        if written or optimized:
+            logger.info("Precompressed %d static asset variants, recompressed %d images", written, optimized)
+
+    if compress_in_background:
+        threading.Thread(target=_compress, name='assets-compress', daemon=True).start()
+    else:
+        _compress()
+    return manifest
+
+
+if __name__ == '__main__':
+    # Деплой: python -m assets — сжимает всё заранее, чтобы воркеры стартовали с готовыми вариантами
+    logging.basicConfig(level=logging.INFO)
+    static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    built = AssetManifest(static_dir).scan()
+    count = built.compress()
+    optimized = built.optimize()
+    os.makedirs(built.cache_dir, exist_ok=True)
+    with open(os.path.join(built.cache_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump({'version': built.version, 'files': built.files}, f, indent=2)
+    print(f"{len(built.files)} assets, version {built.version}, {count} new compressed variants"
+          f"{'' if BROTLI_AVAILABLE else ' (brotli not installed: gzip only)'}, {optimized} recompressed images"
+          f"{'' if PILLOW_AVAILABLE else ' (Pillow not installed: images as they are)'}")
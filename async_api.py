@@ -0,0 +1,292 @@
+"""
+Asyncio tier for the public JSON API.
+
+Serves /api/check, /api/fullist, /api/locations/*, /api/player-details
+(single and batch) and /api/avatar without holding a worker per in-flight upstream call: Supabase is
+reached through AsyncSupabaseClient, Mojang/Minotar through the async side of
+the shared outbound pools, and per-player enrichment is fanned out with
+asyncio.gather. Responses match the Flask views one to one; asgi.py mounts
+these routes in front of the Flask app.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+from functools import wraps
+from typing import Optional
+
+import auth
+import httpx
+import invalidation
+import profiles
+import rate_limit
+import reconcile
+import similarity
+from flask_jwt_extended import decode_token
+from starlette.requests import Request
+from starlette.responses import JSONResponse as StarletteJSONResponse, Response
+from starlette.routing import Route
+
+from app import app as flask_app, build_location_rows, parse_location_report, security_headers
+from mojang import aget_name_from_uuid, avatar_url, to_data_uri
+from http_client import outbound
+from json_codec import COMPRESS_MIN_BYTES, compress, dumps, negotiate
+from metrics import REQUEST_SECONDS, REQUESTS_TOTAL, IN_FLIGHT
+from supabase_client import BackendUnavailable, async_db, mirror_age as supabase_mirror_age
+
+logger = logging.getLogger(__name__)
+
+
+class JSONResponse(StarletteJSONResponse):
+    """Сериализация через json_codec (orjson, если установлен) — тот же вывод, что у Flask-вью."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def _compress(request: Request, response: Response) -> Response:
+    """br/gzip для JSON от COMPRESS_MIN_BYTES — как json_codec._compress_response во Flask."""
+    body = getattr(response, 'body', None)
+    if not body or response.media_type != 'application/json' or 'content-encoding' in response.headers:
+        return response
+    response.headers.append('Vary', 'Accept-Encoding')
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    encoding = negotiate(request.headers.get('accept-encoding'))
+    if encoding is None:
+        return response
+    packed = compress(body, encoding)
+    if len(packed) >= len(body):
+        return response
+    response.body = packed
+    response.headers['Content-Length'] = str(len(packed))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _role_from_cookie(request: Request) -> Optional[str]:
+    """Роль из JWT-cookie (те же настройки, что у Flask-JWT-Extended) или None."""
+    token = request.cookies.get(flask_app.config.get('JWT_ACCESS_COOKIE_NAME', 'access_token_cookie'))
+    if not token:
+        return None
+    try:
+        with flask_app.app_context():
+            claims = decode_token(token)
+    except Exception:
+        return None
+    if auth.is_revoked(claims):
+        return None
+    return (claims.get('role') or '').lower()
+
+
+def _conditional(request: Request, response: Response) -> Response:
+    """Слабый ETag по телу и 304 на совпадающий If-None-Match — как conditional_json во Flask."""
+    etag = f'W/"{hashlib.sha1(response.body).hexdigest()}"'
+    if etag in request.headers.get('if-none-match', ''):
+        return Response(status_code=304, headers={'ETag': etag})
+    response.headers['ETag'] = etag
+    return response
+
+
+async def api_check(request: Request) -> JSONResponse:
+    nickname = request.query_params.get('nickname', '').strip()
+    if not nickname:
+        return JSONResponse({'error': 'Параметр nickname обязателен и не может быть пустым'}, status_code=400)
+
+    try:
+        entry = await async_db.get_blacklist_entry(nickname)
+    except BackendUnavailable:
+        return JSONResponse({'error': 'Проверка временно недоступна, попробуйте позже'}, status_code=503)
+    mirror_age = supabase_mirror_age()
+    matched_by = 'nickname'
+    if not entry:
+        entry = await async_db.get_blacklist_entry_by_past_nickname(nickname)
+        matched_by = 'past_nickname'
+    if entry:
+        await asyncio.to_thread(reconcile.enqueue, entry)  # ждёт блокировку очереди — не в event loop
+        payload = {
+            'in_blacklist': True,
+            'nickname': entry['nickname'],
+            'uuid': entry['uuid'],
+            'reason': entry['reason'],
+            'created_at': entry['created_at'],
+            'last_verified_at': entry.get('last_verified_at'),
+            'matched_by': matched_by
+        }
+    else:
+        payload = {'in_blacklist': False}
+    if mirror_age is not None:
+        payload['source'] = 'mirror'
+        payload['mirror_age'] = round(mirror_age)
+    if request.query_params.get('similar', '').lower() in ('1', 'true', 'yes'):
+        # Первый вызов строит индекс запросами к Supabase — не в event loop
+        payload['similar'] = await asyncio.to_thread(
+            similarity.find_similar, nickname, entry['id'] if entry else None)
+    await async_db.add_check_log(check_source='api_check')
+    return JSONResponse(payload)
+
+
+async def api_full_blacklist(request: Request) -> JSONResponse:
+    try:
+        page = int(request.query_params.get('page', 1))
+        per_page = int(request.query_params.get('per_page', 20))
+        search_query = request.query_params.get('q', '').strip().lower()
+
+        if page < 1:
+            page = 1
+        if per_page < 1 or per_page > 100:
+            per_page = 20
+
+        result = await async_db.get_all_blacklist_entries(page=page, per_page=per_page, search=search_query)
+        profiles.enrich_entries(result['items'])
+        return _conditional(request, JSONResponse(result))
+    except Exception as e:
+        logger.error(f"Error in async api_full_blacklist: {e}")
+        return JSONResponse({'error': 'Internal server error', 'message': str(e)}, status_code=500)
+
+
+async def api_locations_view(request: Request) -> JSONResponse:
+    role = _role_from_cookie(request)
+    if role is None:
+        return JSONResponse({'msg': 'Требуется авторизация'}, status_code=403)
+    if role not in ('owner', 'admin'):
+        return JSONResponse({'msg': 'Недостаточно прав'}, status_code=403)
+
+    try:
+        locations_data = await async_db.get_recent_player_locations(limit=100)
+        unique_uuids = list(set(loc['uuid'] for loc in locations_data if loc['uuid']))
+        # Как profiles.details_many: промахи кэша — параллельно, аватарки — URL Minotar
+        names, misses = profiles.lookup_plan(unique_uuids)
+        for player_uuid, name in zip(misses, await asyncio.gather(*(aget_name_from_uuid(u) for u in misses))):
+            names[player_uuid] = name
+        players = {u: profiles.player_details(u, name, profiles.MAP_AVATAR_SIZE) for u, name in names.items()}
+        return JSONResponse(build_location_rows(locations_data, players))
+    except Exception as e:
+        logger.error(f"Unexpected error in async /api/locations/view: {e}", exc_info=True)
+        return JSONResponse({"error": "An unexpected error occurred.", "message": str(e)}, status_code=500)
+
+
+async def api_locations_report(request: Request) -> JSONResponse:
+    if request.method == "GET":
+        return JSONResponse({'message': "POST JSON {uuid, x, y, z, client_timestamp (optional, ISO format)} to me"})
+
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    record, error = parse_location_report(data)
+    if error:
+        return JSONResponse({"error": error}, status_code=400)
+
+    if await async_db.add_player_location(record):
+        logger.info("Reported location for %s: X:%s Y:%s Z:%s TS:%s",
+                    record['uuid'], record['x'], record['y'], record['z'], record.get('client_timestamp'),
+                    extra={'sample': 'locations.report'})
+        return JSONResponse({"success": True, "message": "Location reported successfully."})
+    logger.error("Failed to report location to Supabase")
+    return JSONResponse({"error": "Failed to store location", "details": "Unknown error"}, status_code=500)
+
+
+async def api_player_details(request: Request) -> JSONResponse:
+    player_uuid = request.path_params['player_uuid']
+    if not player_uuid or len(player_uuid.replace('-', '')) != 32:
+        return JSONResponse({'error': "Invalid UUID format"}, status_code=400)
+
+    nickname = await aget_name_from_uuid(player_uuid)
+    if not nickname:
+        return JSONResponse({'error': "Player details not found or UUID invalid"}, status_code=404)
+    return JSONResponse(profiles.player_details(player_uuid, nickname, profiles.MAP_AVATAR_SIZE))
+
+
+async def api_player_details_batch(request: Request) -> JSONResponse:
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    uuids = data.get('uuids') if isinstance(data, dict) else data
+    if not isinstance(uuids, list) or not all(isinstance(u, str) for u in uuids):
+        return JSONResponse({'error': 'Ожидается {"uuids": ["..."]}'}, status_code=400)
+    if len(uuids) > profiles.BATCH_LIMIT:
+        return JSONResponse({'error': f"Не больше {profiles.BATCH_LIMIT} UUID за запрос"}, status_code=400)
+
+    uuids = list(dict.fromkeys(u.strip() for u in uuids if u.strip()))
+    invalid = [u for u in uuids if profiles.normalize_uuid(u) is None]
+    names, misses = profiles.lookup_plan(u for u in uuids if u not in invalid)
+    for player_uuid, name in zip(misses, await asyncio.gather(*(aget_name_from_uuid(u) for u in misses))):
+        names[player_uuid] = name
+    players = {u: profiles.player_details(u, name) for u, name in names.items()}
+    return JSONResponse({'players': players, 'invalid': invalid})
+
+
+async def api_avatar(request: Request) -> JSONResponse:
+    user_uuid = request.path_params['user_uuid']
+    try:
+        resp = await outbound.aget(avatar_url(user_uuid, size=100), timeout=5)
+    except httpx.HTTPError as e:
+        logger.error(f"Error fetching avatar for {user_uuid}: {e}")
+        return JSONResponse({'error': "Internal error fetching avatar"}, status_code=500)
+
+    if resp.status_code == 200:
+        return JSONResponse({'uuid': user_uuid, 'avatar_base64': to_data_uri(resp.content)})
+    elif resp.status_code == 404:
+        return JSONResponse({'error': "Avatar not found"}, status_code=404)
+    logger.warning(f"Unexpected status {resp.status_code} for avatar {user_uuid}")
+    return JSONResponse({'error': "Error fetching avatar"}, status_code=resp.status_code)
+
+
+def _too_many_requests(error: rate_limit.RateLimited) -> JSONResponse:
+    body = {'error': 'Слишком много запросов, попробуйте позже', 'retry_after': error.retry_after}
+    return JSONResponse(body, status_code=429, headers={'Retry-After': str(error.retry_after)})
+
+
+def _with_security_headers(fn, limited: bool = False):
+    """
+    Те же заголовки, метрики и сжатие, что во Flask: set_security_headers / log_request / json_codec.
+    limited=True — то же, что @rate_limited у Flask-вью.
+    """
+    endpoint = f'async.{fn.__name__}'
+
+    @wraps(fn)
+    async def wrapper(request: Request):
+        start = time.perf_counter()
+        IN_FLIGHT.inc()
+        token = None
+        try:
+            # SQLite и обработчики чужих изменений (сброс кэшей, зеркало) — в потоке, не в event loop
+            await asyncio.to_thread(invalidation.poll)
+            if limited and rate_limit.ENABLED:
+                remote_addr = request.client.host if request.client else None
+                token = rate_limit.enter(rate_limit.identify(remote_addr, request.headers))
+            response = await fn(request)
+        except rate_limit.RateLimited as e:
+            response = _too_many_requests(e)
+        except rate_limit.InvalidAPIKey:
+            response = JSONResponse({'error': 'Invalid API key'}, status_code=401)
+        except Exception:
+            # Как handle_unexpected_error во Flask; метрики и заголовки ставятся и на упавший запрос
+            error_id = str(uuid.uuid4())
+            logger.exception(f'Unhandled exception {error_id} in {endpoint} ({request.method} {request.url.path})')
+            response = JSONResponse({'error': 'Internal server error', 'error_id': error_id}, status_code=500)
+        finally:
+            if token is not None:
+                rate_limit.leave(token)
+            IN_FLIGHT.dec()
+        REQUEST_SECONDS.observe((endpoint,), time.perf_counter() - start)
+        REQUESTS_TOTAL.inc((endpoint, response.status_code))
+        response.headers.update(security_headers(request.url.path, bool(request.headers.get('CF-Visitor'))))
+        return _compress(request, response)
+    return wrapper
+
+
+routes = [
+    Route('/api/check', _with_security_headers(api_check, limited=True), methods=['GET']),
+    Route('/api/fullist', _with_security_headers(api_full_blacklist, limited=True), methods=['GET']),
+    Route('/api/locations/view', _with_security_headers(api_locations_view), methods=['GET']),
+    Route('/api/locations/report', _with_security_headers(api_locations_report), methods=['GET', 'POST']),
+    Route('/api/player-details/batch', _with_security_headers(api_player_details_batch, limited=True),
+          methods=['POST']),
+    Route('/api/player-details/{player_uuid}', _with_security_headers(api_player_details, limited=True),
+          methods=['GET']),
+    Route('/api/avatar/{user_uuid}', _with_security_headers(api_avatar, limited=True), methods=['GET']),
+]
@@ -0,0 +1,191 @@
+"""
+Background, batched audit log writer.
+
+Admin views call ``record`` (through app.log_admin_action) and return at once;
+one daemon thread per process collects the records and inserts them into
+audit_log in one request per AUDIT_BATCH_SIZE records, or every
+AUDIT_FLUSH_SECONDS, whichever comes first. The timestamp is taken when the
+action happens, not when it is written.
+
+* Rows stay small: ``details`` is cut to AUDIT_DETAILS_MAX characters.
+  Bulk operations pass ``items`` instead of one text blob covering every
+  entry; each item becomes an audit_log_item row (migrations/005) pointing
+  at its parent, inserted PAGE_ROWS at a time.
+* A batch that fails is put back and retried, up to AUDIT_MAX_ATTEMPTS
+  times. The queue holds at most AUDIT_MAX_PENDING records; beyond that new
+  records are dropped and counted in audit_dropped_total.
+* What is still queued when the process exits is written by an atexit hook.
+
+Records older than AUDIT_RETENTION_DAYS are moved to audit_log_archive by
+``python -m audit`` (run it daily from cron) or by pg_cron, see migrations/006.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from metrics import REGISTRY, Counter, Family
+from supabase_client import db
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '50'))
+FLUSH_SECONDS = float(os.getenv('AUDIT_FLUSH_SECONDS', '2'))
+MAX_PENDING = int(os.getenv('AUDIT_MAX_PENDING', '10000'))
+MAX_ATTEMPTS = int(os.getenv('AUDIT_MAX_ATTEMPTS', '3'))
+DETAILS_MAX = int(os.getenv('AUDIT_DETAILS_MAX', '1000'))
+ITEM_DETAILS_MAX = 300
+RETENTION_DAYS = int(os.getenv('AUDIT_RETENTION_DAYS', '365'))
+
+WRITTEN = Counter('audit_written_total', 'Audit records written to Supabase.', ('kind',))
+DROPPED = Counter('audit_dropped_total', 'Audit records dropped without being written.', ('reason',))
+
+
+def clip(value: Optional[Any], limit: int) -> Optional[str]:
+    if value is None:
+        return None
+    text = str(value)
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+
+class _Pending:
+    __slots__ = ('row', 'items', 'attempts')
+
+    def __init__(self, row: Dict[str, Any], items: List[Dict[str, Any]]):
+        self.row = row
+        self.items = items
+        self.attempts = 0
+
+
+class AuditWriter:
+    """Bounded queue of audit records drained in batches by one daemon thread."""
+
+    def __init__(self, batch_size: int = BATCH_SIZE, flush_seconds: float = FLUSH_SECONDS,
+                 max_pending: int = MAX_PENDING):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self._pending: Deque[_Pending] = deque()
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()  # поток и atexit не пишут одновременно
+        self._worker: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def put(self, row: Dict[str, Any], items: List[Dict[str, Any]]) -> bool:
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                DROPPED.inc(('queue_full',))
+                return False
+            self._pending.append(_Pending(row, items))
+            self._ensure_worker()
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def _ensure_worker(self) -> None:
+        # Поток создаётся при первой записи, уже в процессе воркера (после fork у Passenger)
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._worker.start()
+
+    def _take(self) -> List[_Pending]:
+        batch = []
+        while self._pending and len(batch) < self.batch_size:
+            batch.append(self._pending.popleft())
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._pending) >= self.batch_size, self.flush_seconds)
+            if not self.flush_once():
+                with self._cond:
+                    self._cond.wait(self.flush_seconds)  # Supabase недоступен — не долбим его в цикле
+
+    def flush_once(self) -> bool:
+        """Write one batch; False if it failed and was put back."""
+        with self._write_lock:
+            with self._cond:
+                batch = self._take()
+            if not batch:
+                return True
+            try:
+                inserted = db.add_audit_logs([p.row for p in batch])
+            except Exception as e:
+                logger.error(f"Audit batch failed: {e}")
+                inserted = None
+            if inserted is None or len(inserted) != len(batch):
+                self._put_back(batch)
+                return False
+            WRITTEN.inc(('record',), len(batch))
+            items = []
+            for pending, row in zip(batch, inserted):
+                for position, item in enumerate(pending.items):
+                    items.append({'audit_id': row.get('id'), 'position': position, **item})
+            if items:
+                if db.add_audit_log_items(items):
+                    WRITTEN.inc(('item',), len(items))
+                else:
+                    DROPPED.inc(('item_error',), len(items))  # сама запись с итогом уже есть
+            return True
+
+    def _put_back(self, batch: List[_Pending]) -> None:
+        with self._cond:
+            for pending in reversed(batch):
+                pending.attempts += 1
+                if pending.attempts >= MAX_ATTEMPTS:
+                    DROPPED.inc(('error',))
+                    logger.error("Audit record dropped after %d attempts: %s %s", pending.attempts,
+                                 pending.row.get('action_type'), pending.row.get('target_identifier'))
+                else:
+                    self._pending.appendleft(pending)
+
+    def flush(self) -> None:
+        """Write everything queued now (used at exit)."""
+        while self._pending:
+            if not self.flush_once() and all(p.attempts for p in self._pending):
+                break
+
+
+writer = AuditWriter()
+atexit.register(writer.flush)
+
+
+def record(admin_username: str, action_type: str, target_type: Optional[str] = None,
+           target_identifier: Optional[Any] = None, details: Optional[str] = None,
+           items: Optional[Iterable[Dict[str, Any]]] = None) -> bool:
+    """
+    Queue an audit record. ``items`` are per-entry outcomes of a bulk action,
+    dicts with any of target_identifier, status and details.
+    """
+    row = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'admin_username': admin_username,
+        'action_type': action_type,
+        'target_type': target_type,
+        'target_identifier': clip(target_identifier, 255),
+        'details': clip(details, DETAILS_MAX),
+    }
+    children = [{'target_identifier': clip(item.get('target_identifier'), 255),
+                 'status': clip(item.get('status'), 32),
+                 'details': clip(item.get('details'), ITEM_DETAILS_MAX)}
+                for item in items or ()]
+    return writer.put(row, children)
+
+
+def collect_metrics() -> Iterable[Family]:
+    yield 'audit_queue_size', 'gauge', 'Audit records waiting to be written.', [({}, len(writer))]
+
+
+REGISTRY.add_collector(collect_metrics)
+
+
+if __name__ == '__main__':
+    # Cron: python -m audit — переносит старые записи журнала в audit_log_archive
+    logging.basicConfig(level=logging.INFO)
+    print(f"{db.archive_audit_log(RETENTION_DAYS)} audit records archived (older than {RETENTION_DAYS} days)")
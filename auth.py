@@ -0,0 +1,84 @@
+"""
+Admin session checks.
+
+The JWT cookie is decoded and verified at most once per request:
+``current_claims`` memoizes the result on ``g``, and role_required, the
+template context and the owner checks all read it from there. Without a
+valid token the claims are ``{}``.
+
+Deleted admins are revoked in memory: ``revoke`` records the time, and
+tokens of that user issued before it are rejected by the blocklist loader,
+an O(1) dict lookup with no database call. Deletions made by other worker
+processes arrive through invalidation.py and are revoked the same way; a
+worker started later replays those from the last token lifetime.
+"""
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from flask import Flask, g
+from flask_jwt_extended import JWTManager, get_jwt, verify_jwt_in_request
+
+import invalidation
+
+# username -> когда отозван (UNIX time); токены, выданные не позже, недействительны
+_revoked: Dict[str, float] = {}
+_revoked_lock = threading.Lock()
+
+
+def revoke(username: str, at: Optional[float] = None) -> None:
+    """Invalidate every token issued to ``username`` up to ``at`` (default: now)."""
+    at = time.time() if at is None else at
+    with _revoked_lock:
+        _revoked[username] = max(at, _revoked.get(username, 0))
+
+
+def _on_admin_user_change(op: str, row: Dict[str, Any]) -> None:
+    if op == 'delete' and row.get('username'):
+        revoke(row['username'], row.get('deleted_at'))
+
+
+def is_revoked(claims: Dict[str, Any]) -> bool:
+    revoked_at = _revoked.get(claims.get('sub'))
+    return revoked_at is not None and claims.get('iat', 0) <= revoked_at
+
+
+def verify_request(optional: bool = False) -> Dict[str, Any]:
+    """
+    Claims of the request's token, verified on the first call only. With
+    ``optional=False`` a missing or invalid token raises the flask_jwt_extended
+    error (handled by the app's loaders), as jwt_required() does.
+    """
+    claims: Optional[Dict[str, Any]] = g.get('jwt_claims')
+    if claims is None or (not claims and not optional):
+        try:
+            verify_jwt_in_request(optional=optional)
+            claims = get_jwt() or {}
+        except Exception:
+            if not optional:
+                raise
+            claims = {}
+        g.jwt_claims = claims
+    return claims
+
+
+def current_claims() -> Dict[str, Any]:
+    """Verified claims of the request's token, or {} when there is none."""
+    return verify_request(optional=True)
+
+
+def current_role() -> str:
+    return (current_claims().get('role') or '').lower()
+
+
+def init_app(app: Flask, jwt: JWTManager) -> None:
+    # Токен удалённого админа живёт не дольше JWT_ACCESS_TOKEN_EXPIRES — столько и нужно помнить удаления
+    lifetime = app.config.get('JWT_ACCESS_TOKEN_EXPIRES', timedelta(minutes=15))
+    replay_seconds = lifetime.total_seconds() if isinstance(lifetime, timedelta) else float(lifetime or 0)
+    invalidation.subscribe('admin_users', _on_admin_user_change,
+                           replay_seconds=min(replay_seconds or invalidation.KEEP_SECONDS, invalidation.KEEP_SECONDS))
+
+    @jwt.token_in_blocklist_loader
+    def _token_revoked(jwt_header, jwt_payload) -> bool:
+        return is_revoked(jwt_payload)
@@ -0,0 +1,15 @@
+"""
+Benchmark / load-test suite.
+
+Runs the real Flask app (or the ASGI stack from asgi.py) against in-process
+stand-ins for Supabase PostgREST and Mojang/Minotar, so results depend only
+on our code and on the configured upstream behaviour:
+
+    python -m bench.run                                   # every target, concurrency 1,8,32
+    python -m bench.run --targets check_hit,fullist --concurrency 16 --requests 500
+    python -m bench.run --tier asgi --mojang-latency 80 --mojang-429-after 50
+    python -m bench.compare bench/results/<old>.json bench/results/<new>.json
+
+Each run writes bench/results/<commit>-<timestamp>.json (git-ignored) and
+keeps the mirror and invalidation SQLite files in a temporary directory.
+"""
@@ -0,0 +1,46 @@
+"""
+Compare two bench result files:
+
+    python -m bench.compare bench/results/<old>.json bench/results/<new>.json
+"""
+import json
+import sys
+from typing import Any, Dict, Tuple
+
+
+def _index(report: Dict[str, Any]) -> Dict[Tuple[str, int], Dict[str, Any]]:
+    return {(r['target'], r['concurrency']): r for r in report['results']}
+
+
+def _delta(old: float, new: float) -> str:
+    if not old:
+        return '     n/a'
+    return f'{(new - old) / old * 100:+7.1f}%'
+
+
+def main(argv=None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        sys.exit(__doc__)
+    with open(argv[0], encoding='utf-8') as f:
+        old = json.load(f)
+    with open(argv[1], encoding='utf-8') as f:
+        new = json.load(f)
+
+    print(f"{old['meta']['commit']} -> {new['meta']['commit']}")
+    print(f"{'target':<18} {'c':>3}  {'rps':>17}  {'p95 ms':>17}  {'p99 ms':>17}  {'upstream calls':>17}")
+    old_runs = _index(old)
+    for key, run in _index(new).items():
+        base = old_runs.get(key)
+        if base is None:
+            continue
+        calls = lambda r: sum(u['total_calls'] for u in r['upstream'].values())  # noqa: E731
+        print(f"{key[0]:<18} {key[1]:>3}  "
+              f"{run['throughput_rps'] or 0:>9.1f}{_delta(base['throughput_rps'] or 0, run['throughput_rps'] or 0)}  "
+              f"{run['latency_ms']['p95']:>9.1f}{_delta(base['latency_ms']['p95'], run['latency_ms']['p95'])}  "
+              f"{run['latency_ms']['p99']:>9.1f}{_delta(base['latency_ms']['p99'], run['latency_ms']['p99'])}  "
+              f"{calls(run):>9}{_delta(calls(base), calls(run))}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+"""
+Load generator: drives the app's hot endpoints at fixed concurrencies and
+records throughput, latency percentiles and upstream call counts.
+"""
+import argparse
+import asyncio
+import atexit
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bench.stand_ins import (MojangStandIn, PostgRESTStandIn, UpstreamBehaviour, install,
+                             seed_dataset)
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+# (path, extra kwargs for client.open / httpx.request)
+RequestSpec = Tuple[str, Dict[str, Any]]
+
+
+@dataclass
+class Target:
+    name: str
+    method: str
+    build: Callable[[int], RequestSpec]
+    auth: bool = False
+    max_requests: Optional[int] = None     # update_nicknames walks the whole blacklist per call
+    max_concurrency: Optional[int] = None
+
+
+def _report_body(i: int) -> Dict[str, Any]:
+    return {'uuid': f'{i:032x}', 'x': i % 1000, 'y': 64, 'z': -(i % 1000)}
+
+
+TARGETS = {t.name: t for t in (
+    Target('check_hit', 'GET', lambda i: (f'/api/check?nickname=Player_{i % 400 + 1:05d}', {})),
+    Target('check_miss', 'GET', lambda i: (f'/api/check?nickname=Nobody{i}', {})),
+    Target('uuid_lookup', 'GET', lambda i: (f'/api/uuid/Player_{i % 400 + 1:05d}', {})),
+    Target('uuid_batch', 'POST', lambda i: ('/api/uuid', {'json': {
+        'nicknames': [f'Player_{(i * 20 + k) % 500 + 1:05d}' for k in range(20)]}})),
+    Target('fullist', 'GET', lambda i: (f'/api/fullist?page={i % 5 + 1}&per_page=20', {})),
+    Target('fullist_search', 'GET', lambda i: (f'/api/fullist?q=player_00{i % 10}', {})),
+    Target('player_details_batch', 'POST', lambda i: ('/api/player-details/batch', {'json': {
+        'uuids': [f'{(i * 10 + k) % 100:032x}' for k in range(10)]}})),
+    Target('locations_report', 'POST', lambda i: ('/api/locations/report', {'json': _report_body(i)})),
+    Target('locations_view', 'GET', lambda i: ('/api/locations/view', {}), auth=True),
+    Target('update_nicknames', 'POST', lambda i: ('/admin/update_nicknames', {}), auth=True,
+           max_requests=3, max_concurrency=1),
+)}
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def _summarise(latencies: List[float], statuses: Counter, wall: float) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    ms = lambda v: round(v * 1000, 3)  # noqa: E731
+    return {
+        'requests': len(latencies),
+        'errors': sum(n for code, n in statuses.items() if code >= 500),
+        'status_counts': {str(code): n for code, n in sorted(statuses.items())},
+        'duration_s': round(wall, 4),
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+        'latency_ms': {
+            'p50': ms(_percentile(ordered, 50)),
+            'p95': ms(_percentile(ordered, 95)),
+            'p99': ms(_percentile(ordered, 99)),
+            'mean': ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+            'max': ms(ordered[-1]) if ordered else 0.0,
+        },
+    }
+
+
+def _auth(flask_app) -> Tuple[str, str]:
+    """Owner JWT for the cookie plus its double-submit CSRF value."""
+    from flask_jwt_extended import create_access_token, get_csrf_token
+    with flask_app.app_context():
+        token = create_access_token(identity='bench', additional_claims={'role': 'owner'})
+        return token, get_csrf_token(token)
+
+
+# ─────────────── Драйверы ───────────────
+def _drive_flask(flask_app, target: Target, n: int, concurrency: int, token: Tuple[str, str]):
+    local = threading.local()
+
+    def client():
+        c = getattr(local, 'client', None)
+        if c is None:
+            c = local.client = flask_app.test_client()
+            if target.auth:
+                c.set_cookie('localhost', flask_app.config.get('JWT_ACCESS_COOKIE_NAME', 'access_token_cookie'),
+                             token[0])
+        return c
+
+    def one(i: int) -> Tuple[float, int]:
+        path, kwargs = target.build(i)
+        headers = {'X-CSRF-TOKEN': token[1]} if target.auth else {}
+        start = time.perf_counter()
+        resp = client().open(path, method=target.method, headers=headers, **kwargs)
+        elapsed = time.perf_counter() - start
+        resp.close()
+        return elapsed, resp.status_code
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, range(n)))
+
+
+def _drive_asgi(flask_app, target: Target, n: int, concurrency: int, token: Tuple[str, str]):
+    import httpx
+    from asgi import application
+
+    async def main():
+        sem = asyncio.Semaphore(concurrency)
+        cookies = {flask_app.config.get('JWT_ACCESS_COOKIE_NAME', 'access_token_cookie'): token[0]} \
+            if target.auth else None
+        async with httpx.AsyncClient(app=application, base_url='http://bench.local', cookies=cookies) as client:
+            async def one(i: int) -> Tuple[float, int]:
+                path, kwargs = target.build(i)
+                headers = {'X-CSRF-TOKEN': token[1]} if target.auth else {}
+                async with sem:
+                    start = time.perf_counter()
+                    resp = await client.request(target.method, path, headers=headers, **kwargs)
+                    return time.perf_counter() - start, resp.status_code
+            return await asyncio.gather(*(one(i) for i in range(n)))
+
+    return asyncio.run(main())
+
+
+DRIVERS = {'flask': _drive_flask, 'asgi': _drive_asgi}
+
+
+def _reset_mojang_state(warm: bool, budget: Optional[int]) -> None:
+    import mojang
+    if not warm:
+        mojang._uuid_cache.clear()
+        mojang._name_cache.clear()
+    mojang._call_times.clear()
+    # Реальный лимит 600/10мин заставил бы бенчмарк спать минутами; по умолчанию он снят.
+    mojang._MAX_CALLS = budget if budget is not None else 10 ** 9
+
+
+def _isolate_state() -> str:
+    """
+    Point the mirror and the invalidation bus at a fresh temporary directory,
+    so a run neither reads nor leaves behind the app's own SQLite files. Must
+    happen before the app is imported: both modules read their paths then.
+    """
+    state_dir = tempfile.mkdtemp(prefix='bench-state-')
+    os.environ['MIRROR_DB'] = os.path.join(state_dir, 'blacklist_mirror.sqlite3')
+    os.environ['INVALIDATION_DB'] = os.path.join(state_dir, 'blacklist_invalidation.sqlite3')
+    atexit.register(shutil.rmtree, state_dir, ignore_errors=True)
+    return state_dir
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    _isolate_state()
+    from app import app as flask_app
+    flask_app.config['WTF_CSRF_ENABLED'] = False  # формы в бенче не рендерятся, токен взять неоткуда
+    import rate_limit
+    rate_limit.ENABLED = args.rate_limit  # весь бенч идёт с одного IP и упёрся бы в лимит
+    logging.getLogger().setLevel(args.log_level)
+    flask_app.logger.setLevel(args.log_level)
+    token = _auth(flask_app)
+    drive = DRIVERS[args.tier]
+
+    supabase_behaviour = UpstreamBehaviour(
+        latency_ms=args.supabase_latency, jitter_ms=args.supabase_latency * args.jitter,
+        error_rate=args.supabase_error_rate,
+    )
+    mojang_behaviour = UpstreamBehaviour(
+        latency_ms=args.mojang_latency, jitter_ms=args.mojang_latency * args.jitter,
+        error_rate=args.mojang_error_rate, rate_limit=args.mojang_429_after,
+        retry_after=args.mojang_retry_after,
+    )
+
+    results = []
+    for name in args.targets:
+        target = TARGETS[name]
+        n = min(args.requests, target.max_requests or args.requests)
+        levels = sorted({min(c, target.max_concurrency or c) for c in args.concurrency})
+        for concurrency in levels:
+            # Свежие данные и счётчики на каждый прогон, чтобы прогоны не влияли друг на друга
+            tables, players = seed_dataset(args.entries, args.locations, seed=args.seed)
+            supabase = PostgRESTStandIn(tables, supabase_behaviour, seed=args.seed)
+            mojang_stand_in = MojangStandIn(players, mojang_behaviour, seed=args.seed)
+            install(supabase, mojang_stand_in)
+            _reset_mojang_state(args.warm, args.mojang_budget)
+            rate_limit.buckets.clear()
+
+            start = time.perf_counter()
+            samples = drive(flask_app, target, n, concurrency, token)
+            wall = time.perf_counter() - start
+
+            summary = _summarise([s[0] for s in samples], Counter(s[1] for s in samples), wall)
+            summary.update({
+                'target': name, 'concurrency': concurrency,
+                'upstream': {'supabase': supabase.stats(), 'mojang': mojang_stand_in.stats()},
+            })
+            results.append(summary)
+            lat = summary['latency_ms']
+            print(f"{name:<18} c={concurrency:<3} n={n:<5} {summary['throughput_rps'] or 0:>9.1f} rps  "
+                  f"p50={lat['p50']:.1f} p95={lat['p95']:.1f} p99={lat['p99']:.1f} ms  "
+                  f"supabase={supabase.stats()['total_calls']} mojang={mojang_stand_in.stats()['total_calls']}")
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'tier': args.tier,
+            'warm_cache': args.warm,
+            'rate_limit': args.rate_limit,
+            'dataset': {'entries': args.entries, 'locations': args.locations, 'seed': args.seed},
+            'upstreams': {'supabase': asdict(supabase_behaviour), 'mojang': asdict(mojang_behaviour)},
+        },
+        'results': results,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(',') if v]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--targets', type=lambda v: v.split(','), default=list(TARGETS),
+                        help=f"comma-separated, from: {', '.join(TARGETS)}")
+    parser.add_argument('--concurrency', type=_int_list, default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=200, help='requests per target and concurrency level')
+    parser.add_argument('--tier', choices=sorted(DRIVERS), default='flask')
+    parser.add_argument('--entries', type=int, default=500, help='blacklist rows in the stand-in')
+    parser.add_argument('--locations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--warm', action='store_true', help='keep Mojang caches between runs')
+    parser.add_argument('--jitter', type=float, default=0.2, help='latency jitter as a share of latency')
+    parser.add_argument('--supabase-latency', type=float, default=15.0, metavar='MS')
+    parser.add_argument('--supabase-error-rate', type=float, default=0.0)
+    parser.add_argument('--mojang-latency', type=float, default=60.0, metavar='MS')
+    parser.add_argument('--mojang-error-rate', type=float, default=0.0)
+    parser.add_argument('--mojang-429-after', type=int, default=None, metavar='N',
+                        help='answer 429 once N calls land within one second')
+    parser.add_argument('--mojang-retry-after', type=float, default=1.0)
+    parser.add_argument('--mojang-budget', type=int, default=None,
+                        help='apply mojang.py call budget (default: unlimited)')
+    parser.add_argument('--rate-limit', action='store_true',
+                        help='keep per-client rate limits on (all bench traffic shares one IP)')
+    parser.add_argument('--log-level', default='WARNING', help='app log level during the run')
+    parser.add_argument('--out', default=None, help='result file (default: bench/results/<commit>-<ts>.json)')
+    args = parser.parse_args(argv)
+
+    unknown = [t for t in args.targets if t not in TARGETS]
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(unknown)}")
+
+    report = run(args)
+    out = args.out or os.path.join(
+        RESULTS_DIR, f"{report['meta']['commit']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {out}")
+
+
+if __name__ == '__main__':
+    main()
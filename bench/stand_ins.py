@@ -0,0 +1,351 @@
+"""
+In-process stand-ins for the upstreams the app talks to.
+
+Both stand-ins are httpx transports, so they plug straight into the shared
+outbound router (``outbound.override_host``) and the real SupabaseClient,
+AsyncSupabaseClient and mojang.py code paths run unchanged against them.
+Each one has an ``UpstreamBehaviour`` (latency, jitter, error rate, 429s)
+and counts every call it serves.
+"""
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import uuid as uuid_lib
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from config import SUPABASE_URL
+from http_client import outbound
+
+MOJANG_HOSTS = ('api.mojang.com', 'api.minecraftservices.com', 'minotar.net')
+
+# 1x1 transparent PNG, enough for to_data_uri()
+_PNG = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c63000100000500010d0a2db40000000049454e44ae426082'
+)
+
+
+@dataclass
+class UpstreamBehaviour:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0          # share of calls answered with error_status
+    error_status: int = 503
+    rate_limit: Optional[int] = None  # calls allowed per rate_limit_window before 429
+    rate_limit_window: float = 1.0
+    retry_after: float = 1.0
+
+
+class StandIn(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """Common latency / error / 429 handling; subclasses implement ``respond``."""
+
+    name = 'stand-in'
+
+    def __init__(self, behaviour: Optional[UpstreamBehaviour] = None, seed: int = 0):
+        self.behaviour = behaviour or UpstreamBehaviour()
+        self.calls: Counter = Counter()
+        self.injected: Counter = Counter()
+        self._random = random.Random(seed)
+        self._window: List[float] = []
+        self._lock = threading.Lock()
+
+    def respond(self, request: httpx.Request) -> Tuple[int, Dict[str, str], Any]:
+        raise NotImplementedError
+
+    def route(self, request: httpx.Request) -> str:
+        return request.url.path
+
+    def _gate(self, request: httpx.Request) -> Tuple[float, Optional[httpx.Response]]:
+        """Counts the call and decides latency and whether to inject a failure."""
+        b = self.behaviour
+        with self._lock:
+            self.calls[f'{request.method} {self.route(request)}'] += 1
+            delay = max(0.0, b.latency_ms + self._random.uniform(-b.jitter_ms, b.jitter_ms)) / 1000
+            if b.rate_limit is not None:
+                now = time.monotonic()
+                self._window = [t for t in self._window if t > now - b.rate_limit_window]
+                if len(self._window) >= b.rate_limit:
+                    self.injected['429'] += 1
+                    return delay, httpx.Response(429, headers={'Retry-After': str(b.retry_after)})
+                self._window.append(now)
+            if b.error_rate and self._random.random() < b.error_rate:
+                self.injected[str(b.error_status)] += 1
+                return delay, httpx.Response(b.error_status, json={'message': 'injected failure'})
+        return delay, None
+
+    def _build(self, request: httpx.Request) -> httpx.Response:
+        status, headers, body = self.respond(request)
+        if isinstance(body, bytes):
+            return httpx.Response(status, headers=headers, content=body)
+        return httpx.Response(status, headers=headers, json=body)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        delay, failure = self._gate(request)
+        if delay:
+            time.sleep(delay)
+        return failure or self._build(request)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        delay, failure = self._gate(request)
+        if delay:
+            await asyncio.sleep(delay)
+        return failure or self._build(request)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'calls': dict(self.calls), 'total_calls': sum(self.calls.values()),
+                'injected': dict(self.injected)}
+
+
+# ─────────────── PostgREST ───────────────
+def _like_to_regex(pattern: str, ignore_case: bool) -> 're.Pattern':
+    # Те же правила, что у Postgres: % — любая строка, _ — любой один символ, \ экранирует следующий
+    parts = []
+    escaped = False
+    for ch in pattern:
+        if escaped or ch not in '%_\\':
+            parts.append(re.escape(ch))
+            escaped = False
+        elif ch == '\\':
+            escaped = True
+        else:
+            parts.append('.*' if ch == '%' else '.')
+    return re.compile(''.join(parts), (re.IGNORECASE if ignore_case else 0) | re.DOTALL)
+
+
+def _compare(value: Any, op: str, arg: str) -> bool:
+    if op == 'is':
+        return value is None if arg == 'null' else str(value).lower() == arg
+    if value is None:
+        return op == 'neq'
+    text = str(value).lower() if isinstance(value, bool) else str(value)
+    if op == 'eq':
+        return text == arg
+    if op == 'neq':
+        return text != arg
+    if op in ('ilike', 'like'):
+        return bool(_like_to_regex(arg.replace('*', '%'), op == 'ilike').fullmatch(text))
+    if op == 'in':
+        return text in [v.strip('"') for v in arg.strip('()').split(',')]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        other: Any = float(arg)
+        value = float(value)
+    else:
+        value, other = text, arg
+    return {'gt': value > other, 'gte': value >= other, 'lt': value < other, 'lte': value <= other}.get(op, False)
+
+
+def _split_or(expr: str) -> List[str]:
+    """'(a.ilike.%x%,b.ilike.%x%)' -> ['a.ilike.%x%', 'b.ilike.%x%']"""
+    return [part for part in expr.strip('()').split(',') if part]
+
+
+class PostgRESTStandIn(StandIn):
+    """Just enough of PostgREST for what SupabaseClient sends: filters, or=, order, Range, count=, CRUD."""
+
+    name = 'supabase'
+    _RESERVED = frozenset({'select', 'order', 'limit', 'offset', 'or', 'columns', 'on_conflict'})
+
+    def __init__(self, tables: Dict[str, List[Dict[str, Any]]], behaviour: Optional[UpstreamBehaviour] = None,
+                 seed: int = 0):
+        super().__init__(behaviour, seed)
+        self.tables = tables
+        self._ids = {name: max((row.get('id', 0) or 0 for row in rows), default=0) for name, rows in tables.items()}
+        self._data_lock = threading.Lock()
+
+    def route(self, request: httpx.Request) -> str:
+        return request.url.path.rsplit('/', 1)[-1]
+
+    def _matches(self, row: Dict[str, Any], params: List[Tuple[str, str]]) -> bool:
+        for key, value in params:
+            if key in self._RESERVED:
+                if key == 'or':
+                    if not any(self._matches(row, [tuple(part.split('.', 1))]) for part in _split_or(value)):
+                        return False
+                continue
+            negate = value.startswith('not.')
+            op, _, arg = value[4 if negate else 0:].partition('.')
+            if _compare(row.get(key), op, arg) == negate:
+                return False
+        return True
+
+    @staticmethod
+    def _project(row: Dict[str, Any], select: str) -> Dict[str, Any]:
+        if not select or select == '*':
+            return dict(row)
+        return {col.strip(): row.get(col.strip()) for col in select.split(',')}
+
+    @staticmethod
+    def _sort(rows: List[Dict[str, Any]], order: str) -> List[Dict[str, Any]]:
+        for clause in reversed(order.split(',')):
+            col, *mods = clause.split('.')
+            desc = 'desc' in mods
+            rows.sort(key=lambda r: (r.get(col) is None, r.get(col) if r.get(col) is not None else ''),
+                      reverse=desc)
+        return rows
+
+    def respond(self, request: httpx.Request) -> Tuple[int, Dict[str, str], Any]:
+        table = self.route(request)
+        if '/rpc/' in request.url.path:
+            handler = getattr(self, f'_rpc_{table}', None)
+            if handler is None:
+                return 404, {}, {'message': f'function {table} not found in stand-in'}
+            with self._data_lock:
+                return 200, {}, handler(json.loads(request.content or b'{}'))
+        params = list(request.url.params.multi_items())
+        with self._data_lock:
+            rows = self.tables.setdefault(table, [])
+            if request.method == 'GET':
+                return self._select(request, rows, params)
+            if request.method == 'POST':
+                body = json.loads(request.content or b'[]')
+                conflict = dict(params).get('on_conflict')
+                if conflict and 'resolution=ignore-duplicates' in request.headers.get('Prefer', ''):
+                    body = self._drop_conflicting(rows, body, conflict.split(','))
+                return self._insert(table, rows, body)
+            matched = [row for row in rows if self._matches(row, params)]
+            if request.method == 'PATCH':
+                changes = json.loads(request.content or b'{}')
+                for row in matched:
+                    row.update(changes)
+                return 200, {}, [dict(row) for row in matched]
+            if request.method == 'DELETE':
+                self.tables[table] = [row for row in rows if row not in matched]
+                return 200, {}, matched
+        return 405, {}, {'message': 'method not supported by stand-in'}
+
+    def _select(self, request: httpx.Request, rows: List[Dict[str, Any]], params: List[Tuple[str, str]]):
+        query = dict(params)
+        result = [row for row in rows if self._matches(row, params)]
+        if 'order' in query:
+            result = self._sort(result, query['order'])
+        total = len(result)
+        start = int(query.get('offset', 0))
+        end = start + int(query['limit']) if 'limit' in query else total
+        range_header = request.headers.get('Range')
+        if range_header:
+            lo, _, hi = range_header.partition('-')
+            start, end = int(lo), int(hi) + 1
+        page = [self._project(row, query.get('select', '*')) for row in result[start:end]]
+        headers = {}
+        if 'count=' in request.headers.get('Prefer', ''):
+            last = start + len(page) - 1
+            headers['Content-Range'] = f'{start}-{last}/{total}' if page else f'*/{total}'
+        return 200, headers, page
+
+    @staticmethod
+    def _drop_conflicting(rows: List[Dict[str, Any]], body: Any, columns: List[str]) -> List[Dict[str, Any]]:
+        """Upsert with ignore-duplicates: records that clash with an existing row on ``columns`` are skipped."""
+        existing = {tuple(row.get(c) for c in columns) for row in rows}
+        return [r for r in (body if isinstance(body, list) else [body])
+                if tuple(r.get(c) for c in columns) not in existing]
+
+    def _insert(self, table: str, rows: List[Dict[str, Any]], body: Any):
+        inserted = []
+        for record in body if isinstance(body, list) else [body]:
+            self._ids[table] = self._ids.get(table, 0) + 1
+            row = {'id': self._ids[table], 'created_at': datetime.utcnow().isoformat(), **record}
+            rows.append(row)
+            inserted.append(dict(row))
+        return 201, {}, inserted
+
+    def _rpc_add_or_reject_blacklist_entry(self, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Same outcome as the SQL function (migrations/001, 002)."""
+        return [self._add_or_reject(args)]
+
+    def _add_or_reject(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        rows = self.tables.setdefault('blacklist_entry', [])
+        for conflict, column, value in (('nickname', 'nickname_key', args['p_nickname'].lower()),
+                                        ('uuid', 'uuid', args['p_uuid'].replace('-', '').lower())):
+            for row in rows:
+                if str(row.get(column, '')).replace('-', '').lower() == value:
+                    return {'status': 'exists', 'conflict': conflict, 'entry': dict(row)}
+        _, _, inserted = self._insert('blacklist_entry', rows, {
+            'nickname': args['p_nickname'], 'nickname_key': args['p_nickname'].lower(),
+            'uuid': args['p_uuid'], 'reason': args['p_reason']})
+        if args.get('p_admin_username'):
+            self._insert('audit_log', self.tables.setdefault('audit_log', []), {
+                'admin_username': args['p_admin_username'], 'action_type': 'ADD_BLACKLIST',
+                'target_type': 'blacklist_entry', 'target_identifier': args['p_nickname'],
+                'details': f"UUID: {args['p_uuid']}, Reason: {args['p_reason']}"})
+        return {'status': 'added', 'conflict': None, 'entry': inserted[0]}
+
+
+# ─────────────── Mojang / Minecraft Services / Minotar ───────────────
+class MojangStandIn(StandIn):
+    """Serves profile lookups by name and by UUID plus Minotar helms for a fixed set of players."""
+
+    name = 'mojang'
+
+    def __init__(self, players: Dict[str, str], behaviour: Optional[UpstreamBehaviour] = None, seed: int = 0):
+        super().__init__(behaviour, seed)
+        self.by_uuid = {u.replace('-', ''): name for u, name in players.items()}
+        self.by_name = {name.lower(): u for u, name in self.by_uuid.items()}
+
+    def route(self, request: httpx.Request) -> str:
+        # api.mojang.com/users/profiles/minecraft/<name> -> api.mojang.com/users/profiles/minecraft
+        return f'{request.url.host}{request.url.path.rsplit("/", 1)[0]}'
+
+    def respond(self, request: httpx.Request) -> Tuple[int, Dict[str, str], Any]:
+        host, path = request.url.host, request.url.path
+        key = path.rstrip('/').rsplit('/', 1)[-1]
+        if host == 'api.mojang.com':
+            u = self.by_name.get(key.lower())
+            return (200, {}, {'id': u, 'name': self.by_uuid[u]}) if u else (404, {}, {})
+        if host == 'api.minecraftservices.com' and request.method == 'POST':  # lookup/bulk/byname
+            found = ((self.by_name.get(n.lower()), n) for n in json.loads(request.content or b'[]'))
+            return 200, {}, [{'id': u, 'name': self.by_uuid[u]} for u, _ in found if u]
+        if host == 'api.minecraftservices.com':
+            name = self.by_uuid.get(key.replace('-', ''))
+            return (200, {}, {'id': key, 'name': name}) if name else (404, {}, {})
+        if host == 'minotar.net':
+            return 200, {'Content-Type': 'image/png'}, _PNG
+        return 404, {}, {}
+
+
+# ─────────────── Данные и подключение ───────────────
+def seed_dataset(entries: int = 500, locations: int = 200, seed: int = 0) -> Tuple[Dict[str, List[dict]], Dict[str, str]]:
+    """Deterministic tables for the PostgREST stand-in and the matching Mojang player set."""
+    rnd = random.Random(seed)
+    now = datetime.utcnow()
+    players = {}
+    blacklist = []
+    for i in range(1, entries + 1):
+        u = uuid_lib.UUID(int=rnd.getrandbits(128)).hex
+        nickname = f'Player_{i:05d}'
+        # каждый десятый игрок сменил ник — update_nicknames найдёт что обновить
+        players[u] = nickname if i % 10 else f'Renamed_{i:05d}'
+        blacklist.append({
+            'id': i, 'nickname': nickname, 'nickname_key': nickname.lower(), 'uuid': u, 'reason': f'reason #{i % 7}',
+            'created_at': (now - timedelta(minutes=i)).isoformat(),
+        })
+    uuids = list(players)
+    player_locations = [{
+        'id': i, 'uuid': rnd.choice(uuids[:25]),
+        'x': rnd.randint(-1000, 1000), 'y': rnd.randint(0, 255), 'z': rnd.randint(-1000, 1000),
+        'client_timestamp': None, 'created_at': (now - timedelta(seconds=i * 10)).isoformat(),
+    } for i in range(1, locations + 1)]
+    tables = {
+        'blacklist_entry': blacklist,
+        'player_locations': player_locations,
+        'check_log': [],
+        'audit_log': [],
+        'admin_user': [{'id': 1, 'username': 'bench', 'password_hash': '', 'role': 'owner'}],
+        'whitelist_players': [],
+    }
+    return tables, players
+
+
+def install(supabase: PostgRESTStandIn, mojang: MojangStandIn) -> None:
+    """Point the shared outbound router at the stand-ins (sync and async pools)."""
+    outbound.override_host(urlsplit(SUPABASE_URL).hostname, supabase)
+    for host in MOJANG_HOSTS:
+        outbound.override_host(host, mojang)
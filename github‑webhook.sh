@@ -13,8 +13,17 @@ git pull origin main >> /var/www/u3085459/data/www/sosmark.ru/webhook.log 2>&1
 source /var/www/u3085459/data/flaskenv/bin/activate
 pip install -r requirements.txt >> /var/www/u3085459/data/www/sosmark.ru/webhook.log 2>&1
 
+# Fingerprint and precompress static assets before workers start
+python -m assets >> /var/www/u3085459/data/www/sosmark.ru/webhook.log 2>&1
+
+# nickname_key for blacklist rows written by the old workers during the deploy (migrations/002)
+python -m supabase_client >> /var/www/u3085459/data/www/sosmark.ru/webhook.log 2>&1 || true
+
 # Restart the application (adjust this based on your setup)
 touch /var/www/u3085459/data/www/sosmark.ru/tmp/restart.txt
 
+# Spawn the new Passenger worker (and run its warm-up) now rather than on the first visitor's request
+curl -s -o /dev/null --max-time 60 https://sosmark.ru/ >> /var/www/u3085459/data/www/sosmark.ru/webhook.log 2>&1 || true
+
 # Log completion
 echo "[$(date)] Deployment completed" >> /var/www/u3085459/data/www/sosmark.ru/webhook.log
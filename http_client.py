@@ -0,0 +1,289 @@
+"""
+Shared outbound HTTP layer.
+
+Every upstream call (Supabase PostgREST, Mojang, Minecraft Services, Minotar)
+goes through one router transport that keeps a separate keep-alive pool per
+host. Pools are sized and timed per host via ``HOST_PROFILES`` and speak
+HTTP/2 when the ``h2`` package is installed. The async API tier gets the same
+per-host pools on its event loop through ``arequest``/``aget``.
+"""
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Mapping, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from config import SUPABASE_URL
+from metrics import REGISTRY, UPSTREAM_SECONDS
+
+try:
+    import h2  # noqa: F401  (only needed to enable HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class HostProfile:
+    max_connections: int = 10
+    max_keepalive: int = 5
+    keepalive_expiry: float = 60.0
+    timeout: float = 5.0
+
+
+DEFAULT_PROFILE = HostProfile()
+
+HOST_PROFILES: Dict[str, HostProfile] = {
+    # Every request path talks to Supabase, keep the largest warm pool here.
+    urlsplit(SUPABASE_URL).hostname: HostProfile(max_connections=32, max_keepalive=16, timeout=10.0),
+    'api.mojang.com': HostProfile(max_connections=8, max_keepalive=4, timeout=5.0),
+    'api.minecraftservices.com': HostProfile(max_connections=8, max_keepalive=4, timeout=5.0),
+    'minotar.net': HostProfile(max_connections=16, max_keepalive=8, timeout=3.0),
+}
+
+# Same policy the old requests adapter used: retry 5xx with exponential backoff.
+RETRY_STATUSES = frozenset({500, 502, 503, 504})
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 1.0
+
+
+class HostStats:
+    """Connection reuse counters for a single upstream host."""
+    __slots__ = ('host', 'requests', 'connects', 'tls_handshakes', 'errors', '_lock')
+
+    def __init__(self, host: str):
+        self.host = host
+        self.requests = 0
+        self.connects = 0
+        self.tls_handshakes = 0
+        self.errors = 0
+        self._lock = threading.Lock()  # += из потоков запросов и event loop — без блокировки инкременты теряются
+
+    def add(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            requests, connects, tls_handshakes, errors = self.requests, self.connects, self.tls_handshakes, self.errors
+        reused = max(requests - connects, 0)
+        return {
+            'requests': requests,
+            'connects': connects,
+            'tls_handshakes': tls_handshakes,
+            'errors': errors,
+            'reuse_ratio': round(reused / requests, 4) if requests else None,
+        }
+
+
+class _HostTransport(httpx.HTTPTransport):
+    """Keep-alive pool for one host that records new connections via httpcore tracing."""
+
+    def __init__(self, stats: HostStats, profile: HostProfile):
+        super().__init__(
+            http2=HTTP2_AVAILABLE,
+            retries=1,  # connect errors only; status retries live in OutboundHTTP.request
+            limits=httpx.Limits(
+                max_connections=profile.max_connections,
+                max_keepalive_connections=profile.max_keepalive,
+                keepalive_expiry=profile.keepalive_expiry,
+            ),
+        )
+        self._stats = stats
+        self._labels = (stats.host, 'http')
+
+    def _trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        if event_name == 'connection.connect_tcp.complete':
+            self._stats.add('connects')
+        elif event_name == 'connection.start_tls.complete':
+            self._stats.add('tls_handshakes')
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self._stats.add('requests')
+        request.extensions['trace'] = self._trace
+        start = time.perf_counter()
+        try:
+            return super().handle_request(request)
+        except httpx.TransportError:
+            self._stats.add('errors')
+            raise
+        finally:
+            UPSTREAM_SECONDS.observe(self._labels, time.perf_counter() - start)
+
+
+class _AsyncHostTransport(httpx.AsyncHTTPTransport):
+    """Async twin of _HostTransport; httpcore awaits trace callbacks on this side."""
+
+    def __init__(self, stats: HostStats, profile: HostProfile):
+        super().__init__(
+            http2=HTTP2_AVAILABLE,
+            retries=1,
+            limits=httpx.Limits(
+                max_connections=profile.max_connections,
+                max_keepalive_connections=profile.max_keepalive,
+                keepalive_expiry=profile.keepalive_expiry,
+            ),
+        )
+        self._stats = stats
+        self._labels = (stats.host, 'http')
+
+    async def _trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        if event_name == 'connection.connect_tcp.complete':
+            self._stats.add('connects')
+        elif event_name == 'connection.start_tls.complete':
+            self._stats.add('tls_handshakes')
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self._stats.add('requests')
+        request.extensions['trace'] = self._trace
+        start = time.perf_counter()
+        try:
+            return await super().handle_async_request(request)
+        except httpx.TransportError:
+            self._stats.add('errors')
+            raise
+        finally:
+            UPSTREAM_SECONDS.observe(self._labels, time.perf_counter() - start)
+
+
+class _HostRouter(httpx.BaseTransport):
+    """Dispatches each request to the pool of its target host, creating pools lazily."""
+
+    def __init__(self, owner: 'OutboundHTTP'):
+        self._owner = owner
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        return self._owner.transport_for(request.url.host).handle_request(request)
+
+    def close(self) -> None:
+        self._owner.close_pools()
+
+
+class _AsyncHostRouter(httpx.AsyncBaseTransport):
+    def __init__(self, owner: 'OutboundHTTP'):
+        self._owner = owner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._owner.async_transport_for(request.url.host).handle_async_request(request)
+
+
+class OutboundHTTP:
+    def __init__(self, profiles: Mapping[str, HostProfile], default: HostProfile = DEFAULT_PROFILE):
+        self._profiles = dict(profiles)
+        self._default = default
+        self._transports: Dict[str, _HostTransport] = {}
+        self._async_transports: Dict[str, _AsyncHostTransport] = {}
+        self._stats: Dict[str, HostStats] = {}
+        self._lock = threading.Lock()
+        self.router = _HostRouter(self)
+        self.async_router = _AsyncHostRouter(self)
+        self.client = httpx.Client(transport=self.router, follow_redirects=True)
+        self.async_client = httpx.AsyncClient(transport=self.async_router, follow_redirects=True)
+
+    def profile(self, host: Optional[str]) -> HostProfile:
+        return self._profiles.get(host or '', self._default)
+
+    def transport_for(self, host: str) -> _HostTransport:
+        transport = self._transports.get(host)
+        if transport is None:
+            with self._lock:
+                transport = self._transports.get(host)
+                if transport is None:
+                    stats = self._stats.setdefault(host, HostStats(host))
+                    transport = _HostTransport(stats, self.profile(host))
+                    self._transports[host] = transport
+        return transport
+
+    def async_transport_for(self, host: str) -> _AsyncHostTransport:
+        transport = self._async_transports.get(host)
+        if transport is None:
+            with self._lock:
+                transport = self._async_transports.get(host)
+                if transport is None:
+                    stats = self._stats.setdefault(host, HostStats(host))
+                    transport = _AsyncHostTransport(stats, self.profile(host))
+                    self._async_transports[host] = transport
+        return transport
+
+    def override_host(self, host: str, transport: httpx.BaseTransport,
+                      async_transport: Optional[httpx.AsyncBaseTransport] = None) -> None:
+        """Route a host to a custom transport instead of a real pool (used by the bench stand-ins)."""
+        with self._lock:
+            self._transports[host] = transport
+            self._async_transports[host] = async_transport or transport
+
+    def request(self, method: str, url: str, *, timeout: Optional[float] = None,
+                retries: int = MAX_RETRIES, **kwargs) -> httpx.Response:
+        if timeout is None:
+            timeout = self.profile(urlsplit(url).hostname).timeout
+        attempt = 0
+        while True:
+            resp = self.client.request(method, url, timeout=timeout, **kwargs)
+            if resp.status_code not in RETRY_STATUSES or attempt >= retries:
+                return resp
+            resp.close()
+            time.sleep(BACKOFF_FACTOR * (2 ** attempt))
+            attempt += 1
+
+    def get(self, url: str, **kwargs) -> httpx.Response:
+        return self.request('GET', url, **kwargs)
+
+    async def arequest(self, method: str, url: str, *, timeout: Optional[float] = None,
+                       retries: int = MAX_RETRIES, **kwargs) -> httpx.Response:
+        if timeout is None:
+            timeout = self.profile(urlsplit(url).hostname).timeout
+        attempt = 0
+        while True:
+            resp = await self.async_client.request(method, url, timeout=timeout, **kwargs)
+            if resp.status_code not in RETRY_STATUSES or attempt >= retries:
+                return resp
+            await resp.aclose()
+            await asyncio.sleep(BACKOFF_FACTOR * (2 ** attempt))
+            attempt += 1
+
+    async def aget(self, url: str, **kwargs) -> httpx.Response:
+        return await self.arequest('GET', url, **kwargs)
+
+    def session(self, base_url: str, headers: Mapping[str, str],
+                session_cls: type = httpx.Client, **kwargs) -> httpx.Client:
+        """Build a client (e.g. a PostgREST session) that shares the pooled transport."""
+        host = urlsplit(base_url).hostname
+        kwargs.setdefault('timeout', self.profile(host).timeout)
+        return session_cls(base_url=base_url, headers=dict(headers),
+                           transport=self.router, follow_redirects=True, **kwargs)
+
+    def async_session(self, base_url: str, headers: Mapping[str, str],
+                      session_cls: type = httpx.AsyncClient, **kwargs) -> httpx.AsyncClient:
+        host = urlsplit(base_url).hostname
+        kwargs.setdefault('timeout', self.profile(host).timeout)
+        return session_cls(base_url=base_url, headers=dict(headers),
+                           transport=self.async_router, follow_redirects=True, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {host: s.as_dict() for host, s in sorted(self._stats.items())}
+
+    def collect_metrics(self):
+        """metrics.Registry collector: per-host pool counters."""
+        hosts = list(self._stats.values())
+        for field, help in (('requests', 'Outbound requests sent.'),
+                            ('connects', 'New TCP connections opened.'),
+                            ('tls_handshakes', 'TLS handshakes performed.'),
+                            ('errors', 'Transport-level failures.')):
+            yield (f'outbound_{field}_total', 'counter', help,
+                   [({'host': s.host}, getattr(s, field)) for s in hosts])
+
+    def close_pools(self) -> None:
+        with self._lock:
+            transports, self._transports = self._transports, {}
+        for transport in transports.values():
+            transport.close()
+
+
+outbound = OutboundHTTP(HOST_PROFILES)
+REGISTRY.add_collector(outbound.collect_metrics)
@@ -0,0 +1,196 @@
+"""
+Cross-worker cache invalidation bus.
+
+Passenger runs several worker processes, and a cache filled in one of them
+does not see writes made in another. The write methods in supabase_client.py
+``publish`` every change as (family, op, row). The event goes into a small
+SQLite file shared by the workers on the host, and the family's version is
+bumped in the same transaction.
+
+At the start of every request each process calls ``poll``. The check is
+``PRAGMA data_version``, which only changes after another connection has
+committed, so it costs microseconds and no I/O. Events from other
+processes are then passed to the handlers registered with ``subscribe``.
+The publishing process has already applied its own change and skips it.
+
+Families and rows:
+
+* 'blacklist': the blacklist_entry row (op 'upsert' or 'delete');
+* 'whitelist': {'uuid': ...};
+* 'admin_users': the admin_user row;
+* 'profiles': {'uuid', 'nickname'}, a player who renamed.
+
+A worker spawned later starts from the newest event: its caches are empty
+anyway. A subscriber whose state must also cover earlier changes passes
+``replay_seconds``. Its family's events from that window are then passed to
+it once, at the process's first poll. auth.py uses this for admin deletions,
+so tokens of an admin deleted before the worker started are revoked too.
+
+``version(family)`` is for caches that only need to know that something changed.
+Events older than INVALIDATION_KEEP_SECONDS are pruned, so no replay window
+may be longer than that. If the file is unavailable, publishing is skipped
+with a warning and the caches fall back to their TTLs.
+"""
+import json
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv('INVALIDATION_ENABLED', '1') != '0'
+PATH = os.getenv('INVALIDATION_DB') or os.path.join(tempfile.gettempdir(), 'blacklist_invalidation.sqlite3')
+KEEP_SECONDS = float(os.getenv('INVALIDATION_KEEP_SECONDS', '3600'))
+
+Handler = Callable[[str, Dict[str, Any]], None]
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS events (seq INTEGER PRIMARY KEY AUTOINCREMENT, family TEXT NOT NULL, '
+    'op TEXT NOT NULL, payload TEXT NOT NULL, origin INTEGER NOT NULL, at REAL NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS versions (family TEXT PRIMARY KEY, version INTEGER NOT NULL) WITHOUT ROWID',
+)
+
+
+class Bus:
+    """Event log and version table in one SQLite file, plus this process's subscribers."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._handlers: Dict[str, List[Tuple[Handler, float]]] = {}  # family -> [(handler, replay_seconds)]
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None  # процесс, для которого действуют _seq/_versions (после fork — заново)
+        self._seq = 0
+        self._replay_pending = False  # новый процесс: недавние события ещё не переданы подписчикам с replay_seconds
+        self._versions: Dict[str, int] = {}
+
+    def _conn(self) -> sqlite3.Connection:
+        pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != pid:
+            # Соединение, открытое до fork, в дочернем процессе использовать нельзя
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._local.conn, self._local.pid, self._local.data_version = conn, pid, None
+        with self._lock:
+            if self._pid != pid:
+                # Новый процесс: прошлые события его кэшей не касаются — читаем только новые
+                self._pid = pid
+                self._seq = conn.execute('SELECT coalesce(max(seq), 0) FROM events').fetchone()[0]
+                self._replay_pending = True
+                self._versions = dict(conn.execute('SELECT family, version FROM versions'))
+        return conn
+
+    def subscribe(self, family: str, handler: Handler, replay_seconds: float = 0) -> None:
+        self._handlers.setdefault(family, []).append((handler, replay_seconds))
+
+    def publish(self, family: str, op: str, row: Dict[str, Any]) -> None:
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('INSERT INTO events (family, op, payload, origin, at) VALUES (?, ?, ?, ?, ?)',
+                             (family, op, json.dumps(row, default=str), os.getpid(), now))
+                conn.execute('INSERT INTO versions (family, version) VALUES (?, 1) '
+                             'ON CONFLICT(family) DO UPDATE SET version = version + 1', (family,))
+                if random.random() < 0.01:
+                    conn.execute('DELETE FROM events WHERE at < ?', (now - KEEP_SECONDS,))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            logger.warning("Invalidation bus unavailable, %s %s not published: %s", family, op, e)
+            return
+        with self._lock:
+            self._versions[family] = self._versions.get(family, 0) + 1
+
+    def poll(self) -> None:
+        """Apply other processes' changes committed since the last call."""
+        try:
+            conn = self._conn()
+            if self._replay_pending:
+                self._replay(conn)
+            data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+            if data_version == self._local.data_version:
+                return
+            self._local.data_version = data_version
+            with self._lock:
+                events = conn.execute('SELECT seq, family, op, payload, origin FROM events WHERE seq > ? ORDER BY seq',
+                                      (self._seq,)).fetchall()
+                if events:
+                    self._seq = events[-1][0]
+                self._versions = dict(conn.execute('SELECT family, version FROM versions'))
+        except sqlite3.Error as e:
+            logger.warning("Invalidation bus unavailable: %s", e)
+            return
+        pid = os.getpid()
+        for _, family, op, payload, origin in events:
+            if origin != pid:
+                self._dispatch(family, op, payload, self._handlers.get(family, ()))
+
+    def _replay(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            if not self._replay_pending:
+                return
+            self._replay_pending = False
+            seq = self._seq
+        now = time.time()
+        for family, handlers in self._handlers.items():
+            window = max((seconds for _, seconds in handlers), default=0)
+            if window <= 0:
+                continue
+            events = conn.execute('SELECT op, payload, at FROM events WHERE family = ? AND at >= ? AND seq <= ? '
+                                  'ORDER BY seq', (family, now - window, seq)).fetchall()
+            for op, payload, at in events:
+                self._dispatch(family, op, payload, [h for h in handlers if h[1] >= now - at])
+
+    def _dispatch(self, family: str, op: str, payload: str, handlers: Iterable[Tuple[Handler, float]]) -> None:
+        row = json.loads(payload)
+        for handler, _ in handlers:
+            try:
+                handler(op, row)
+            except Exception as e:
+                logger.error(f"Invalidation handler {handler!r} failed on {family} {op}: {e}")
+
+    def version(self, family: str) -> int:
+        return self._versions.get(family, 0)
+
+
+bus = Bus(PATH)
+
+
+def subscribe(family: str, handler: Handler, replay_seconds: float = 0) -> None:
+    """
+    Call ``handler(op, row)`` for changes of ``family`` made by other worker
+    processes; with ``replay_seconds`` also, once per process, for those made
+    in that many seconds before it started.
+    """
+    bus.subscribe(family, handler, replay_seconds)
+
+
+def publish(family: str, op: str, row: Dict[str, Any]) -> None:
+    if ENABLED:
+        bus.publish(family, op, row)
+
+
+def poll() -> None:
+    if ENABLED:
+        bus.poll()
+
+
+def version(family: str) -> int:
+    return bus.version(family)
+
+
+def init_app(app) -> None:
+    app.before_request(poll)
@@ -0,0 +1,195 @@
+"""
+JSON encoding for API responses.
+
+* Serialization goes through orjson when it is installed (straight to bytes,
+  several times faster than the stdlib on our payloads) and falls back to
+  ``json.dumps(ensure_ascii=False)``. ``init_app`` installs it as the Flask
+  JSON provider, so ``jsonify`` uses it too.
+* ``json_response`` builds a Response from bytes, without the str round trip
+  of ``Response(json.dumps(...))``. Lists of STREAM_MIN_ITEMS or more are
+  streamed in chunks instead of being serialized as one buffer.
+* Responses of COMPRESS_MIN_BYTES or more are compressed once, after the
+  view, with brotli or gzip according to Accept-Encoding. The ETag from
+  conditional_json is computed before that and is weak, so it stays valid
+  for every encoding.
+"""
+import gzip
+import json
+import os
+import zlib
+from typing import Any, Iterable, Iterator, Optional
+
+from flask import Flask, Response, request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import parse_accept_header
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+COMPRESS_MIN_BYTES = int(os.getenv('JSON_COMPRESS_MIN_BYTES', '1024'))
+STREAM_MIN_ITEMS = int(os.getenv('JSON_STREAM_MIN_ITEMS', '500'))
+STREAM_CHUNK_BYTES = 64 * 1024
+# Сжимаем на каждом запросе, поэтому уровни умеренные: основной выигрыш даёт сам факт сжатия
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+COMPRESSIBLE_MIMETYPES = frozenset({'application/json'})
+
+
+def _default(obj: Any) -> Any:
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    return str(obj)
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize to UTF-8 JSON bytes (non-ASCII characters are not escaped)."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def loads(data: Any) -> Any:
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best supported content coding for an Accept-Encoding value, or None for identity."""
+    if not accept_encoding:
+        return None
+    accepted = parse_accept_header(accept_encoding)
+    if BROTLI_AVAILABLE and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class _StreamCompressor:
+    def __init__(self, encoding: Optional[str]):
+        if encoding == 'br':
+            self._obj = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._flush = self._obj.flush
+            self._finish = self._obj.finish
+            self._feed = self._obj.process
+        elif encoding == 'gzip':
+            self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._flush = lambda: self._obj.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = self._obj.flush
+            self._feed = self._obj.compress
+        else:
+            self._obj = None
+
+    def chunk(self, data: bytes) -> bytes:
+        if self._obj is None:
+            return data
+        # Сбрасываем буфер на каждом чанке, чтобы клиент получал данные по мере сериализации
+        return self._feed(data) + self._flush()
+
+    def finish(self) -> bytes:
+        return self._finish() if self._obj is not None else b''
+
+
+def iter_json_array(items: Iterable[Any], encoding: Optional[str] = None,
+                    chunk_bytes: int = STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+    """Serialize a sequence item by item as one JSON array, yielding chunks of about chunk_bytes."""
+    compressor = _StreamCompressor(encoding)
+    buffer = bytearray(b'[')
+    first = True
+    for item in items:
+        if not first:
+            buffer += b','
+        buffer += dumps(item)
+        first = False
+        if len(buffer) >= chunk_bytes:
+            yield compressor.chunk(bytes(buffer))
+            buffer.clear()
+    buffer += b']'
+    yield compressor.chunk(bytes(buffer))
+    tail = compressor.finish()
+    if tail:
+        yield tail
+
+
+def json_response(payload: Any, status: int = 200, stream: Optional[bool] = None) -> Response:
+    """Flask response with the payload serialized once, straight to bytes.
+
+    ``stream=None`` streams lists of STREAM_MIN_ITEMS or more; a streamed
+    response has no Content-Length and no ETag, so views that call
+    conditional_json pass ``stream=False``.
+    """
+    if stream is None:
+        stream = isinstance(payload, list) and len(payload) >= STREAM_MIN_ITEMS
+    if not stream:
+        return Response(dumps(payload), status=status, mimetype='application/json')
+
+    encoding = negotiate(request.headers.get('Accept-Encoding'))
+    response = Response(iter_json_array(payload, encoding), status=status, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+class JSONProvider(DefaultJSONProvider):
+    """``jsonify`` / ``request.get_json`` through orjson; the stdlib path stays for explicit options."""
+
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj).decode('utf-8')
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
+
+
+def _compress_response(response: Response) -> Response:
+    if (response.mimetype not in COMPRESSIBLE_MIMETYPES or response.direct_passthrough
+            or response.is_streamed or 'Content-Encoding' in response.headers
+            or response.status_code < 200 or response.status_code in (204, 304)):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    encoding = negotiate(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    packed = compress(body, encoding)
+    if len(packed) >= len(body):
+        return response
+    response.set_data(packed)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app: Flask) -> None:
+    app.json = JSONProvider(app)
+    app.after_request(_compress_response)
@@ -0,0 +1,106 @@
+"""
+Non-blocking structured logging.
+
+Request threads render the message and put the LogRecord on a bounded
+queue; a single QueueListener thread does the JSON encoding and the stdout
+write. High-volume INFO logs can be sampled per key before they are even
+queued:
+
+    logger.info("Reported location for %s", uuid, extra={'sample': 'locations.report'})
+"""
+import atexit
+import copy
+import itertools
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+# Attributes every LogRecord has; anything else on a record came in via ``extra=``.
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sample'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; ``extra=`` fields (real_ip, method, path, ...) become top-level keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text  # отрисован в DeferredQueueHandler.prepare
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps 1 of every N records that carry ``extra={'sample': key}``; WARNING and above always pass."""
+
+    def __init__(self, rates: Optional[Dict[str, int]] = None):
+        super().__init__()
+        self.rates = dict(rates or {})
+        self._counters = {key: itertools.count() for key in self.rates}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, 'sample', None)
+        if key is None or record.levelno >= logging.WARNING:
+            return True
+        counter = self._counters.get(key)
+        if counter is None:
+            return True
+        return next(counter) % self.rates[key] == 0
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that renders the message on the calling thread, while the
+    arguments still hold their values at the time of the call, and leaves the
+    JSON encoding to the listener. When the queue is full the record is
+    dropped rather than blocking the request.
+    """
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Как QueueHandler.prepare, но без format(): аргументы могут измениться или не пережить поток
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DeferredQueueHandler.dropped += 1
+
+
+def queue_handler(maxsize: int = 10000, sample_rates: Optional[Dict[str, int]] = None) -> QueueHandler:
+    """dictConfig factory: returns the producer-side handler and starts its listener thread."""
+    log_queue: 'queue.Queue[logging.LogRecord]' = queue.Queue(maxsize=maxsize)
+    target = logging.StreamHandler()
+    target.setFormatter(JsonFormatter())
+    listener = QueueListener(log_queue, target, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(sample_rates))
+    return handler
+
+
+def collect_metrics():
+    """metrics.Registry collector."""
+    yield ('log_records_dropped_total', 'counter', 'Log records dropped because the queue was full.',
+           [({}, DeferredQueueHandler.dropped)])
@@ -0,0 +1,253 @@
+"""
+In-process metrics with Prometheus text exposition (served at /metrics).
+
+Recording is lock-free: every thread writes only to its own shard, a dict of
+small int lists keyed by the label tuple, so a request costs a few integer
+increments. Shards are merged only when /metrics is scraped. When a thread
+ends, its shard is folded into the metric's base shard, so a
+thread-per-request server does not grow the shard list.
+"""
+import bisect
+import inspect
+import itertools
+import threading
+import time
+import weakref
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (name, kind, help, [(labels, value), ...])
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _fold(into: Dict[tuple, list], shard: Dict[tuple, list]) -> None:
+    for labels, cell in list(shard.items()):
+        total = into.get(labels)
+        if total is None:
+            into[labels] = list(cell)
+        else:
+            for i, v in enumerate(cell):
+                total[i] += v
+
+
+class _ShardOwner:
+    """Held only by the thread-local: collected when its thread ends, which retires the shard."""
+    __slots__ = ('shard', '__weakref__')
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: Dict[int, Dict[tuple, list]] = {}  # shards of live threads
+        self._base: Dict[tuple, list] = {}  # всё, что насчитали завершившиеся потоки
+        self._keys = itertools.count()
+        self._shards_lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _shard(self) -> Dict[tuple, list]:
+        try:
+            return self._local.owner.shard
+        except AttributeError:
+            owner = self._local.owner = _ShardOwner()
+            shard = owner.shard = {}
+            key = next(self._keys)
+            with self._shards_lock:  # once per thread
+                self._shards[key] = shard
+            weakref.finalize(owner, self._retire, key)
+            return shard
+
+    def _retire(self, key: int) -> None:
+        # Поток завершился и больше не пишет в свой шард — переносим его счёт в базовый
+        with self._shards_lock:
+            shard = self._shards.pop(key, None)
+            if shard:
+                _fold(self._base, shard)
+
+    def _merged(self) -> Dict[tuple, list]:
+        with self._shards_lock:
+            merged = {labels: list(cell) for labels, cell in self._base.items()}
+            shards = list(self._shards.values())
+        for shard in shards:
+            _fold(merged, shard)
+        return merged
+
+    def _labels(self, values: tuple) -> Dict[str, str]:
+        return dict(zip(self.labelnames, (str(v) for v in values)))
+
+    def collect(self) -> Iterable[Family]:
+        samples = [(self._labels(labels), cell[0]) for labels, cell in self._merged().items()]
+        yield self.name, self.kind, self.help, samples
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, labels: tuple = (), amount: int = 1) -> None:
+        shard = self._shard()
+        cell = shard.get(labels)
+        if cell is None:
+            cell = shard[labels] = [0]
+        cell[0] += amount
+
+
+class Gauge(Counter):
+    """Per-thread deltas; the sum across shards is the current value."""
+    kind = 'gauge'
+
+    def dec(self, labels: tuple = (), amount: int = 1) -> None:
+        self.inc(labels, -amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labelnames)
+
+    def observe(self, labels: tuple, value: float) -> None:
+        shard = self._shard()
+        cell = shard.get(labels)
+        if cell is None:
+            # one slot per bucket, one for +Inf, then the running sum
+            cell = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def collect(self) -> Iterable[Family]:
+        buckets, sums, counts = [], [], []
+        for labels, cell in self._merged().items():
+            base = self._labels(labels)
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), cell):
+                cumulative += n
+                buckets.append(({**base, 'le': _format_value(bound)}, cumulative))
+            sums.append((base, cell[-1]))
+            counts.append((base, cumulative))
+        yield self.name + '_bucket', 'histogram', self.help, buckets
+        yield self.name + '_sum', '', '', sums
+        yield self.name + '_count', '', '', counts
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def register(self, metric: _Metric) -> None:
+        self._metrics.append(metric)
+
+    def add_collector(self, collector: Callable[[], Iterable[Family]]) -> None:
+        """Scrape-time callback for values kept elsewhere (cache stats, pool counters)."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        families = [f for m in self._metrics for f in m.collect()]
+        for collector in self._collectors:
+            families.extend(collector())
+        # Several collectors may report into one family (e.g. cache_hits_total); emit each once.
+        grouped: Dict[str, Family] = {}
+        for name, kind, help, samples in families:
+            if name in grouped:
+                grouped[name][3].extend(samples)
+            else:
+                grouped[name] = (name, kind, help, list(samples))
+
+        lines: List[str] = []
+        for name, kind, help, samples in grouped.values():
+            if kind:
+                base_name = name[:-len('_bucket')] if kind == 'histogram' else name
+                lines.append(f'# HELP {base_name} {help}')
+                lines.append(f'# TYPE {base_name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    inner = ','.join(
+        '{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels.items()
+    )
+    return '{' + inner + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+REGISTRY = Registry()
+
+# ─────────────── Стандартные метрики приложения ───────────────
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Request latency by endpoint.', ('endpoint',))
+REQUESTS_TOTAL = Counter('http_requests_total', 'Responses by endpoint and status code.', ('endpoint', 'status'))
+IN_FLIGHT = Gauge('http_requests_in_flight', 'Requests currently being served.')
+UPSTREAM_SECONDS = Histogram('upstream_call_duration_seconds', 'Upstream call latency.', ('upstream', 'operation'))
+UPSTREAM_ERRORS = Counter('upstream_call_errors_total', 'Upstream calls that raised.', ('upstream', 'operation'))
+
+
+def timed(upstream: str, operation: str) -> Callable:
+    """Decorator recording the wrapped call into UPSTREAM_SECONDS (sync or async)."""
+    labels = (upstream, operation)
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception:
+                    UPSTREAM_ERRORS.inc(labels)
+                    raise
+                finally:
+                    UPSTREAM_SECONDS.observe(labels, time.perf_counter() - start)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                UPSTREAM_ERRORS.inc(labels)
+                raise
+            finally:
+                UPSTREAM_SECONDS.observe(labels, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def instrument_methods(cls: type, upstream: str) -> type:
+    """Wrap every public method of cls with timed(upstream, <method name>)."""
+    for name, attr in list(vars(cls).items()):
+        if not name.startswith('_') and callable(attr):
+            setattr(cls, name, timed(upstream, name)(attr))
+    return cls
+
+
+def cache_collector(name: str, cache) -> Callable[[], Iterable[Family]]:
+    """Collector exposing hits/misses/ratio of any cache with ``hits`` and ``misses`` counters."""
+    def collect() -> Iterable[Family]:
+        hits, misses = cache.hits, cache.misses
+        total = hits + misses
+        labels = {'cache': name}
+        yield 'cache_hits_total', 'counter', 'Cache hits.', [(labels, hits)]
+        yield 'cache_misses_total', 'counter', 'Cache misses.', [(labels, misses)]
+        yield 'cache_hit_ratio', 'gauge', 'Cache hit ratio since start.', [(labels, hits / total if total else 0.0)]
+    return collect
+
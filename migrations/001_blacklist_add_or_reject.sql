@@ -0,0 +1,59 @@
+-- Одна операция добавления в ЧС: проверка дубликатов, вставка и запись в audit_log
+-- в одной транзакции (SupabaseClient.add_or_reject_blacklist_entry).
+-- Применить в Supabase: SQL Editor -> Run. Повторный запуск безопасен.
+
+-- 1. Уникальность UUID. Если индекс не создаётся, сначала найдите дубликаты:
+--    select lower(replace(uuid, '-', '')) as u, array_agg(id) from blacklist_entry
+--     group by 1 having count(*) > 1;
+create unique index if not exists blacklist_entry_uuid_key
+    on public.blacklist_entry (lower(replace(uuid, '-', '')));
+
+-- 2. Добавить или отказать. Возвращает одну строку (status, conflict, entry):
+--    status: 'added' | 'exists', conflict: null | 'uuid' | 'nickname', entry: запись ЧС.
+--    Таблица, а не jsonb: postgrest-py 0.10 принимает от RPC только массив объектов.
+create or replace function public.add_or_reject_blacklist_entry(
+    p_nickname text,
+    p_uuid text,
+    p_reason text,
+    p_admin_username text default null
+) returns table (status text, conflict text, entry jsonb)
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_entry blacklist_entry;
+begin
+    -- Ник уже в ЧС (под другим UUID) — как и раньше, не добавляем
+    select * into v_entry from blacklist_entry where lower(nickname) = lower(p_nickname) limit 1;
+    if found then
+        return query select 'exists'::text, 'nickname'::text, to_jsonb(v_entry);
+        return;
+    end if;
+
+    -- Гонку двух админов с одним UUID решает уникальный индекс: второй insert ничего не вставит
+    insert into blacklist_entry (nickname, uuid, reason, created_at)
+    values (p_nickname, p_uuid, p_reason, now())
+    on conflict do nothing
+    returning * into v_entry;
+
+    if v_entry.id is null then
+        select * into v_entry from blacklist_entry
+         where lower(replace(uuid, '-', '')) = lower(replace(p_uuid, '-', '')) limit 1;
+        return query select 'exists'::text, 'uuid'::text, to_jsonb(v_entry);
+        return;
+    end if;
+
+    if p_admin_username is not null then
+        insert into audit_log (timestamp, admin_username, action_type, target_type, target_identifier, details)
+        values (now(), p_admin_username, 'ADD_BLACKLIST', 'blacklist_entry', p_nickname,
+                format('UUID: %s, Reason: %s', p_uuid, p_reason));
+    end if;
+
+    return query select 'added'::text, null::text, to_jsonb(v_entry);
+end;
+$$;
+
+-- Вызывается только с service key (admin_client)
+revoke all on function public.add_or_reject_blacklist_entry(text, text, text, text) from public, anon, authenticated;
+grant execute on function public.add_or_reject_blacklist_entry(text, text, text, text) to service_role;
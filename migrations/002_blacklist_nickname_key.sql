@@ -0,0 +1,65 @@
+-- Точный поиск по нику без учёта регистра: ILIKE с ником в качестве шаблона не использует
+-- B-tree индекс, а '_' в нём — любой символ (Player_1 находил и Player11).
+-- nickname_key = lower(nickname) пишет SupabaseClient на каждой вставке/обновлении ника;
+-- запросы сравнивают его через =.
+-- Применить в Supabase: SQL Editor -> Run (после 001). Повторный запуск безопасен.
+
+-- 1. Колонка и заполнение существующих строк
+alter table public.blacklist_entry add column if not exists nickname_key text;
+
+update public.blacklist_entry
+   set nickname_key = lower(nickname)
+ where nickname_key is distinct from lower(nickname);
+
+-- 2. Уникальный индекс. Если не создаётся, сначала найдите дубликаты:
+--    select nickname_key, array_agg(id) from blacklist_entry group by 1 having count(*) > 1;
+create unique index if not exists blacklist_entry_nickname_key_key
+    on public.blacklist_entry (nickname_key);
+
+-- NOT NULL не ставим: воркеры со старым кодом могут ещё вставлять строки без ключа.
+-- После деплоя их дописывает python -m supabase_client (github-webhook.sh).
+
+-- 3. add_or_reject_blacklist_entry из 001: сравнение и вставка через nickname_key
+create or replace function public.add_or_reject_blacklist_entry(
+    p_nickname text,
+    p_uuid text,
+    p_reason text,
+    p_admin_username text default null
+) returns table (status text, conflict text, entry jsonb)
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_entry blacklist_entry;
+begin
+    insert into blacklist_entry (nickname, nickname_key, uuid, reason, created_at)
+    values (p_nickname, lower(p_nickname), p_uuid, p_reason, now())
+    on conflict do nothing
+    returning * into v_entry;
+
+    -- Не вставилось — ник или UUID уже в ЧС; ник проверяем первым, как и раньше
+    if v_entry.id is null then
+        select * into v_entry from blacklist_entry where nickname_key = lower(p_nickname);
+        if found then
+            return query select 'exists'::text, 'nickname'::text, to_jsonb(v_entry);
+            return;
+        end if;
+        select * into v_entry from blacklist_entry
+         where lower(replace(uuid, '-', '')) = lower(replace(p_uuid, '-', '')) limit 1;
+        return query select 'exists'::text, 'uuid'::text, to_jsonb(v_entry);
+        return;
+    end if;
+
+    if p_admin_username is not null then
+        insert into audit_log (timestamp, admin_username, action_type, target_type, target_identifier, details)
+        values (now(), p_admin_username, 'ADD_BLACKLIST', 'blacklist_entry', p_nickname,
+                format('UUID: %s, Reason: %s', p_uuid, p_reason));
+    end if;
+
+    return query select 'added'::text, null::text, to_jsonb(v_entry);
+end;
+$$;
+
+revoke all on function public.add_or_reject_blacklist_entry(text, text, text, text) from public, anon, authenticated;
+grant execute on function public.add_or_reject_blacklist_entry(text, text, text, text) to service_role;
@@ -0,0 +1,4 @@
+-- Когда запись ЧС последний раз сверяли с Mojang (reconcile.py). Проверка ника отвечает
+-- из сохранённых данных и ставит запись в очередь; фоновый воркер пишет сюда время сверки.
+-- Применить в Supabase: SQL Editor -> Run. Повторный запуск безопасен.
+alter table public.blacklist_entry add column if not exists last_verified_at timestamptz;
@@ -0,0 +1,24 @@
+-- Прошлые ники игроков: пишется, когда сверка с Mojang (reconcile.py) или /admin/update_nicknames
+-- замечает переименование. Проверка ника ищет по ней бывшие ники без обращения к Mojang,
+-- /api/name-history/<uuid> отдаёт историю игрока.
+-- Применить в Supabase: SQL Editor -> Run. Повторный запуск безопасен.
+
+create table if not exists public.nickname_history (
+    id bigint generated by default as identity primary key,
+    uuid text not null,                      -- без дефисов, в нижнем регистре
+    nickname text not null,                  -- ник, который игрок носил раньше
+    nickname_key text not null,              -- lower(nickname), как в blacklist_entry (002)
+    changed_at timestamptz not null default now()  -- когда смену ника заметили
+);
+
+-- Одна запись на пару (игрок, ник); этот же индекс обслуживает выборку истории по uuid
+create unique index if not exists nickname_history_uuid_nickname_key
+    on public.nickname_history (uuid, nickname_key);
+-- Поиск по прошлому нику
+create index if not exists nickname_history_nickname_key_idx
+    on public.nickname_history (nickname_key);
+
+-- Читать может кто угодно (история публичная, как и ЧС), писать — только service key
+alter table public.nickname_history enable row level security;
+drop policy if exists nickname_history_read on public.nickname_history;
+create policy nickname_history_read on public.nickname_history for select using (true);
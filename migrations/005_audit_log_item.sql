@@ -0,0 +1,19 @@
+-- Построчные итоги массовых действий админки (например, /admin/update_nicknames):
+-- вместо одной строки details на весь ЧС — запись audit_log с итогом и по строке на
+-- каждый затронутый элемент. Пишет audit.py пачками, без ожидания в запросе.
+-- Применить в Supabase: SQL Editor -> Run. Повторный запуск безопасен.
+
+create table if not exists public.audit_log_item (
+    id bigint generated by default as identity primary key,
+    audit_id bigint not null references public.audit_log (id) on delete cascade,
+    position integer not null,               -- порядок внутри действия
+    target_identifier text,                  -- UUID или ник элемента
+    status text,                             -- 'updated' | 'failed' | 'skipped' | ...
+    details text                             -- коротко, до 300 символов (audit.ITEM_DETAILS_MAX)
+);
+
+create index if not exists audit_log_item_audit_id_idx
+    on public.audit_log_item (audit_id, position);
+
+-- Как и audit_log: только service key
+alter table public.audit_log_item enable row level security;
@@ -0,0 +1,72 @@
+-- Журнал аудита: постраничный просмотр по курсору (timestamp, id), фильтры и архивирование.
+-- SupabaseClient.get_audit_logs / archive_audit_log, python -m audit.
+-- Применить в Supabase после 005: SQL Editor -> Run. Повторный запуск безопасен.
+
+-- 1. Индексы под ORDER BY timestamp DESC, id DESC: без фильтра и с каждым из фильтров админки
+create index if not exists audit_log_timestamp_id_idx
+    on public.audit_log (timestamp desc, id desc);
+create index if not exists audit_log_admin_timestamp_idx
+    on public.audit_log (admin_username, timestamp desc, id desc);
+create index if not exists audit_log_action_timestamp_idx
+    on public.audit_log (action_type, timestamp desc, id desc);
+create index if not exists audit_log_target_timestamp_idx
+    on public.audit_log (target_identifier, timestamp desc, id desc);
+
+-- 2. Архив: старые записи вместе с построчными итогами (005) одной строкой, items — jsonb
+create table if not exists public.audit_log_archive (
+    id bigint primary key,
+    timestamp timestamptz,
+    admin_username text,
+    action_type text,
+    target_type text,
+    target_identifier text,
+    details text,
+    items jsonb,
+    archived_at timestamptz not null default now()
+);
+alter table public.audit_log_archive enable row level security;
+
+-- 3. Перенос записей старше p_keep_days пачками по p_batch; возвращает число перенесённых.
+--    Таблица, а не integer: postgrest-py 0.10 принимает от RPC только массив объектов.
+create or replace function public.archive_audit_log(p_keep_days integer default 365, p_batch integer default 5000)
+returns table (moved integer)
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_total integer := 0;
+    v_moved integer;
+begin
+    loop
+        with batch as (
+            select id from audit_log
+             where timestamp < now() - make_interval(days => p_keep_days)
+             order by timestamp, id
+             limit p_batch
+             for update skip locked
+        ), gone as (
+            delete from audit_log a using batch b where a.id = b.id
+            returning a.*
+        )
+        insert into audit_log_archive (id, timestamp, admin_username, action_type, target_type,
+                                       target_identifier, details, items)
+        select g.id, g.timestamp, g.admin_username, g.action_type, g.target_type, g.target_identifier, g.details,
+               (select jsonb_agg(jsonb_build_object('target_identifier', i.target_identifier,
+                                                    'status', i.status, 'details', i.details) order by i.position)
+                  from audit_log_item i where i.audit_id = g.id)
+          from gone g
+        on conflict (id) do nothing;
+        get diagnostics v_moved = row_count;
+        v_total := v_total + v_moved;
+        exit when v_moved < p_batch;
+    end loop;
+    return query select v_total;
+end;
+$$;
+
+revoke all on function public.archive_audit_log(integer, integer) from public, anon, authenticated;
+grant execute on function public.archive_audit_log(integer, integer) to service_role;
+
+-- 4. Запуск по расписанию: cron на хосте (python -m audit) или, если включён pg_cron:
+--    select cron.schedule('archive-audit-log', '30 3 * * *', $$select public.archive_audit_log(365)$$);
@@ -0,0 +1,22 @@
+-- Время последнего изменения записи ЧС: локальное зеркало (mirror.py) забирает только
+-- строки, изменённые после прошлой синхронизации, а не всю таблицу.
+-- Применить в Supabase: SQL Editor -> Run. Повторный запуск безопасен.
+
+alter table public.blacklist_entry add column if not exists updated_at timestamptz not null default now();
+
+create or replace function public.blacklist_entry_touch() returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at := now();
+    return new;
+end;
+$$;
+
+drop trigger if exists blacklist_entry_touch on public.blacklist_entry;
+create trigger blacklist_entry_touch before update on public.blacklist_entry
+    for each row execute function public.blacklist_entry_touch();
+
+-- Выборка изменений: updated_at >= курсора, по порядку (updated_at, id)
+create index if not exists blacklist_entry_updated_at_idx
+    on public.blacklist_entry (updated_at, id);
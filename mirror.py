@@ -0,0 +1,480 @@
+"""
+Local SQLite mirror of blacklist_entry and whitelist_players.
+
+Reads on the check path go to Supabase. When Supabase fails, they are
+answered from this file instead: SupabaseClient.get_blacklist_entry, the
+lookups by UUID and by a batch of nicknames, and the whitelist. Checks then
+keep working with stale but correct answers, and /api/check reports
+``mirror_age``, the seconds since the last successful sync. With
+MIRROR_READS=first these reads are served from the mirror whenever it has
+been synced, as a local indexed lookup.
+
+The file lives in the app's instance/ directory (MIRROR_DB overrides it),
+not in the shared temp directory.
+
+* One daemon thread per process keeps the mirror in sync. Every
+  MIRROR_REFRESH_SECONDS it fetches the blacklist rows changed since the
+  previous sync (updated_at, migrations/007). Every MIRROR_FULL_SECONDS, or
+  on every sync while updated_at is missing, it reloads the whole table,
+  which also drops deleted rows. The whitelist is small and is reloaded
+  every time. Workers on the host share the file; a lease in the meta table
+  lets one of them sync at a time.
+* This process's own writes are applied at once, by supabase_client's
+  _notify_blacklist and _notify_whitelist. Writes made by other workers
+  are already in the shared file, so remote invalidation events skip it.
+* check_log inserts, which never need to wait, go to an outbox table. So do
+  admin additions made while Supabase is unreachable: they are shown in the
+  mirror as provisional rows (negative ids) until replayed. The same thread
+  replays the outbox oldest first and backs off while Supabase stays down.
+  A row is deleted only after it was sent, and only Supabase rejecting it
+  counts towards MIRROR_MAX_ATTEMPTS, so an outage of any length loses
+  nothing. An addition rejected that many times stays in the outbox as
+  failed (mirror_outbox_failed) and gets an ADD_BLACKLIST_FAILED audit record.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import audit
+import supabase_client
+from metrics import REGISTRY, Counter, Family
+from supabase_client import (PAGE_ROWS, BackendUnavailable, _is_unreachable, _optional_column_missing, _or_filter,
+                             _order_by, compact_uuid, db, nickname_key)
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv('MIRROR_ENABLED', '1') != '0'
+PATH = os.getenv('MIRROR_DB') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance',
+                                              'blacklist_mirror.sqlite3')
+REFRESH_SECONDS = float(os.getenv('MIRROR_REFRESH_SECONDS', '30'))
+FULL_SECONDS = float(os.getenv('MIRROR_FULL_SECONDS', '600'))
+MAX_ATTEMPTS = int(os.getenv('MIRROR_MAX_ATTEMPTS', '100'))
+REPLAY_SECONDS = 2.0
+MAX_BACKOFF = 60.0
+LEASE_SECONDS = 120.0
+OVERLAP = timedelta(seconds=60)  # транзакции фиксируются не в порядке updated_at — перечитываем последнюю минуту
+
+REPLAYED = Counter('mirror_replayed_total', 'Outbox writes replayed to Supabase.', ('kind', 'result'))
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS blacklist (id INTEGER PRIMARY KEY, nickname_key TEXT, uuid_key TEXT, row TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS blacklist_nickname_key ON blacklist (nickname_key)',
+    'CREATE INDEX IF NOT EXISTS blacklist_uuid_key ON blacklist (uuid_key)',
+    'CREATE TABLE IF NOT EXISTS whitelist (uuid TEXT PRIMARY KEY) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, '
+    'target TEXT NOT NULL, payload TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, '
+    'claimed_until REAL NOT NULL DEFAULT 0, failed_at REAL)',
+)
+# Файлы, созданные до появления аренды и failed_at
+OUTBOX_COLUMNS = {'claimed_until': 'REAL NOT NULL DEFAULT 0', 'failed_at': 'REAL'}
+
+
+def _row_values(row: Dict[str, Any]) -> Tuple[Any, str, str, str]:
+    return (row['id'], nickname_key(row.get('nickname') or ''), compact_uuid(row.get('uuid') or ''),
+            json.dumps(row, default=str))
+
+
+class Mirror:
+    """The SQLite file plus the sync/replay thread that keeps it current."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._synced: Tuple[float, Optional[float]] = (0.0, None)  # (когда читали meta, synced_at)
+        self._incremental = True  # False, пока в blacklist_entry нет updated_at
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                conn.execute(statement)
+            existing = {column[1] for column in conn.execute('PRAGMA table_info(outbox)')}
+            for column, definition in OUTBOX_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE outbox ADD COLUMN {column} {definition}')
+            self._local.conn = conn
+        return conn
+
+    def _meta(self, conn: sqlite3.Connection, key: str) -> Any:
+        row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _set_meta(conn: sqlite3.Connection, **values: Any) -> None:
+        conn.executemany('INSERT INTO meta (key, value) VALUES (?, ?) '
+                         'ON CONFLICT(key) DO UPDATE SET value = excluded.value', values.items())
+
+    # ── Состояние ──
+    def synced_at(self) -> Optional[float]:
+        """UNIX time of the last successful sync by any worker (re-read at most once a second)."""
+        checked, value = self._synced
+        now = time.monotonic()
+        if now - checked > 1.0:
+            try:
+                value = self._meta(self._conn(), 'synced_at')
+            except sqlite3.Error as e:
+                logger.warning("Mirror unavailable: %s", e)
+                value = None
+            self._synced = (now, value)
+        return value
+
+    def start(self) -> None:
+        """Start the sync thread in this process, so the mirror is current when Supabase fails."""
+        self._ensure_worker()
+
+    def ready(self) -> bool:
+        """True when reads can be served from the mirror; starts the sync thread on first use."""
+        self._ensure_worker()
+        return self.synced_at() is not None
+
+    def age(self) -> Optional[float]:
+        synced_at = self.synced_at()
+        return None if synced_at is None else max(0.0, time.time() - synced_at)
+
+    # ── Чтение ──
+    def get_blacklist_entry(self, nickname: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute('SELECT row FROM blacklist WHERE nickname_key = ? ORDER BY id DESC LIMIT 1',
+                                   (nickname_key(nickname),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_blacklist_entry_by_uuid(self, uuid: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute('SELECT row FROM blacklist WHERE uuid_key = ? ORDER BY id DESC LIMIT 1',
+                                   (compact_uuid(uuid),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_blacklist_entries_by_nicknames(self, nicknames: List[str]) -> Dict[str, Dict[str, Any]]:
+        keys = list(dict.fromkeys(nickname_key(n) for n in nicknames))
+        found = {}
+        for start in range(0, len(keys), 500):  # лимит параметров SQLite
+            chunk = keys[start:start + 500]
+            for (row,) in self._conn().execute(
+                    f"SELECT row FROM blacklist WHERE nickname_key IN ({','.join('?' * len(chunk))}) ORDER BY id",
+                    chunk):
+                entry = json.loads(row)
+                found[entry['nickname'].lower()] = entry
+        return found
+
+    def whitelisted_uuids(self) -> List[str]:
+        return [uuid for (uuid,) in self._conn().execute('SELECT uuid FROM whitelist')]
+
+    def is_whitelisted(self, uuid: str) -> bool:
+        return self._conn().execute('SELECT 1 FROM whitelist WHERE uuid = ?', (uuid,)).fetchone() is not None
+
+    # ── Свои записи ──
+    def on_blacklist_change(self, op: str, row: Dict[str, Any]) -> None:
+        if row.get('id') is None:
+            return
+        conn = self._conn()
+        if op == 'delete':
+            conn.execute('DELETE FROM blacklist WHERE id = ?', (row['id'],))
+            return
+        values = _row_values(row)
+        # Настоящая запись пришла — временная (из очереди) больше не нужна
+        conn.execute('DELETE FROM blacklist WHERE id < 0 AND nickname_key = ?', (values[1],))
+        conn.execute('INSERT OR REPLACE INTO blacklist (id, nickname_key, uuid_key, row) VALUES (?, ?, ?, ?)', values)
+
+    def on_whitelist_change(self, op: str, row: Dict[str, Any]) -> None:
+        if op == 'delete':
+            self._conn().execute('DELETE FROM whitelist WHERE uuid = ?', (row['uuid'],))
+        else:
+            self._conn().execute('INSERT OR IGNORE INTO whitelist (uuid) VALUES (?)', (row['uuid'],))
+
+    # ── Очередь записей ──
+    def enqueue(self, kind: str, target: str, payload: Dict[str, Any]) -> int:
+        """Store a write for replay: kind 'insert' (target = table) or 'add_or_reject' (target = nickname)."""
+        cursor = self._conn().execute('INSERT INTO outbox (kind, target, payload) VALUES (?, ?, ?)',
+                                      (kind, target, json.dumps(payload, default=str)))
+        self._ensure_worker()
+        return cursor.lastrowid
+
+    def queue_add(self, nickname: str, uuid: str, reason: str, admin_username: Optional[str]) -> Dict[str, Any]:
+        """add_or_reject_blacklist_entry while Supabase is unreachable: checked against the mirror, then queued."""
+        for conflict, existing in (('nickname', self.get_blacklist_entry(nickname)),
+                                   ('uuid', self.get_blacklist_entry_by_uuid(uuid))):
+            if existing:
+                return {'status': 'exists', 'conflict': conflict, 'entry': existing}
+        params = {'nickname': nickname, 'uuid': uuid, 'reason': reason, 'admin_username': admin_username}
+        outbox_id = self.enqueue('add_or_reject', nickname, params)
+        entry = {'id': -outbox_id, 'nickname': nickname, 'uuid': uuid, 'reason': reason,
+                 'created_at': datetime.utcnow().isoformat()}
+        self._conn().execute('INSERT OR REPLACE INTO blacklist (id, nickname_key, uuid_key, row) VALUES (?, ?, ?, ?)',
+                             _row_values(entry))
+        logger.warning("Supabase unreachable; blacklist entry '%s' queued for replay", nickname)
+        return {'status': 'queued', 'conflict': None, 'entry': entry}
+
+    def _claim(self, limit: int = PAGE_ROWS) -> List[Tuple[int, str, str, str, int]]:
+        # Пачка берётся в аренду в одной транзакции — другой воркер её не тронет, пока аренда не истекла.
+        # Строки удаляются только после успешной отправки: перезапуск посреди повтора ничего не теряет
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute('SELECT id, kind, target, payload, attempts FROM outbox '
+                                'WHERE failed_at IS NULL AND claimed_until < ? ORDER BY id LIMIT ?',
+                                (now, limit)).fetchall()
+            if rows:
+                conn.execute(f"UPDATE outbox SET claimed_until = ? WHERE id IN ({','.join('?' * len(rows))})",
+                             [now + LEASE_SECONDS] + [r[0] for r in rows])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return rows
+
+    def _done(self, items: List[Tuple[int, str, str, str, int]]) -> None:
+        self._conn().executemany('DELETE FROM outbox WHERE id = ?', [(item[0],) for item in items])
+
+    def _release(self, items: List[Tuple[int, str, str, str, int]], rejected: bool) -> None:
+        """
+        Give failed items back for the next pass. Only a rejection by Supabase
+        counts as an attempt; while it is unreachable the items just wait.
+        """
+        conn = self._conn()
+        for outbox_id, kind, target, payload, attempts in items:
+            attempts += rejected
+            if attempts < MAX_ATTEMPTS:
+                conn.execute('UPDATE outbox SET attempts = ?, claimed_until = 0 WHERE id = ?', (attempts, outbox_id))
+            elif kind == 'insert':
+                REPLAYED.inc((kind, 'dropped'))
+                logger.error("Outbox insert into %s dropped after %d attempts", target, attempts)
+                conn.execute('DELETE FROM outbox WHERE id = ?', (outbox_id,))
+            else:
+                self._fail(outbox_id, kind, target, payload, attempts)
+
+    def _fail(self, outbox_id: int, kind: str, target: str, payload: str, attempts: int) -> None:
+        # Админу обещали, что запись добавится: не выбрасываем её молча — оставляем в outbox с failed_at
+        # (mirror_outbox_failed) и пишем в журнал аудита, кто и что пытался добавить
+        params = json.loads(payload)
+        conn = self._conn()
+        conn.execute('UPDATE outbox SET attempts = ?, failed_at = ? WHERE id = ?', (attempts, time.time(), outbox_id))
+        conn.execute('DELETE FROM blacklist WHERE id = ?', (-outbox_id,))
+        REPLAYED.inc((kind, 'failed'))
+        logger.error("Queued blacklist entry '%s' was rejected %d times and needs to be added again by hand",
+                     target, attempts)
+        audit.record(params.get('admin_username') or 'system', 'ADD_BLACKLIST_FAILED', target_type='blacklist_entry',
+                     target_identifier=target,
+                     details=f"Queued while Supabase was down, rejected on replay. "
+                             f"UUID: {params.get('uuid')}, Reason: {params.get('reason')}")
+
+    def replay(self) -> bool:
+        """Send one batch of queued writes; False if some of them failed and were given back."""
+        items = self._claim()
+        unreachable: List[Tuple[int, str, str, str, int]] = []
+        rejected: List[Tuple[int, str, str, str, int]] = []
+        inserts: Dict[str, List[Tuple[int, str, str, str, int]]] = {}
+        for item in items:
+            if item[1] == 'insert':
+                inserts.setdefault(item[2], []).append(item)
+            elif unreachable:
+                unreachable.append(item)  # Supabase опять не отвечает — остальное не пробуем
+            else:
+                try:
+                    added = self._replay_add(item)
+                except BackendUnavailable:
+                    unreachable.append(item)
+                    continue
+                if added:
+                    self._done([item])
+                else:
+                    rejected.append(item)
+        for table, group in inserts.items():
+            if unreachable:
+                unreachable.extend(group)
+                continue
+            try:
+                db.admin_client.table(table).insert([json.loads(item[3]) for item in group]).execute()
+            except Exception as e:
+                logger.warning("Outbox insert into %s failed: %s", table, e)
+                (unreachable if _is_unreachable(e) else rejected).extend(group)
+                continue
+            REPLAYED.inc(('insert', 'ok'), len(group))
+            self._done(group)
+        self._release(unreachable, rejected=False)
+        self._release(rejected, rejected=True)
+        return not (unreachable or rejected)
+
+    def _replay_add(self, item: Tuple[int, str, str, str, int]) -> bool:
+        """True once Supabase has answered (added or already there); raises BackendUnavailable while it is down."""
+        outbox_id, kind, target, payload, attempts = item
+        params = json.loads(payload)
+        outcome = db.add_or_reject_blacklist_entry(params['nickname'], params['uuid'], params['reason'],
+                                                   admin_username=params.get('admin_username'), queue=False)
+        if outcome['status'] == 'error':
+            return False
+        REPLAYED.inc((kind, outcome['status']))
+        if outcome['status'] == 'exists':
+            logger.warning("Queued blacklist entry '%s' was not added: %s already blacklisted",
+                           target, outcome.get('conflict'))
+        self._conn().execute('DELETE FROM blacklist WHERE id = ?', (-outbox_id,))
+        return True
+
+    def pending(self) -> int:
+        return self._conn().execute('SELECT count(*) FROM outbox WHERE failed_at IS NULL').fetchone()[0]
+
+    def failed(self) -> int:
+        return self._conn().execute('SELECT count(*) FROM outbox WHERE failed_at IS NOT NULL').fetchone()[0]
+
+    # ── Синхронизация ──
+    def _take_lease(self) -> bool:
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            synced_at = self._meta(conn, 'synced_at') or 0.0
+            lease_until = self._meta(conn, 'lease_until') or 0.0
+            due = now - synced_at >= REFRESH_SECONDS and now >= lease_until
+            if due:
+                self._set_meta(conn, lease_until=now + LEASE_SECONDS)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return due
+
+    def _fetch_all(self) -> List[Dict[str, Any]]:
+        rows, last_id = [], 0
+        while True:
+            page = db.client.table('blacklist_entry').select('*').gt('id', last_id) \
+                .order('id').limit(PAGE_ROWS).execute().data or []
+            rows.extend(page)
+            if len(page) < PAGE_ROWS:
+                return rows
+            last_id = page[-1]['id']
+
+    def _fetch_changed(self, since: str) -> List[Dict[str, Any]]:
+        rows, last = [], None
+        while True:
+            query = db.client.table('blacklist_entry').select('*')
+            if last is None:
+                query = query.gte('updated_at', since)
+            else:
+                # (updated_at, id) после последней строки страницы — как курсор журнала аудита
+                query = _or_filter(query.gte('updated_at', last['updated_at']),
+                                   f"updated_at.gt.{last['updated_at']},id.gt.{last['id']}")
+            page = _order_by(query, 'updated_at', 'id').limit(PAGE_ROWS).execute().data or []
+            rows.extend(page)
+            if len(page) < PAGE_ROWS:
+                return rows
+            last = page[-1]
+
+    def _fetch_whitelist(self) -> List[str]:
+        uuids, last = [], ''
+        while True:
+            page = db.client.table('whitelist_players').select('uuid').gt('uuid', last) \
+                .order('uuid').limit(PAGE_ROWS).execute().data or []
+            uuids.extend(item['uuid'] for item in page)
+            if len(page) < PAGE_ROWS:
+                return uuids
+            last = page[-1]['uuid']
+
+    def sync(self) -> bool:
+        """Bring the mirror up to date if it is due and no other worker is doing it; True if synced."""
+        if not self._take_lease():
+            return False
+        conn = self._conn()
+        try:
+            now = time.time()
+            cursor = self._meta(conn, 'cursor')
+            full = not self._incremental or cursor is None or now - (self._meta(conn, 'full_at') or 0) >= FULL_SECONDS
+            rows = None
+            if not full:
+                since = (datetime.fromisoformat(cursor.replace('Z', '+00:00')) - OVERLAP).isoformat()
+                try:
+                    rows = self._fetch_changed(since)
+                except Exception as e:
+                    if not _optional_column_missing(e):
+                        raise
+                    logger.warning("blacklist_entry.updated_at not found (apply migrations/007); mirror reloads in full")
+                    self._incremental = False
+            if rows is None:
+                full = True
+                rows = self._fetch_all()
+            whitelist = self._fetch_whitelist()
+
+            stamps = [row['updated_at'] for row in rows if row.get('updated_at')]
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if full:
+                    conn.execute('DELETE FROM blacklist WHERE id > 0')  # временные строки очереди остаются
+                conn.executemany('DELETE FROM blacklist WHERE id < 0 AND nickname_key = ?',
+                                 [(nickname_key(row.get('nickname') or ''),) for row in rows])
+                conn.executemany('INSERT OR REPLACE INTO blacklist (id, nickname_key, uuid_key, row) VALUES (?, ?, ?, ?)',
+                                 [_row_values(row) for row in rows])
+                conn.execute('DELETE FROM whitelist')
+                conn.executemany('INSERT OR IGNORE INTO whitelist (uuid) VALUES (?)', [(u,) for u in whitelist])
+                meta = {'synced_at': now, 'lease_until': 0}
+                if full:
+                    meta['full_at'] = now
+                if stamps:
+                    meta['cursor'] = max(stamps + ([cursor] if cursor and not full else []))
+                self._set_meta(conn, **meta)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            self._synced = (time.monotonic(), now)
+            logger.info("Mirror synced (%s): %d blacklist rows, %d whitelisted",
+                        'full' if full else 'changes', len(rows), len(whitelist))
+            return True
+        except Exception:
+            self._set_meta(conn, lease_until=0)
+            raise
+
+    # ── Поток ──
+    def _ensure_worker(self) -> None:
+        # Поток создаётся при первом обращении, уже в процессе воркера (после fork у Passenger)
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='mirror', daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        delay = REPLAY_SECONDS
+        while True:
+            ok = True
+            try:
+                ok = self.replay()
+            except Exception as e:
+                logger.error(f"Mirror outbox replay failed: {e}")
+                ok = False
+            try:
+                self.sync()
+            except Exception as e:
+                logger.warning(f"Mirror sync failed, serving data from {self.age() or 0:.0f}s ago: {e}")
+            delay = REPLAY_SECONDS if ok else min(delay * 2, MAX_BACKOFF)
+            time.sleep(delay)
+
+
+mirror = Mirror(PATH) if ENABLED else None
+if mirror is not None:
+    supabase_client.read_mirror = mirror
+
+
+def collect_metrics() -> Iterable[Family]:
+    if mirror is None:
+        return
+    try:
+        age, pending, failed = mirror.age(), mirror.pending(), mirror.failed()
+    except sqlite3.Error:
+        return
+    yield 'mirror_age_seconds', 'gauge', 'Seconds since the local mirror was last synced.', \
+        [({}, age)] if age is not None else []
+    yield 'mirror_outbox_size', 'gauge', 'Writes waiting in the mirror outbox.', [({}, pending)]
+    yield 'mirror_outbox_failed', 'gauge', 'Queued blacklist additions rejected on every replay.', [({}, failed)]
+
+
+REGISTRY.add_collector(collect_metrics)
@@ -0,0 +1,353 @@
+"""
+Mojang / Minecraft Services / Minotar lookups.
+
+Shared by the Flask views and the async API tier: both draw on the same
+600-per-10-minutes Mojang budget and the same in-process caches, so running
+them side by side in one process never doubles the upstream traffic.
+"""
+import asyncio
+import base64
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import httpx
+
+from http_client import outbound
+from metrics import REGISTRY, cache_collector
+
+logger = logging.getLogger(__name__)
+
+# ─────────────── Лимит Mojang API ───────────────
+_MAX_CALLS = 600
+_WINDOW_SEC = 10 * 60
+_call_times = deque()
+_budget_lock = threading.Lock()
+# Вызывается перед каждым походом в Mojang (промах кэша); rate_limit.py списывает тут бюджет клиента
+before_upstream_call: Optional[Callable[[], None]] = None
+
+UUID_URL = "https://api.mojang.com/users/profiles/minecraft/{name}"
+NAME_URL = "https://api.minecraftservices.com/minecraft/profile/lookup/{uuid}"
+BULK_UUID_URL = "https://api.minecraftservices.com/minecraft/profile/lookup/bulk/byname"
+BULK_LIMIT = 10  # ников за один запрос bulk/byname
+AVATAR_URL = "https://minotar.net/helm/{uuid}/{size}.png"
+
+
+def _reserve_call() -> float:
+    """Book a slot in the shared budget. Returns 0 when booked, otherwise seconds to wait."""
+    with _budget_lock:
+        now = time.time()
+        while _call_times and _call_times[0] <= now - _WINDOW_SEC:
+            _call_times.popleft()
+        if len(_call_times) >= _MAX_CALLS:
+            return _WINDOW_SEC - (now - _call_times[0]) + 0.1
+        _call_times.append(now)
+        return 0.0
+
+
+def _throttle() -> None:
+    if before_upstream_call is not None:
+        before_upstream_call()
+    delay = _reserve_call()
+    while delay:
+        time.sleep(delay)
+        delay = _reserve_call()
+
+
+async def _athrottle() -> None:
+    if before_upstream_call is not None:
+        before_upstream_call()
+    delay = _reserve_call()
+    while delay:
+        await asyncio.sleep(delay)
+        delay = _reserve_call()
+
+
+# ─────────────── Кэши ───────────────
+_MISSING = object()
+
+
+class LRUCache:
+    """Small thread-safe LRU; unlike functools.lru_cache it can be read without calling through."""
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._data: 'OrderedDict[Any, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return _MISSING
+            self.hits += 1
+            return self._data[key]
+
+    def set(self, key: Any, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key: Any) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+_uuid_cache = LRUCache(maxsize=512)   # lower-cased nickname -> uuid | None
+_name_cache = LRUCache(maxsize=512)   # undashed uuid -> nickname | None
+REGISTRY.add_collector(cache_collector('mojang_uuid', _uuid_cache))
+REGISTRY.add_collector(cache_collector('mojang_name', _name_cache))
+
+
+def _retry_after(resp: httpx.Response) -> float:
+    retry_after = resp.headers.get("Retry-After")
+    try:
+        return float(retry_after) if retry_after else 5.0
+    except ValueError:
+        return 5.0
+
+
+def _parse_uuid_response(name: str, resp: httpx.Response) -> Tuple[Optional[str], bool]:
+    """Returns (uuid, cacheable). Network/5xx failures are not cached."""
+    if resp.status_code in (204, 404):
+        # Никнейм не существует
+        logger.debug(f"UUID for '{name}' not found ({resp.status_code}).")
+        return None, True
+    try:
+        resp.raise_for_status()
+        data = resp.json()
+        uuid = data.get("id")
+    except httpx.HTTPStatusError as e:
+        logger.error(f"Mojang API HTTP {e.response.status_code} for '{name}'")
+        return None, False
+    except ValueError as e:
+        logger.error(f"JSON parse error for '{name}': {e}")
+        return None, False
+    if not uuid:
+        logger.info(f"Nickname '{name}' not found (empty response).")
+    elif data.get("name"):
+        # Ответ содержит и точное написание ника — заодно кэшируем обратное направление
+        _name_cache.set(uuid.replace('-', ''), data["name"])
+    return uuid, True
+
+
+def _parse_name_response(u: str, resp: httpx.Response) -> Tuple[Optional[str], bool]:
+    if resp.status_code in (204, 404):
+        logger.debug(f"UUID '{u}' not found ({resp.status_code}).")
+        return None, True
+    try:
+        resp.raise_for_status()
+        name = resp.json().get("name")
+    except httpx.HTTPStatusError as e:
+        logger.error(f"HTTP {e.response.status_code} for lookup/{u}")
+        return None, False
+    except ValueError as e:
+        logger.error(f"Error fetching name for '{u}': {e}")
+        return None, False
+    if not name:
+        logger.info(f"No name field in response for '{u}'")
+    return name, True
+
+
+def get_uuid_from_nickname(nickname: str) -> Optional[str]:
+    """
+    Получить Minecraft UUID по нику через Mojang API.
+    — Кэш на 512 записей (общий с async-версией).
+    — Учитывает лимит 600/10мин.
+    — Разные уровни логирования для 404 и 429.
+    """
+    name = nickname.strip()
+    if not name:
+        return None
+    cached = _uuid_cache.get(name.lower())
+    if cached is not _MISSING:
+        return cached
+
+    _throttle()
+    try:
+        resp = outbound.get(UUID_URL.format(name=name))
+    except httpx.HTTPError as e:
+        logger.error(f"Network error retrieving UUID for '{name}': {e}")
+        return None
+    # Обрабатываем 429 вручную
+    if resp.status_code == 429:
+        delay = _retry_after(resp)
+        logger.warning(f"429 for '{name}', retrying after {delay}s")
+        time.sleep(delay)
+        return get_uuid_from_nickname(name)  # повторяем после задержки
+
+    uuid, cacheable = _parse_uuid_response(name, resp)
+    if cacheable:
+        _uuid_cache.set(name.lower(), uuid)
+    return uuid
+
+
+async def aget_uuid_from_nickname(nickname: str) -> Optional[str]:
+    name = nickname.strip()
+    if not name:
+        return None
+    cached = _uuid_cache.get(name.lower())
+    if cached is not _MISSING:
+        return cached
+
+    await _athrottle()
+    try:
+        resp = await outbound.aget(UUID_URL.format(name=name))
+    except httpx.HTTPError as e:
+        logger.error(f"Network error retrieving UUID for '{name}': {e}")
+        return None
+    if resp.status_code == 429:
+        delay = _retry_after(resp)
+        logger.warning(f"429 for '{name}', retrying after {delay}s")
+        await asyncio.sleep(delay)
+        return await aget_uuid_from_nickname(name)
+
+    uuid, cacheable = _parse_uuid_response(name, resp)
+    if cacheable:
+        _uuid_cache.set(name.lower(), uuid)
+    return uuid
+
+
+def get_name_from_uuid(uuid: str) -> Optional[str]:
+    """
+    Получить текущий ник по UUID через Minecraft Services API.
+    Эндпоинт: https://api.minecraftservices.com/minecraft/profile/lookup/{uuid}
+    """
+    u = uuid.replace('-', '').strip()
+    if not u:
+        return None
+    cached = _name_cache.get(u)
+    if cached is not _MISSING:
+        return cached
+
+    _throttle()
+    try:
+        resp = outbound.get(NAME_URL.format(uuid=u))
+    except httpx.HTTPError as e:
+        logger.error(f"Error fetching name for '{u}': {e}")
+        return None
+    # 429: учитываем Retry-After
+    if resp.status_code == 429:
+        delay = _retry_after(resp)
+        logger.warning(f"429 for '{u}', retry after {delay}s")
+        time.sleep(delay)
+        return get_name_from_uuid(u)
+
+    name, cacheable = _parse_name_response(u, resp)
+    if cacheable:
+        _name_cache.set(u, name)
+    return name
+
+
+async def aget_name_from_uuid(uuid: str) -> Optional[str]:
+    u = uuid.replace('-', '').strip()
+    if not u:
+        return None
+    cached = _name_cache.get(u)
+    if cached is not _MISSING:
+        return cached
+
+    await _athrottle()
+    try:
+        resp = await outbound.aget(NAME_URL.format(uuid=u))
+    except httpx.HTTPError as e:
+        logger.error(f"Error fetching name for '{u}': {e}")
+        return None
+    if resp.status_code == 429:
+        delay = _retry_after(resp)
+        logger.warning(f"429 for '{u}', retry after {delay}s")
+        await asyncio.sleep(delay)
+        return await aget_name_from_uuid(u)
+
+    name, cacheable = _parse_name_response(u, resp)
+    if cacheable:
+        _name_cache.set(u, name)
+    return name
+
+
+def cached_uuid(nickname: str) -> Any:
+    """UUID from the cache without calling out: a str, None (known not to exist) or MISSING."""
+    return _uuid_cache.get(nickname.strip().lower())
+
+
+def cached_name(uuid: str) -> Any:
+    """Current nickname from the cache without calling out: a str, None or MISSING."""
+    return _name_cache.get(uuid.replace('-', '').strip())
+
+
+def forget(uuid: Optional[str] = None, nickname: Optional[str] = None) -> None:
+    """Drop cached lookups for a player who renamed, so the next one asks Mojang."""
+    if uuid:
+        _name_cache.discard(uuid.replace('-', '').strip())
+    if nickname:
+        _uuid_cache.discard(nickname.strip().lower())
+
+
+MISSING = _MISSING
+
+
+def get_profiles_by_nicknames(nicknames: Iterable[str]) -> Dict[str, Optional[Tuple[str, str]]]:
+    """
+    Bulk nickname lookup: lower-cased nickname -> (uuid, exact nickname), or None if it does not exist.
+    Cached names cost nothing; the rest go BULK_LIMIT per request, each request
+    is one call against the shared budget. Names whose chunk failed are left out.
+    """
+    result: Dict[str, Optional[Tuple[str, str]]] = {}
+    pending = []
+    for nickname in dict.fromkeys(n.strip() for n in nicknames if n and n.strip()):
+        key = nickname.lower()
+        uuid = _uuid_cache.get(key)
+        if uuid is _MISSING:
+            pending.append(nickname)
+        elif uuid is None:
+            result[key] = None
+        else:
+            name = _name_cache.get(uuid)
+            result[key] = (uuid, nickname if name is _MISSING or not name else name)
+
+    for i in range(0, len(pending), BULK_LIMIT):
+        chunk = pending[i:i + BULK_LIMIT]
+        _throttle()
+        try:
+            resp = outbound.request('POST', BULK_UUID_URL, json=chunk)
+        except httpx.HTTPError as e:
+            logger.error(f"Network error in bulk UUID lookup: {e}")
+            continue
+        if resp.status_code == 429:
+            logger.warning(f"429 in bulk UUID lookup, {len(pending) - i} names left unresolved")
+            break
+        try:
+            resp.raise_for_status()
+            found = {p['name'].lower(): (p['id'], p['name']) for p in resp.json() if p.get('id') and p.get('name')}
+        except (httpx.HTTPStatusError, ValueError, TypeError, KeyError) as e:
+            logger.error(f"Bulk UUID lookup failed: {e}")
+            continue
+        for nickname in chunk:
+            key = nickname.lower()
+            profile = found.get(key)
+            _uuid_cache.set(key, profile[0] if profile else None)
+            if profile:
+                _name_cache.set(profile[0], profile[1])
+            result[key] = profile
+    return result
+
+
+# ─────────────── Аватарки (Minotar) ───────────────
+def avatar_url(uuid: str, size: int = 32) -> str:
+    return AVATAR_URL.format(uuid=uuid, size=size)
+
+
+def to_data_uri(content: bytes) -> str:
+    return f"data:image/png;base64,{base64.b64encode(content).decode('ascii')}"
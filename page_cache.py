@@ -0,0 +1,142 @@
+"""
+Rendered-page cache for anonymous GETs of the public pages.
+
+Views opt in with ``@cache_page``. A hit is served from a before_request hook,
+so an anonymous page view costs a dict lookup instead of a Jinja render plus
+the JWT work in ``inject_user``. Nothing is cached or served when:
+
+* the request carries a JWT cookie (the page shows the admin menu);
+* the request has a query string or a pending flash message;
+* rendering generated a CSRF token (the page holds a form) or the response
+  sets a cookie. "/" renders the check form on every GET, so it is not marked.
+
+Keys are (endpoint, template version, locale). The template version is a hash
+of the templates directory taken at startup, so a deploy (git pull + restart)
+never serves pages rendered from old templates.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, NamedTuple, Optional, Tuple
+
+from flask import Flask, Response, current_app, g, request, session
+
+from metrics import REGISTRY, cache_collector
+
+MAX_BYTES = int(os.getenv('PAGE_CACHE_MAX_BYTES', str(4 * 1024 * 1024)))
+SUPPORTED_LOCALES = ('ru',)
+DEFAULT_LOCALE = 'ru'
+
+
+class CachedPage(NamedTuple):
+    body: bytes
+    status: int
+    mimetype: str
+
+
+class PageCache:
+    """LRU bounded by the total size of cached bodies."""
+
+    def __init__(self, max_bytes: int = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: 'OrderedDict[Tuple, CachedPage]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[CachedPage]:
+        with self._lock:
+            page = self._data.get(key)
+            if page is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return page
+
+    def set(self, key: Tuple, page: CachedPage) -> None:
+        if len(page.body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= len(old.body)
+            self._data[key] = page
+            self.size += len(page.body)
+            while self.size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= len(evicted.body)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+pages = PageCache()
+REGISTRY.add_collector(cache_collector('pages', pages))
+
+
+def cache_page(view: Callable) -> Callable:
+    """Mark a view as cacheable for anonymous GETs."""
+    view._page_cache = True
+    return view
+
+
+def template_version(template_dir: str) -> str:
+    digest = hashlib.sha1()
+    for root, _, files in sorted(os.walk(template_dir)):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(path.encode())
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def _cache_key(version: str) -> Optional[Tuple]:
+    if request.method != 'GET' or request.query_string:
+        return None
+    view = current_app.view_functions.get(request.endpoint)
+    if not getattr(view, '_page_cache', False):
+        return None
+    if current_app.config.get('JWT_ACCESS_COOKIE_NAME', 'access_token_cookie') in request.cookies:
+        return None
+    if session.get('_flashes'):
+        return None
+    locale = request.accept_languages.best_match(SUPPORTED_LOCALES) or DEFAULT_LOCALE
+    return request.endpoint, version, locale
+
+
+def init_app(app: Flask) -> None:
+    version = template_version(os.path.join(app.root_path, app.template_folder))
+    csrf_field = app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token')
+
+    @app.before_request
+    def _serve_cached_page():
+        key = _cache_key(version)
+        if key is None:
+            return None
+        g.page_cache_key = key
+        page = pages.get(key)
+        if page is None:
+            return None
+        response = Response(page.body, status=page.status, mimetype=page.mimetype)
+        response.vary.update(('Cookie', 'Accept-Language'))
+        response.headers['X-Page-Cache'] = 'HIT'
+        return response
+
+    @app.after_request
+    def _store_page(response):
+        key = g.pop('page_cache_key', None)
+        if key is None or 'X-Page-Cache' in response.headers:
+            return response
+        response.vary.update(('Cookie', 'Accept-Language'))
+        if (response.status_code != 200 or response.direct_passthrough
+                or csrf_field in g or response.headers.get('Set-Cookie')):
+            return response
+        pages.set(key, CachedPage(response.get_data(), response.status_code, response.mimetype))
+        response.headers['X-Page-Cache'] = 'MISS'
+        return response
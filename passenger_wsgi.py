@@ -3,11 +3,20 @@ import sys
 
 # Add the application directory to the Python path
 INTERP = os.path.expanduser("/var/www/u3085459/data/flaskenv/bin/python")
-if sys.executable != INTERP:
+# Перезапуск под venv-интерпретатором только если он действительно другой: сравниваем
+# реальные пути (симлинки venv), а без venv (локально) не падаем на execl
+if os.path.exists(INTERP) and os.path.realpath(sys.executable) != os.path.realpath(INTERP):
     os.execl(INTERP, INTERP, *sys.argv)
 
 # Add the application directory to the Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+import startup  # noqa: E402 — отсчёт фаз старта
+
 # Import and create the application
-from app import app as application
+from app import app as application  # noqa: E402
+
+# Passenger не пускает запросы, пока модуль не загружен: прогреваем кэши и соединения здесь
+if startup.WARMUP_ENABLED:
+    startup.warm_up(application)
+application.logger.info(startup.summary())
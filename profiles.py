@@ -0,0 +1,169 @@
+"""
+Nickname -> profile resolution for the API.
+
+Sources are tried cheapest first:
+
+1. the in-process Mojang caches (mojang.py);
+2. the blacklist: UUIDs we already store, one Supabase query for the whole batch;
+3. Mojang itself, through the bulk lookup under the shared 600/10min budget
+   (and the caller's rate limit, see rate_limit.py).
+
+Blacklist hits are not written into the Mojang caches: the stored nickname may
+be stale, and those caches must only hold what Mojang said.
+
+The other direction (UUID -> current nickname + avatar) is used to enrich list
+rows: ``enrich_entries`` only reads the cache, so a page of /api/fullist costs
+no upstream calls; ``details_many`` also asks Mojang for the names it lacks
+(the batch endpoint and the player map use it).
+Avatars are returned as Minotar URLs, which the browser and the service
+worker cache, instead of being downloaded and inlined by the server.
+"""
+import contextvars
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import invalidation
+import mojang
+from supabase_client import db
+
+NICKNAME_RE = re.compile(r'^[A-Za-z0-9_]{1,16}$')
+UUID_RE = re.compile(r'^[0-9a-f]{32}$')
+BATCH_LIMIT = 100
+LOOKUP_LIMIT = 25  # походов в Mojang на один batch-запрос (из общих 600/10 мин)
+LOOKUP_WORKERS = 8
+AVATAR_SIZE = 50  # как рисует список в infinite-scroll.js
+MAP_AVATAR_SIZE = 32  # карта игроков (admin_map.html)
+
+_lookup_pool: Optional[ThreadPoolExecutor] = None
+_lookup_pool_lock = threading.Lock()
+
+
+# Другой воркер записал смену ника (add_nickname_history): старые ответы Mojang в нашем кэше устарели
+invalidation.subscribe('profiles', lambda op, row: mojang.forget(row.get('uuid'), row.get('nickname')))
+
+
+class Profile(NamedTuple):
+    nickname: str
+    uuid: str
+    source: str  # 'cache' | 'blacklist' | 'mojang'
+
+
+def is_valid_nickname(nickname: str) -> bool:
+    return bool(NICKNAME_RE.match(nickname))
+
+
+def normalize_uuid(value: str) -> Optional[str]:
+    """32 lower-case hex digits without dashes, or None if ``value`` is not a UUID."""
+    compact = value.replace('-', '').strip().lower()
+    return compact if UUID_RE.match(compact) else None
+
+
+def resolve_many(nicknames: Iterable[str]) -> Dict[str, Optional[Profile]]:
+    """
+    Lower-cased nickname -> Profile, or None when the nickname does not exist.
+    Nicknames that could not be resolved (invalid, or Mojang unavailable) are left out.
+    """
+    result: Dict[str, Optional[Profile]] = {}
+    pending: List[str] = []
+    for nickname in dict.fromkeys(n.strip() for n in nicknames if n):
+        if not is_valid_nickname(nickname):
+            continue
+        uuid = mojang.cached_uuid(nickname)
+        if uuid is mojang.MISSING:
+            pending.append(nickname)
+        elif uuid is None:
+            result[nickname.lower()] = None
+        else:
+            name = mojang.cached_name(uuid)
+            exact = name if name is not mojang.MISSING and name else nickname
+            result[nickname.lower()] = Profile(exact, uuid, 'cache')
+    if not pending:
+        return result
+
+    known = db.get_blacklist_entries_by_nicknames(pending)
+    for key, entry in known.items():
+        result[key] = Profile(entry['nickname'], entry['uuid'], 'blacklist')
+    pending = [n for n in pending if n.lower() not in known]
+    if not pending:
+        return result
+
+    for key, found in mojang.get_profiles_by_nicknames(pending).items():
+        result[key] = Profile(found[1], found[0], 'mojang') if found else None
+    return result
+
+
+def resolve(nickname: str) -> Optional[Profile]:
+    """Profile for one nickname; raises LookupError when it could not be resolved right now."""
+    key = nickname.strip().lower()
+    result = resolve_many([nickname])
+    if key not in result:
+        raise LookupError(nickname)
+    return result[key]
+
+
+def cached_nickname(uuid: str) -> Optional[str]:
+    name = mojang.cached_name(uuid)
+    return None if name is mojang.MISSING else name
+
+
+def player_details(uuid: str, nickname: Optional[str], size: int = AVATAR_SIZE) -> Dict[str, Optional[str]]:
+    return {"uuid": uuid, "nickname": nickname, "avatar_url": mojang.avatar_url(uuid, size)}
+
+
+def enrich_entries(items: List[dict]) -> List[dict]:
+    """
+    Add ``current_nickname`` (from the Mojang cache, else the stored one) and
+    ``avatar_url`` to blacklist rows in place. Never calls out.
+    """
+    for entry in items:
+        uuid = entry.get('uuid')
+        if not uuid:
+            continue
+        entry['current_nickname'] = cached_nickname(uuid) or entry.get('nickname')
+        entry['avatar_url'] = mojang.avatar_url(uuid, AVATAR_SIZE)
+    return items
+
+
+def lookup_plan(uuids: Iterable[str]) -> Tuple[Dict[str, Optional[str]], List[str]]:
+    """
+    Split a batch into names already known (from the cache) and UUIDs to ask
+    Mojang for, at most LOOKUP_LIMIT of them; the misses past the limit get
+    nickname None, and the client can ask for them again.
+    """
+    names: Dict[str, Optional[str]] = {}
+    misses: List[str] = []
+    for uuid in dict.fromkeys(uuids):
+        name = mojang.cached_name(uuid)
+        if name is mojang.MISSING:
+            if len(misses) < LOOKUP_LIMIT:
+                misses.append(uuid)
+            name = None
+        names[uuid] = name
+    return names, misses
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _lookup_pool
+    # Пул создаётся при первом batch-запросе, уже в процессе воркера (после fork у Passenger)
+    with _lookup_pool_lock:
+        if _lookup_pool is None:
+            _lookup_pool = ThreadPoolExecutor(max_workers=LOOKUP_WORKERS, thread_name_prefix='profiles')
+        return _lookup_pool
+
+
+def details_many(uuids: Iterable[str], size: int = AVATAR_SIZE) -> Dict[str, Dict[str, Optional[str]]]:
+    """
+    UUID (as given) -> player_details. Cache hits are answered at once; the
+    misses are looked up concurrently, LOOKUP_WORKERS at a time, still under
+    the shared Mojang budget and billed to the calling client.
+    """
+    names, misses = lookup_plan(uuids)
+    if misses:
+        pool = _pool()
+        # copy_context: charge_mojang в потоке пула должен видеть клиента запроса (rate_limit._current_client)
+        futures = [pool.submit(contextvars.copy_context().run, mojang.get_name_from_uuid, uuid) for uuid in misses]
+        for uuid, future in zip(misses, futures):
+            names[uuid] = future.result()
+    return {uuid: player_details(uuid, name, size) for uuid, name in names.items()}
@@ -0,0 +1,209 @@
+"""
+Opt-in profiling for slow routes.
+
+* Per request: an owner sends ``X-Profile: 1`` (or ``?_profile=1``) and the
+  request runs under cProfile. The top frames by self time come back in a
+  ``Server-Timing`` header and the full report is kept in memory
+  (``X-Profile-Report`` points at it).
+* Per route: ``arm(endpoint, n)`` profiles the next n requests to an endpoint
+  regardless of who sends them. Their reports are listed on /admin/profiles;
+  the response headers are added only when the owner sent the request.
+* Continuous: with ``PROFILE_SAMPLING_HZ`` > 0 a background thread samples
+  every worker thread's stack and aggregates folded stacks per endpoint,
+  ready for flamegraph.pl or speedscope.
+
+With nothing armed and sampling off, the only per-request cost is one header
+lookup and one dict lookup.
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from typing import Callable, Dict, List, Optional
+
+from flask import Flask, g, request
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_QUERY_ARG = '_profile'
+TOP_FRAMES = 8
+MAX_REPORTS = 50
+MAX_STACKS_PER_ROUTE = 5000
+SAMPLING_HZ = float(os.getenv('PROFILE_SAMPLING_HZ', '0') or 0)
+
+_reports: 'deque[Dict]' = deque(maxlen=MAX_REPORTS)
+_armed: Dict[str, int] = {}
+_armed_lock = threading.Lock()
+
+# Continuous sampling state: thread id -> endpoint being served, endpoint -> folded stack counts
+_active: Dict[int, str] = {}
+_flamegraphs: Dict[str, Counter] = {}
+_flamegraphs_lock = threading.Lock()  # сэмплер пишет, /flamegraph читает — без него "dict changed size during iteration"
+_sampler: Optional[threading.Thread] = None
+
+
+def arm(endpoint: str, count: int) -> None:
+    """Profile the next ``count`` requests to ``endpoint`` (0 disarms)."""
+    with _armed_lock:
+        if count > 0:
+            _armed[endpoint] = count
+        else:
+            _armed.pop(endpoint, None)
+
+
+def armed() -> Dict[str, int]:
+    return dict(_armed)
+
+
+def _take_armed(endpoint: Optional[str]) -> bool:
+    if not _armed or endpoint not in _armed:
+        return False
+    with _armed_lock:
+        remaining = _armed.get(endpoint, 0)
+        if remaining <= 0:
+            return False
+        if remaining == 1:
+            del _armed[endpoint]
+        else:
+            _armed[endpoint] = remaining - 1
+    return True
+
+
+def _frame_label(func: tuple) -> str:
+    filename, lineno, name = func
+    return f"{os.path.basename(filename)}:{lineno}({name})" if lineno else name
+
+
+def _finish_profile(profiler: cProfile.Profile, response, started: float, owner: bool):
+    """Store the report; only the owner's own requests get Server-Timing and X-Profile-Report."""
+    profiler.disable()
+    total_ms = (time.perf_counter() - started) * 1000
+    stats = pstats.Stats(profiler)
+    top = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:TOP_FRAMES]
+
+    timings = [f'total;dur={total_ms:.1f}']
+    for i, (func, (_, _, tottime, _, _)) in enumerate(top):
+        desc = _frame_label(func).replace('"', "'")
+        timings.append(f'prof{i};desc="{desc}";dur={tottime * 1000:.1f}')
+
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(40)
+    report_id = uuid.uuid4().hex[:12]
+    _reports.appendleft({
+        'id': report_id,
+        'endpoint': request.endpoint,
+        'path': request.full_path,
+        'timestamp': time.time(),
+        'total_ms': round(total_ms, 2),
+        'report': out.getvalue(),
+    })
+    if owner:
+        # Взведённый профиль мог поймать чужой запрос — тайминги и id отчёта видит только владелец (/admin/profiles)
+        response.headers.add('Server-Timing', ', '.join(timings))
+        response.headers['X-Profile-Report'] = f'/admin/profiles/{report_id}'
+    return response
+
+
+def reports() -> List[Dict]:
+    return [{k: v for k, v in r.items() if k != 'report'} for r in _reports]
+
+
+def get_report(report_id: str) -> Optional[Dict]:
+    return next((r for r in _reports if r['id'] == report_id), None)
+
+
+# ─────────────── Непрерывный сэмплирующий режим ───────────────
+def _collapse(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(parts))
+
+
+def _sample_forever(interval: float) -> None:
+    me = threading.get_ident()
+    while True:
+        time.sleep(interval)
+        if not _active:
+            continue
+        frames = sys._current_frames()
+        for thread_id, endpoint in list(_active.items()):
+            frame = frames.get(thread_id)
+            if frame is None or thread_id == me:
+                continue
+            stack = _collapse(frame)
+            with _flamegraphs_lock:
+                stacks = _flamegraphs.setdefault(endpoint, Counter())
+                if stack in stacks or len(stacks) < MAX_STACKS_PER_ROUTE:
+                    stacks[stack] += 1
+
+
+def flamegraph(endpoint: Optional[str] = None) -> str:
+    """Folded stacks ("a;b;c count" per line) for one endpoint or all of them."""
+    with _flamegraphs_lock:
+        snapshot = {name: stacks.copy() for name, stacks in _flamegraphs.items()
+                    if not endpoint or name == endpoint}
+    lines = []
+    for name, stacks in sorted(snapshot.items()):
+        for stack, count in stacks.most_common():
+            lines.append(f"{name};{stack} {count}")
+    return '\n'.join(lines) + '\n'
+
+
+def sampled_endpoints() -> Dict[str, int]:
+    with _flamegraphs_lock:
+        return {name: sum(stacks.values()) for name, stacks in _flamegraphs.items()}
+
+
+# ─────────────── Подключение к Flask ───────────────
+def init_app(app: Flask, is_owner: Callable[[], bool]) -> None:
+    @app.before_request
+    def _start_profile():
+        requested = request.headers.get(PROFILE_HEADER) or (
+            PROFILE_QUERY_ARG in request.args and request.args.get(PROFILE_QUERY_ARG))
+        owner = bool(requested) and is_owner()
+        if owner or _take_armed(request.endpoint):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                return  # another profiler is already active in this interpreter
+            g.profiler = profiler
+            g.profile_started = time.perf_counter()
+            g.profile_owner = owner or is_owner()
+
+    @app.after_request
+    def _stop_profile(response):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            return _finish_profile(profiler, response, g.pop('profile_started'), g.pop('profile_owner', False))
+        return response
+
+    @app.teardown_request
+    def _drop_profile(exc):
+        # after_request не вызывается при необработанном исключении — не оставляем профайлер включённым
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+    if SAMPLING_HZ > 0:
+        global _sampler
+
+        @app.before_request
+        def _track_endpoint():
+            _active[threading.get_ident()] = request.endpoint or 'unmatched'
+
+        @app.teardown_request
+        def _untrack_endpoint(exc):
+            _active.pop(threading.get_ident(), None)
+
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_forever, args=(1.0 / SAMPLING_HZ,),
+                                        name='profile-sampler', daemon=True)
+            _sampler.start()
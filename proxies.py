@@ -0,0 +1,130 @@
+"""
+Client IP resolution behind Cloudflare and local reverse proxies.
+
+Forwarding headers are honoured only when they come from a trusted hop:
+Cloudflare's published ranges, loopback, and whatever TRUSTED_PROXIES (comma
+separated CIDRs) adds. The X-Forwarded-For chain is walked right to left and
+the first untrusted address is the client; a request that reaches the origin
+directly gets its socket address no matter what headers it sends.
+
+The CIDR lists are compiled once into sorted integer ranges, so a lookup is
+one bisect per address instead of parsing every network on every request.
+"""
+import ipaddress
+import os
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Union
+
+IPAddress = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+# Cloudflare IP ranges
+CLOUDFLARE_IPV4 = [
+    "173.245.48.0/20",
+    "103.21.244.0/22",
+    "103.22.200.0/22",
+    "103.31.4.0/22",
+    "141.101.64.0/18",
+    "108.162.192.0/18",
+    "190.93.240.0/20",
+    "188.114.96.0/20",
+    "197.234.240.0/22",
+    "198.41.128.0/17",
+    "162.158.0.0/15",
+    "104.16.0.0/13",
+    "104.24.0.0/14",
+    "172.64.0.0/13",
+    "131.0.72.0/22"
+]
+
+CLOUDFLARE_IPV6 = [
+    "2400:cb00::/32",
+    "2606:4700::/32",
+    "2803:f800::/32",
+    "2405:b500::/32",
+    "2405:8100::/32",
+    "2a06:98c0::/29",
+    "2c0f:f248::/32"
+]
+
+LOCAL_PROXIES = ["127.0.0.0/8", "::1/128"]
+TRUSTED_PROXIES = [c.strip() for c in os.getenv('TRUSTED_PROXIES', '').split(',') if c.strip()]
+
+
+class NetworkTable:
+    """Sorted, merged integer ranges per IP version; membership is a bisect."""
+
+    def __init__(self, cidrs: Iterable[str]):
+        ranges: Dict[int, List[List[int]]] = {4: [], 6: []}
+        for cidr in cidrs:
+            net = ipaddress.ip_network(cidr, strict=False)
+            ranges[net.version].append([int(net.network_address), int(net.broadcast_address)])
+        self._starts: Dict[int, List[int]] = {}
+        self._ends: Dict[int, List[int]] = {}
+        for version, items in ranges.items():
+            merged: List[List[int]] = []
+            for start, end in sorted(items):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            self._starts[version] = [s for s, _ in merged]
+            self._ends[version] = [e for _, e in merged]
+
+    def __contains__(self, ip: IPAddress) -> bool:
+        value = int(ip)
+        i = bisect_right(self._starts[ip.version], value) - 1
+        return i >= 0 and value <= self._ends[ip.version][i]
+
+
+CLOUDFLARE = NetworkTable(CLOUDFLARE_IPV4 + CLOUDFLARE_IPV6)
+TRUSTED = NetworkTable(LOCAL_PROXIES + TRUSTED_PROXIES)
+
+
+def parse_ip(value: Optional[str]) -> Optional[IPAddress]:
+    if not value:
+        return None
+    try:
+        ip = ipaddress.ip_address(value.strip())
+    except ValueError:
+        return None
+    if ip.version == 6 and ip.ipv4_mapped:
+        return ip.ipv4_mapped
+    return ip
+
+
+@lru_cache(maxsize=4096)
+def _hop_kind(value: str) -> str:
+    """'cloudflare', 'proxy', 'client' or 'invalid' for one address string."""
+    ip = parse_ip(value)
+    if ip is None:
+        return 'invalid'
+    if ip in CLOUDFLARE:
+        return 'cloudflare'
+    if ip in TRUSTED:
+        return 'proxy'
+    return 'client'
+
+
+def is_cloudflare_ip(ip: str) -> bool:
+    """Check if an IP address belongs to Cloudflare's ranges."""
+    return _hop_kind(ip) == 'cloudflare'
+
+
+def client_ip(remote_addr: Optional[str], forwarded_for: Optional[str] = None,
+              cf_connecting_ip: Optional[str] = None) -> Optional[str]:
+    """Real client address from the socket peer and the forwarding headers it is allowed to set."""
+    hops = [h.strip() for h in forwarded_for.split(',')] if forwarded_for else []
+    hops.append(remote_addr or '')
+    previous = remote_addr
+    for hop in reversed(hops):
+        kind = _hop_kind(hop)
+        if kind == 'client':
+            return hop
+        if kind == 'invalid':
+            # Мусор в заголовке: дальше цепочке не верим, клиент — последний проверенный адрес
+            return previous
+        if kind == 'cloudflare' and parse_ip(cf_connecting_ip) is not None:
+            return cf_connecting_ip.strip()
+        previous = hop
+    return previous
@@ -0,0 +1,272 @@
+"""
+Token-bucket rate limits for the public API.
+
+Views opt in with ``@rate_limited``. Every request to such a view takes a token
+from the client's ``api`` bucket; on top of that every call that actually
+leaves for Mojang (a cache miss in mojang.py) takes one from the much smaller
+``mojang`` bucket, so one scraper cannot burn the shared 600/10min budget.
+Requests over the limit get 429 with Retry-After.
+
+The client is the X-API-Key holder when a valid key is sent (API_KEYS, as
+``name:key,...``; key holders get RATE_LIMIT_KEY_MULTIPLIER times the
+budgets), otherwise the real IP from proxies.client_ip.
+
+Buckets live in a bounded in-process table. With RATE_LIMIT_DB pointing at a
+SQLite file they are shared by all workers on the host instead (Passenger
+runs several); if that file is unavailable requests are let through.
+"""
+import contextvars
+import hmac
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+from flask import Flask, current_app, g, jsonify, request
+
+import mojang
+from metrics import Counter
+from proxies import client_ip
+
+logger = logging.getLogger(__name__)
+
+
+class Limit(NamedTuple):
+    capacity: float
+    period: float  # seconds to refill the full capacity
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+    @classmethod
+    def parse(cls, value: str) -> 'Limit':
+        """'<requests>/<seconds>', e.g. '120/60'."""
+        capacity, period = value.split('/', 1)
+        return cls(float(capacity), float(period))
+
+
+ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') != '0'
+LIMITS = {
+    'api': Limit.parse(os.getenv('RATE_LIMIT_API', '120/60')),
+    # Общий бюджет Mojang — 600 за 10 минут на всех; одному клиенту без ключа — 5% от него
+    'mojang': Limit.parse(os.getenv('RATE_LIMIT_MOJANG', '30/600')),
+}
+KEY_MULTIPLIER = float(os.getenv('RATE_LIMIT_KEY_MULTIPLIER', '10'))
+MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '50000'))
+SQLITE_PATH = os.getenv('RATE_LIMIT_DB')
+API_KEY_HEADER = 'X-API-Key'
+
+RATE_LIMITED = Counter('rate_limited_total', 'Requests rejected by the rate limiter.', ('scope',))
+
+
+def _parse_api_keys(value: str) -> Dict[str, str]:
+    keys = {}
+    for item in value.split(','):
+        name, sep, key = item.strip().partition(':')
+        if sep and key:
+            keys[name] = key
+    return keys
+
+
+API_KEYS = _parse_api_keys(os.getenv('API_KEYS', ''))
+
+
+class RateLimited(Exception):
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"{scope} rate limit exceeded")
+        self.scope = scope
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class InvalidAPIKey(Exception):
+    pass
+
+
+def _refill(state: Optional[Tuple[float, float]], limit: Limit, cost: float,
+            now: float) -> Tuple[Tuple[float, float], float]:
+    """New (tokens, updated) state and the wait in seconds (0 when the tokens were taken)."""
+    tokens, updated = state if state is not None else (limit.capacity, now)
+    tokens = min(limit.capacity, tokens + max(0.0, now - updated) * limit.rate)
+    if tokens >= cost:
+        return (tokens - cost, now), 0.0
+    return (tokens, now), (cost - tokens) / limit.rate
+
+
+class MemoryBuckets:
+    """
+    key -> (tokens, updated) in an OrderedDict kept in last-access order. Past
+    max_keys, idle (already full) buckets are popped from the front; when none
+    is idle, the least recently used one goes. Each call removes only what it
+    pops, so a flood of new keys costs O(1) per request.
+    """
+
+    def __init__(self, max_keys: int = MAX_KEYS):
+        self.max_keys = max_keys
+        self._data: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: Limit, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        with self._lock:
+            state, wait = _refill(self._data.pop(key, None), limit, cost, now)
+            self._data[key] = state  # в конец словаря: порядок вставки = порядок последнего обращения
+            if len(self._data) > self.max_keys:
+                self._sweep(now)
+        return wait
+
+    def _sweep(self, now: float) -> None:
+        idle = max(limit.period for limit in LIMITS.values())
+        # Спереди — давно не обращавшиеся ключи; первый живой значит, что дальше простаивающих нет
+        # OrderedDict: начало списка — O(1); у dict next(iter()) после удалений спереди деградирует
+        while self._data:
+            _, updated = next(iter(self._data.values()))
+            if now - updated < idle:
+                break
+            self._data.popitem(last=False)
+        while len(self._data) > self.max_keys:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class SQLiteBuckets:
+    """Same buckets in a SQLite table, so every worker process on the host sees one budget."""
+
+    SWEEP_EVERY = 60.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._last_sweep = 0.0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets '
+                         '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL) WITHOUT ROWID')
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, limit: Limit, cost: float = 1.0) -> float:
+        now = time.time()  # монотонные часы у каждого процесса свои
+        try:
+            conn = self._conn()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                state, wait = _refill(row, limit, cost, now)
+                conn.execute('INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) '
+                             'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                             (key, *state))
+                if now - self._last_sweep > self.SWEEP_EVERY:
+                    self._last_sweep = now
+                    idle = max(limit.period for limit in LIMITS.values())
+                    conn.execute('DELETE FROM buckets WHERE updated < ?', (now - idle,))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            logger.warning("Rate limit store unavailable, letting the request through: %s", e)
+            return 0.0
+        return wait
+
+    def clear(self) -> None:
+        self._conn().execute('DELETE FROM buckets')
+
+
+buckets = SQLiteBuckets(SQLITE_PATH) if SQLITE_PATH else MemoryBuckets()
+
+# Клиент текущего запроса; выставляется только для вью с @rate_limited,
+# поэтому вызовы Mojang из админки и фоновых задач не лимитируются
+_current_client: contextvars.ContextVar[Optional[Tuple[str, float]]] = contextvars.ContextVar(
+    'rate_limit_client', default=None)
+
+
+def identify(remote_addr: Optional[str], headers) -> Tuple[str, float]:
+    """(bucket key, budget multiplier) for a request; raises InvalidAPIKey for an unknown key."""
+    api_key = headers.get(API_KEY_HEADER)
+    if api_key:
+        for name, key in API_KEYS.items():
+            if hmac.compare_digest(api_key.encode(), key.encode()):
+                return f'key:{name}', KEY_MULTIPLIER
+        raise InvalidAPIKey()
+    ip = client_ip(remote_addr, headers.get('X-Forwarded-For'), headers.get('CF-Connecting-IP'))
+    return f'ip:{ip}', 1.0
+
+
+def take(scope: str, client: Tuple[str, float]) -> None:
+    """Take one token from the client's ``scope`` bucket or raise RateLimited."""
+    key, multiplier = client
+    base = LIMITS[scope]
+    wait = buckets.take(f'{scope}:{key}', Limit(base.capacity * multiplier, base.period))
+    if wait:
+        RATE_LIMITED.inc((scope,))
+        raise RateLimited(scope, wait)
+
+
+def enter(client: Tuple[str, float]) -> contextvars.Token:
+    """Charge the request and make ``client`` the one mojang.py calls are billed to."""
+    take('api', client)
+    return _current_client.set(client)
+
+
+def leave(token: contextvars.Token) -> None:
+    _current_client.reset(token)
+
+
+def charge_mojang() -> None:
+    """Bill one Mojang call to the current client, if the request is rate limited."""
+    client = _current_client.get()
+    if ENABLED and client is not None:
+        take('mojang', client)
+
+
+def rate_limited(view: Callable) -> Callable:
+    """Mark a view as rate limited per client."""
+    view._rate_limited = True
+    return view
+
+
+def too_many_requests(error: RateLimited):
+    body = {'error': 'Слишком много запросов, попробуйте позже', 'retry_after': error.retry_after}
+    response = jsonify(body)
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def init_app(app: Flask) -> None:
+    mojang.before_upstream_call = charge_mojang
+
+    @app.before_request
+    def _limit_request():
+        if not ENABLED:
+            return None
+        view = current_app.view_functions.get(request.endpoint)
+        if not getattr(view, '_rate_limited', False):
+            return None
+        try:
+            client = identify(request.remote_addr, request.headers)
+        except InvalidAPIKey:
+            return jsonify({'error': 'Invalid API key'}), 401
+        g.rate_limit_token = enter(client)
+        return None
+
+    @app.teardown_request
+    def _forget_client(exc):
+        token = g.pop('rate_limit_token', None)
+        if token is not None:
+            leave(token)
+
+    app.register_error_handler(RateLimited, too_many_requests)
@@ -0,0 +1,176 @@
+"""
+Background reconciliation of blacklist entries with Mojang.
+
+A positive check answers from the stored row and hands it to ``enqueue``;
+this module later asks Mojang who owns the nickname now. If the UUID has
+changed, the entry moves to it (the rule the check views used to apply
+inline); if nobody owns the name any more, the player has renamed and the
+entry takes the current name of its UUID. Either way the old name goes to
+nickname_history. Every entry that Mojang answered for gets ``last_verified_at``.
+
+* The queue is deduplicated by entry id and ordered by staleness: entries
+  never verified come first, then the oldest ``last_verified_at``.
+* Entries verified less than RECONCILE_MAX_AGE seconds ago are not queued.
+  The process also remembers when it verified each entry itself, so this
+  holds before migration 003 adds last_verified_at too; until then an entry
+  Mojang confirmed unchanged is not written at all.
+* One daemon thread per process works the queue at no more than
+  RECONCILE_PER_MINUTE entries, so the checks never wait on the Mojang
+  throttle and reconciliation takes a bounded share of the shared budget.
+* If Mojang is unavailable the entry is dropped; the next check queues it again.
+"""
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import mojang
+from metrics import REGISTRY, Counter, Family
+import supabase_client
+from supabase_client import db
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv('RECONCILE_ENABLED', '1') != '0'
+PER_MINUTE = float(os.getenv('RECONCILE_PER_MINUTE', '20'))
+MAX_AGE = float(os.getenv('RECONCILE_MAX_AGE', str(6 * 60 * 60)))
+MAX_QUEUE = int(os.getenv('RECONCILE_MAX_QUEUE', '1000'))
+
+# entry id -> когда этот процесс сверил запись (UNIX time); без миграции 003 это единственный след проверки
+_verified: Dict[Any, float] = {}
+
+RECONCILED = Counter('blacklist_reconciled_total', 'Blacklist entries reconciled with Mojang.', ('result',))
+
+
+def _verified_at(entry: Dict[str, Any]) -> float:
+    """When the entry was last verified (stored or by this process), as a UNIX timestamp; 0 if never."""
+    local = _verified.get(entry.get('id'), 0.0)
+    value = entry.get('last_verified_at')
+    if not value:
+        return local
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return local
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return max(parsed.timestamp(), local)
+
+
+def _mark_verified(entry_id: Any) -> None:
+    if len(_verified) > 10 * MAX_QUEUE:
+        _verified.clear()
+    _verified[entry_id] = time.time()
+
+
+def reconcile(entry: Dict[str, Any]) -> str:
+    """Check one entry against Mojang: 'updated', 'renamed', 'unchanged' or 'error'."""
+    nickname = entry['nickname']
+    old_uuid = entry.get('uuid') or ''
+    new_uuid = mojang.get_uuid_from_nickname(nickname)
+    if new_uuid is None and mojang.cached_uuid(nickname) is mojang.MISSING:
+        return 'error'  # Mojang не ответил; «ника нет» попало бы в кэш как None
+
+    changes: Dict[str, Any] = {'last_verified_at': datetime.now(timezone.utc).isoformat()}
+    result = 'unchanged'
+    if new_uuid is None and old_uuid:
+        # Ник свободен — игрок переименовался; текущий ник узнаём по UUID
+        current = mojang.get_name_from_uuid(old_uuid)
+        if current is None and mojang.cached_name(old_uuid) is mojang.MISSING:
+            return 'error'
+        if current and current != nickname:
+            changes['nickname'] = current
+            result = 'renamed'
+            logger.info("Blacklisted '%s' (%s) is now '%s'", nickname, old_uuid, current)
+    elif new_uuid and new_uuid.lower() != old_uuid.replace('-', '').lower():
+        changes['uuid'] = new_uuid
+        result = 'updated'
+        logger.info("UUID for blacklisted '%s' changed: %s -> %s", nickname, old_uuid, new_uuid)
+    # Без миграции 003 last_verified_at отбрасывается, и патч «ничего не изменилось» был бы пустым
+    if (result != 'unchanged' or supabase_client._schema['last_verified_at']) \
+            and not db.update_blacklist_entry(entry['id'], changes):
+        return 'error'
+    _mark_verified(entry['id'])
+    if result != 'unchanged' and old_uuid:
+        # В обоих случаях ник раньше принадлежал old_uuid
+        db.add_nickname_history(old_uuid, nickname)
+    return result
+
+
+class ReconcileQueue:
+    """Deduplicated, staleness-ordered queue with one rate-limited worker thread."""
+
+    def __init__(self, per_minute: float = PER_MINUTE, max_size: int = MAX_QUEUE):
+        self.interval = 60.0 / per_minute
+        self.max_size = max_size
+        self._heap: List[Tuple[float, int, Any]] = []  # (verified_at, seq, entry id)
+        self._entries: Dict[Any, Dict[str, Any]] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put(self, entry: Dict[str, Any]) -> bool:
+        """Queue an entry unless it is queued already, fresh, or the queue is full."""
+        entry_id = entry.get('id')
+        if entry_id is None or entry_id < 0 or not entry.get('nickname'):
+            return False  # отрицательный id — временная запись из очереди зеркала (mirror.py)
+        verified_at = _verified_at(entry)
+        if time.time() - verified_at < MAX_AGE:
+            return False
+        with self._cond:
+            if entry_id in self._entries or len(self._entries) >= self.max_size:
+                return False
+            self._entries[entry_id] = dict(entry)
+            heapq.heappush(self._heap, (verified_at, next(self._seq), entry_id))
+            self._ensure_worker()
+            self._cond.notify()
+        return True
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Stalest queued entry, waiting up to ``timeout`` seconds; None if there is none."""
+        with self._cond:
+            if not self._heap and not self._cond.wait_for(lambda: self._heap, timeout):
+                return None
+            _, _, entry_id = heapq.heappop(self._heap)
+            return self._entries.pop(entry_id)
+
+    def _ensure_worker(self) -> None:
+        # Поток создаётся при первой записи, уже в процессе воркера (после fork у Passenger)
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name='reconcile', daemon=True)
+            self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            entry = self.get()
+            started = time.monotonic()
+            try:
+                result = reconcile(entry)
+            except Exception as e:
+                logger.error(f"Reconciliation of blacklist entry {entry.get('id')} failed: {e}")
+                result = 'error'
+            RECONCILED.inc((result,))
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+queue = ReconcileQueue()
+
+
+def enqueue(entry: Dict[str, Any]) -> bool:
+    """Schedule a background check of an entry that was just served from stored data."""
+    return ENABLED and queue.put(entry)
+
+
+def collect_metrics() -> Iterable[Family]:
+    yield 'blacklist_reconcile_queue_size', 'gauge', 'Blacklist entries waiting for reconciliation.', \
+        [({}, len(queue))]
+
+
+REGISTRY.add_collector(collect_metrics)
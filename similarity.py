@@ -0,0 +1,232 @@
+"""
+Similar-nickname search over the blacklist (likely alt accounts).
+
+Nicknames are compared in a normalized form: lower case, trailing digits
+dropped, underscores removed, and look-alike characters folded (0 -> o;
+1, l, i -> i; 3 -> e; 4 -> a; 5 -> s; 7 -> t), so Gr1ef3r_99 and griefer
+land on the same key. The distance is Levenshtein between the keys:
+xX_Gr1ef3r_Xx99 becomes xxgrieferxx, two edits away from xxgriefer.
+
+The index is an in-process bigram inverted index over the keys. For a query
+it counts shared bigrams with ``Counter.update`` (C speed). An edit changes
+at most two bigrams, which gives a lower bound on the shared count and filters
+the candidates. Only those get an edit distance that gives up past the threshold, so a query
+over tens of thousands of names stays in single milliseconds.
+
+The index is built on first use from the whole table, paged by id. After that
+it follows writes through supabase_client.blacklist_listeners: this process's
+at once, other workers' through invalidation.py. It is also rebuilt in the
+background every SIMILAR_REBUILD_SECONDS, for anything the bus missed.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import supabase_client
+from supabase_client import PAGE_ROWS, db
+
+logger = logging.getLogger(__name__)
+
+MAX_DISTANCE = int(os.getenv('SIMILAR_MAX_DISTANCE', '2'))
+SHORT_KEY = 5  # ключам до стольких символов хватает расстояния 1, иначе похожим оказывается всё
+LIMIT = int(os.getenv('SIMILAR_LIMIT', '10'))
+REBUILD_SECONDS = float(os.getenv('SIMILAR_REBUILD_SECONDS', '600'))
+
+_FOLD = str.maketrans({'0': 'o', '1': 'i', 'l': 'i', '3': 'e', '4': 'a', '5': 's', '7': 't', '_': None})
+_TRAILING_DIGITS = re.compile(r'(?<=[^0-9_])[0-9_]+$')
+
+
+def normalize(nickname: str) -> str:
+    """Comparison key: look-alikes folded, underscores and the digit suffix dropped."""
+    return _TRAILING_DIGITS.sub('', nickname.strip().lower()).translate(_FOLD)
+
+
+def _bigrams(key: str) -> Set[str]:
+    padded = f'^{key}$'
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+def distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance, or limit + 1 as soon as it is known to exceed ``limit``."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if len(a) > len(b):
+        a, b = b, a
+    previous = list(range(len(a) + 1))
+    for j, cb in enumerate(b, 1):
+        current = [j]
+        best = j
+        for i, ca in enumerate(a, 1):
+            cost = min(previous[i] + 1, current[i - 1] + 1, previous[i - 1] + (ca != cb))
+            current.append(cost)
+            if cost < best:
+                best = cost
+        if best > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class Match(NamedTuple):
+    id: Any
+    nickname: str
+    uuid: Optional[str]
+    reason: Optional[str]
+    distance: int
+
+
+class SimilarityIndex:
+    """Bigram index over normalized blacklist nicknames, updated per entry."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys: Dict[str, int] = {}                   # key -> key id
+        self._key_list: List[Optional[str]] = []          # key id -> key (None once unused)
+        self._postings: Dict[str, Set[int]] = {}          # bigram -> key ids
+        self._entries: Dict[int, Dict[Any, Tuple[str, Optional[str], Optional[str]]]] = {}  # key id -> rows
+        self._entry_keys: Dict[Any, int] = {}             # entry id -> key id
+        self.built_at: Optional[float] = None
+        self._rebuilding = False
+
+    def __len__(self) -> int:
+        return len(self._entry_keys)
+
+    # ── Изменения ──
+    def add(self, row: Dict[str, Any]) -> None:
+        entry_id, nickname = row.get('id'), row.get('nickname')
+        if entry_id is None or not nickname:
+            return
+        key = normalize(nickname)
+        with self._lock:
+            self.remove(entry_id)
+            key_id = self._keys.get(key)
+            if key_id is None:
+                key_id = self._keys[key] = len(self._key_list)
+                self._key_list.append(key)
+                for gram in _bigrams(key):
+                    self._postings.setdefault(gram, set()).add(key_id)
+            self._entries.setdefault(key_id, {})[entry_id] = (nickname, row.get('uuid'), row.get('reason'))
+            self._entry_keys[entry_id] = key_id
+
+    def remove(self, entry_id: Any) -> None:
+        with self._lock:
+            key_id = self._entry_keys.pop(entry_id, None)
+            if key_id is None:
+                return
+            rows = self._entries[key_id]
+            rows.pop(entry_id, None)
+            if rows:
+                return
+            del self._entries[key_id]
+            key = self._key_list[key_id]
+            self._key_list[key_id] = None
+            del self._keys[key]
+            for gram in _bigrams(key):
+                postings = self._postings.get(gram)
+                if postings is not None:
+                    postings.discard(key_id)
+                    if not postings:
+                        del self._postings[gram]
+
+    def on_blacklist_change(self, op: str, row: Dict[str, Any]) -> None:
+        if self.built_at is None:
+            return  # ещё не строили: построение прочитает таблицу целиком
+        if op == 'delete':
+            self.remove(row.get('id'))
+        else:
+            self.add(row)
+
+    # ── Построение ──
+    def build(self) -> None:
+        """Replace the contents with the current table (paged by id, a few requests per thousand rows)."""
+        fresh = SimilarityIndex()
+        fresh.built_at = time.monotonic()  # изменения во время чтения уже попадут в fresh
+        supabase_client.blacklist_listeners.append(fresh.on_blacklist_change)
+        try:
+            last_id = 0
+            while True:
+                rows = db.client.table('blacklist_entry').select('id, nickname, uuid, reason') \
+                    .gt('id', last_id).order('id').limit(PAGE_ROWS).execute().data or []
+                for row in rows:
+                    fresh.add(row)
+                if len(rows) < PAGE_ROWS:
+                    break
+                last_id = rows[-1]['id']
+        finally:
+            supabase_client.blacklist_listeners.remove(fresh.on_blacklist_change)
+        with self._lock:
+            self._keys, self._key_list, self._postings = fresh._keys, fresh._key_list, fresh._postings
+            self._entries, self._entry_keys = fresh._entries, fresh._entry_keys
+            self.built_at = fresh.built_at
+        logger.info("Similarity index built: %d entries, %d keys", len(self), len(self._keys))
+
+    def ensure_built(self) -> None:
+        if self.built_at is None:
+            with self._lock:
+                if self.built_at is None:
+                    self.build()
+        elif time.monotonic() - self.built_at > REBUILD_SECONDS and not self._rebuilding:
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild, name='similarity-rebuild', daemon=True).start()
+
+    def _rebuild(self) -> None:
+        try:
+            self.build()
+        except Exception as e:
+            logger.error(f"Similarity index rebuild failed: {e}")
+        finally:
+            self._rebuilding = False
+
+    # ── Поиск ──
+    def search(self, nickname: str, max_distance: int = MAX_DISTANCE, limit: int = LIMIT,
+               exclude: Any = None) -> List[Match]:
+        """Closest entries by normalized distance, nearest first; ``exclude`` is an entry id to skip."""
+        key = normalize(nickname)
+        if not key:
+            return []
+        k = min(max_distance, 1) if len(key) <= SHORT_KEY else max_distance
+        grams = _bigrams(key)
+        # Правка задевает не больше двух биграмм, значит у ключа на расстоянии k общих хотя бы столько
+        need = len(grams) - 2 * k
+        with self._lock:
+            if need > 0:
+                counts = Counter()
+                for gram in grams:
+                    postings = self._postings.get(gram)
+                    if postings:
+                        counts.update(postings)
+                candidates = [key_id for key_id, shared in counts.items() if shared >= need]
+            else:
+                # Ключ так короток, что фильтр по биграммам ничего не отсекает — перебор по длине
+                candidates = [key_id for key_id, other in enumerate(self._key_list)
+                              if other is not None and abs(len(other) - len(key)) <= k]
+            found = []
+            for key_id in candidates:
+                other = self._key_list[key_id]
+                d = 0 if other == key else distance(key, other, k)
+                if d > k:
+                    continue
+                for entry_id, (name, uuid, reason) in self._entries[key_id].items():
+                    if entry_id != exclude:
+                        found.append(Match(entry_id, name, uuid, reason, d))
+        found.sort(key=lambda m: (m.distance, m.nickname.lower()))
+        return found[:limit]
+
+
+index = SimilarityIndex()
+supabase_client.blacklist_listeners.append(index.on_blacklist_change)
+
+
+def find_similar(nickname: str, exclude: Any = None, limit: int = LIMIT) -> List[Dict[str, Any]]:
+    """Blacklisted nicknames similar to ``nickname``, as JSON-ready dicts."""
+    try:
+        index.ensure_built()
+    except Exception as e:
+        logger.error(f"Similarity index unavailable: {e}")
+        return []
+    return [{'nickname': m.nickname, 'uuid': m.uuid, 'reason': m.reason, 'distance': m.distance}
+            for m in index.search(nickname, exclude=exclude, limit=limit)]
@@ -0,0 +1,159 @@
+"""
+Cold-start instrumentation and warm-up.
+
+``mark(name)`` closes a startup phase: it records the time since the previous
+mark (the first phase starts when this module is imported, i.e. at the top of
+the entry point). ``warm_up(app)`` runs before the server takes traffic and
+primes what the first requests would otherwise pay for: the Supabase clients
+and connection, the whitelist cache, Mojang nicknames of players on the map,
+compiled templates, the cached public pages, the similar-nickname index and
+the blacklist mirror. Each step is timed as a ``warmup.<step>`` phase, and
+the whole warm-up is bounded by WARMUP_TIMEOUT.
+
+Phases are logged once as a summary and exported as
+``app_startup_phase_seconds{phase=...}``.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable
+
+from metrics import REGISTRY, Family
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = os.getenv('WARMUP_ON_START', '1') != '0'
+WARMUP_TIMEOUT = float(os.getenv('WARMUP_TIMEOUT', '15'))
+WARMUP_PROFILES = int(os.getenv('WARMUP_PROFILES', '50'))
+
+_started = time.perf_counter()
+_last = _started
+_lock = threading.Lock()
+phases: 'OrderedDict[str, float]' = OrderedDict()
+
+
+def mark(name: str) -> float:
+    """End the current phase under ``name``; returns its duration in seconds."""
+    global _last
+    with _lock:
+        now = time.perf_counter()
+        elapsed = now - _last
+        phases[name] = phases.get(name, 0.0) + elapsed
+        _last = now
+    return elapsed
+
+
+@contextmanager
+def phase(name: str):
+    """Time a block as its own phase, independent of the mark() sequence."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+
+
+def total() -> float:
+    return _last - _started
+
+
+def summary() -> str:
+    with _lock:
+        items = list(phases.items())
+    parts = ', '.join(f'{name} {seconds * 1000:.0f} ms' for name, seconds in items)
+    return f"Startup {total() * 1000:.0f} ms: {parts}"
+
+
+def collect_metrics() -> Iterable[Family]:
+    with _lock:
+        samples = [({'phase': name}, seconds) for name, seconds in phases.items()]
+    yield 'app_startup_phase_seconds', 'gauge', 'Time spent in each startup phase.', samples
+
+
+REGISTRY.add_collector(collect_metrics)
+
+
+# ─────────────── Прогрев ───────────────
+def _warm_supabase() -> None:
+    from supabase_client import db
+    db.client, db.admin_client  # noqa: B018 — создаёт клиенты (ленивые свойства)
+    # Первая страница ЧС: открывает соединение (TLS + HTTP/2) к PostgREST в общем пуле
+    db.get_all_blacklist_entries(page=1, per_page=20)
+
+
+def _warm_whitelist() -> None:
+    from supabase_client import db
+    db.get_all_whitelisted_uuids()
+
+
+def _warm_profiles() -> None:
+    """Ники игроков, которые сейчас на карте: первый запрос /api/locations/view их и спросит."""
+    from mojang import get_name_from_uuid
+    from supabase_client import db
+    uuids = list(dict.fromkeys(loc['uuid'] for loc in db.get_recent_player_locations(limit=100)
+                               if loc.get('uuid')))[:WARMUP_PROFILES]
+    with ThreadPoolExecutor(max_workers=8, thread_name_prefix='warmup') as pool:
+        list(pool.map(get_name_from_uuid, uuids))
+
+
+def _warm_blacklist_index() -> None:
+    """Индекс похожих ников: иначе его строит первый /api/check?similar=1."""
+    import similarity
+    similarity.index.ensure_built()
+
+
+def _warm_mirror() -> None:
+    """Синхронизация зеркала ЧС; поток синхронизации запустит первое чтение, уже в процессе воркера."""
+    import supabase_client
+    if supabase_client.read_mirror is not None:
+        supabase_client.read_mirror.sync()
+
+
+def _warm_templates(app) -> None:
+    for name in app.jinja_env.list_templates(extensions=('html', 'js')):
+        app.jinja_env.get_template(name)
+
+
+def _warm_pages(app) -> None:
+    """Анонимный GET каждой страницы с @cache_page кладёт её в page_cache."""
+    client = app.test_client()
+    for rule in app.url_map.iter_rules():
+        view = app.view_functions.get(rule.endpoint)
+        if getattr(view, '_page_cache', False) and 'GET' in rule.methods and not rule.arguments:
+            client.get(rule.rule).close()
+
+
+def warm_up(app, timeout: float = WARMUP_TIMEOUT) -> bool:
+    """Run the warm-up steps; returns False if they did not finish within ``timeout`` seconds."""
+    steps = (
+        ('supabase', _warm_supabase),
+        ('whitelist', _warm_whitelist),
+        ('profiles', _warm_profiles),
+        ('templates', lambda: _warm_templates(app)),
+        ('pages', lambda: _warm_pages(app)),
+        ('blacklist_index', _warm_blacklist_index),
+        ('mirror', _warm_mirror),
+    )
+
+    def run():
+        for name, step in steps:
+            with phase(f'warmup.{name}'):
+                try:
+                    step()
+                except Exception as e:
+                    # Прогрев — оптимизация: упавший шаг не должен мешать старту
+                    logger.warning("Warm-up step %s failed: %s", name, e)
+
+    worker = threading.Thread(target=run, name='warmup', daemon=True)
+    worker.start()
+    worker.join(timeout)
+    mark('warmup')
+    if worker.is_alive():
+        logger.warning("Warm-up did not finish in %.0f s; continuing in the background", timeout)
+        return False
+    return True
@@ -90,7 +90,7 @@ class InfiniteScroll {
       const data = await response.json();
       
       if (data.items && data.items.length > 0) {
-        await this.renderItems(data.items, false); // false for not prepending
+        this.renderItems(data.items, false); // false for not prepending
         this.page++;
         this.hasMore = data.has_more;
         if (!this.hasMore && this.options.noMoreResultsIndicator) {
@@ -116,30 +116,19 @@ class InfiniteScroll {
     }
   }
   
-  async createItemElement(item) {
+  createItemElement(item) {
     const element = document.createElement('div');
     element.className = 'blacklist-entry';
     element.dataset.id = item.id; // Use database ID for tracking
 
-    let avatarSrc = 'https://minotar.net/helm/MHF_Steve/50.png';
-    try {
-        // Use the new combined player details endpoint if available
-        const detailsResponse = await fetch(`/api/player-details/${item.uuid}`);
-        if (detailsResponse.ok) {
-            const detailsData = await detailsResponse.json();
-            if (detailsData.avatar_base64) avatarSrc = detailsData.avatar_base64;
-            // item.nickname might be updated by this too, but the render logic below uses item.nickname from payload
-        } else {
-            console.warn(`Failed to fetch player details for ${item.uuid} (status: ${detailsResponse.status})`);
-        }
-    } catch (e) {
-        console.warn(`Error fetching player details for ${item.uuid}:`, e);
-    }
+    // /api/fullist и /api/player-details/batch уже отдают URL аватарки и текущий ник
+    const avatarSrc = item.avatar_url || 'https://minotar.net/helm/MHF_Steve/50.png';
+    const nickname = item.current_nickname || item.nickname;
 
     element.innerHTML = `
       <div class="entry-header">
-        <img src="${avatarSrc}" alt="${item.nickname}" class="avatar" loading="lazy" style="width:50px; height:50px; margin-right:10px; border-radius:5px;">
-        <h3>${item.nickname || 'Неизвестный'}</h3>
+        <img src="${avatarSrc}" alt="${nickname}" class="avatar" loading="lazy" style="width:50px; height:50px; margin-right:10px; border-radius:5px;">
+        <h3>${nickname || 'Неизвестный'}</h3>
       </div>
       <div class="entry-details">
         <p class="reason" style="margin: 5px 0;">Причина: ${item.reason || 'Не указана'}</p>
@@ -149,8 +138,31 @@ class InfiniteScroll {
     `;
     return element;
   }
-  
-  async renderItems(items, prepend = false) {
+
+  // Строки из realtime приходят без ника и аватарки — добираем их одним запросом на пачку
+  async enrichItems(items) {
+    const uuids = [...new Set(items.filter(item => item.uuid && !item.avatar_url).map(item => item.uuid))];
+    if (uuids.length === 0) return items;
+    try {
+      const response = await fetch('/api/player-details/batch', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ uuids })
+      });
+      if (!response.ok) throw new Error(`HTTP error ${response.status}`);
+      const { players } = await response.json();
+      return items.map(item => {
+        const details = players[item.uuid];
+        if (!details) return item;
+        return { ...item, avatar_url: details.avatar_url, current_nickname: details.nickname || item.nickname };
+      });
+    } catch (e) {
+      console.warn('Error fetching player details batch:', e);
+      return items;
+    }
+  }
+
+  renderItems(items, prepend = false) {
     if (!this.container) return;
     const fragment = document.createDocumentFragment();
     
@@ -159,7 +171,7 @@ class InfiniteScroll {
           console.warn("Item without ID found, cannot cache or reliably update:", item);
           continue;
       }
-      const element = await this.createItemElement(item);
+      const element = this.createItemElement(item);
       this.itemsCache.set(item.id.toString(), element); // Cache element by ID
       fragment.appendChild(element);
     }
@@ -235,7 +247,9 @@ class InfiniteScroll {
     
     // Consider sort order for prepending/appending - by default, prepend for 'desc' created_at
     const prepend = this.options.sortBy === 'created_at' && this.options.sortOrder === 'desc';
-    await this.renderItems([newItem], prepend);
+    const [item] = await this.enrichItems([newItem]);
+    if (this.itemsCache.has(item.id.toString())) return; // пока ждали ответа, строка могла прийти со страницей
+    this.renderItems([item], prepend);
     if (this.options.initialPageContentElement && this.container.querySelector('.text-center.text-muted')){
         this.options.initialPageContentElement.innerHTML = ''; // Clear "No records found" if it was there
     }
@@ -249,7 +263,8 @@ class InfiniteScroll {
 
     if (existingElement) {
       // Re-render the specific item with new data
-      const newElement = await this.createItemElement(updatedItem);
+      const [item] = await this.enrichItems([updatedItem]);
+      const newElement = this.createItemElement(item);
       existingElement.replaceWith(newElement);
       this.itemsCache.set(itemKey, newElement); // Update cache
     } else {
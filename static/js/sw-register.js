@@ -1,5 +1,18 @@
 if ('serviceWorker' in navigator) {
   navigator.serviceWorker.register('/sw.js', { scope: '/' })
-    .then(reg => console.log("✅ Service Worker registered", reg))
+    .then(async reg => {
+      console.log("✅ Service Worker registered", reg);
+      // Периодическая догрузка новых записей (поддерживается не везде и только для установленного PWA)
+      if ('periodicSync' in reg) {
+        try {
+          const status = await navigator.permissions.query({ name: 'periodic-background-sync' });
+          if (status.state === 'granted') {
+            await reg.periodicSync.register('latest-data-sync', { minInterval: 6 * 60 * 60 * 1000 });
+          }
+        } catch (err) {
+          console.warn("Periodic sync unavailable", err);
+        }
+      }
+    })
     .catch(err => console.error("❌ Service Worker failed", err));
 }
@@ -1,26 +1,402 @@
-from supabase import create_client, Client
+import asyncio
+import contextvars
+import os
+import re
+import sqlite3
+import threading
+import time
 from datetime import datetime, timedelta, timezone
 from config import SUPABASE_URL, SUPABASE_KEY, SUPABASE_SERVICE_KEY
-from typing import Optional, List, Dict, Any
+import httpx
+import invalidation
+from http_client import outbound
+from metrics import instrument_methods
+from typing import TYPE_CHECKING, Optional, List, Dict, Any, Awaitable, Callable, Tuple
 import logging
 
+if TYPE_CHECKING:
+    from postgrest import AsyncPostgrestClient
+    from supabase import Client
+
 logger = logging.getLogger(__name__)
 
+
+def _use_shared_transport(client: 'Client') -> 'Client':
+    """Swap the PostgREST session for one backed by the shared outbound pools."""
+    postgrest = client.postgrest
+    old_session = postgrest.session
+    postgrest.session = outbound.session(
+        base_url=str(old_session.base_url),
+        headers=old_session.headers,
+        session_cls=type(old_session),
+    )
+    old_session.close()
+    return client
+
+
+def _or_filter(query, expression: str):
+    """PostgREST ``or=(...)``; postgrest-py 0.10 select builders have no or_()."""
+    query.params = query.params.add('or', f'({expression})')
+    return query
+
+
+def _order_by(query, *clauses: str):
+    """One ``order=a.desc,b.desc`` parameter; chained .order() calls would send the key twice."""
+    query.params = query.params.add('order', ','.join(clauses))
+    return query
+
+
+def audit_cursor(row: Dict[str, Any]) -> str:
+    """Position of an audit_log row for get_audit_logs: '<id>:<timestamp>'."""
+    return f"{row['id']}:{row['timestamp']}"
+
+
+def _parse_audit_cursor(value: Optional[str]) -> Optional[Tuple[int, str]]:
+    # Значения попадают в or=(...), поэтому принимаем только число и разобранную дату
+    entry_id, _, timestamp = (value or '').partition(':')
+    try:
+        return int(entry_id), datetime.fromisoformat(timestamp.replace('Z', '+00:00')).isoformat()
+    except ValueError:
+        return None
+
+
+def _is_missing_function(error: Exception) -> bool:
+    """PostgREST error for an RPC whose migration has not been applied yet."""
+    if getattr(error, 'code', None) in ('PGRST202', '42883'):
+        return True
+    text = str(error).lower()
+    return 'function' in text and ('not found' in text or 'could not find' in text)
+
+
+# Колонки blacklist_entry из миграций, которые могли ещё не применить (колонка -> миграция):
+# nickname_key — lower(nickname) с уникальным индексом, last_verified_at — когда запись сверяли с Mojang.
+# Первая ошибка про отсутствующую колонку выключает её: без nickname_key поиск идёт по ILIKE
+# с экранированием, last_verified_at просто не пишется
+OPTIONAL_COLUMNS = {'nickname_key': '002', 'last_verified_at': '003'}
+_schema = {column: True for column in OPTIONAL_COLUMNS}
+
+
+def nickname_key(nickname: str) -> str:
+    """Normalized form for exact case-insensitive matching (nicknames are ASCII)."""
+    return nickname.strip().lower()
+
+
+def _escape_like(value: str) -> str:
+    return re.sub(r'([\\%_])', r'\\\1', value)
+
+
+def _blacklist_row(data: Dict[str, Any]) -> Dict[str, Any]:
+    """blacklist_entry row or patch with nickname_key filled in and columns the table lacks dropped."""
+    if data.get('nickname'):
+        data = {**data, 'nickname_key': nickname_key(data['nickname'])}
+    return {k: v for k, v in data.items() if _schema.get(k, True)}
+
+
+def _match_nickname(query, nickname: str):
+    if _schema['nickname_key']:
+        return query.eq('nickname_key', nickname_key(nickname))
+    return query.ilike('nickname', _escape_like(nickname.strip()))
+
+
+def _optional_column_missing(error: Exception) -> bool:
+    """True (and switch to the fallback) if ``error`` is about a missing OPTIONAL_COLUMNS column."""
+    text = str(error)
+    if getattr(error, 'code', None) not in ('42703', 'PGRST204') and 'does not exist' not in text \
+            and 'could not find' not in text.lower():
+        return False
+    for column, migration in OPTIONAL_COLUMNS.items():
+        if _schema[column] and column in text:
+            logger.warning(f"blacklist_entry.{column} not found (apply migrations/{migration}); working without it")
+            _schema[column] = False
+            return True
+    return False
+
+
+def _retry_on_missing_column(run: Callable[[], Any]) -> Any:
+    """Run a blacklist_entry request; repeat it if it failed on a column a migration adds."""
+    while True:
+        try:
+            return run()
+        except Exception as e:
+            if not _optional_column_missing(e):
+                raise
+
+
+async def _aretry_on_missing_column(run: Callable[[], Awaitable[Any]]) -> Any:
+    while True:
+        try:
+            return await run()
+        except Exception as e:
+            if not _optional_column_missing(e):
+                raise
+
+
+# Разделители списка or=(...) и шаблонов LIKE в поисковой строке не нужны, а ломают фильтр
+_SEARCH_UNSAFE = re.compile(r'[,()"\\%*]')
+
+
+def _blacklist_page_query(table, page: int, per_page: int, search: Optional[str], sort_by: str, sort_order: str, date_from: Optional[str], date_to: Optional[str],
+                          created_after: Optional[str] = None):
+    """
+    Build the paged blacklist select; works with both sync and async PostgREST builders.
+    ``date_from`` is the list view's inclusive filter; ``created_after`` is strict, for deltas
+    that pass the newest created_at seen so far.
+    """
+    query = table.select('*', count='exact')
+
+    search = _SEARCH_UNSAFE.sub('', search or '')
+    if search:
+        query = _or_filter(query, f'nickname.ilike.%{search}%,reason.ilike.%{search}%')
+
+    # Date filtering
+    if date_from:
+        query = query.gte('created_at', date_from)
+    if created_after:
+        query = query.gt('created_at', created_after)
+    if date_to:
+        # Add 1 day to date_to to make the range inclusive of the end date
+        try:
+            end_date = datetime.fromisoformat(date_to.replace('Z', '+00:00')) + timedelta(days=1)
+            query = query.lte('created_at', end_date.isoformat())
+        except ValueError:
+            logger.warning(f"Invalid date_to format: {date_to}. Skipping date_to filter.")
+
+    # Sorting
+    if sort_by and sort_order:
+        is_desc = sort_order.lower() == 'desc'
+        query = query.order(sort_by, desc=is_desc)
+    else: # Default sort if not specified
+        query = query.order('created_at', desc=True)
+
+    # Pagination; range() в postgrest-py 0.10 сам вычитает единицу из конца
+    start_index = (page - 1) * per_page
+    return query.range(start_index, start_index + per_page)
+
+
+def _page_result(result, page: int, per_page: int) -> Dict[str, Any]:
+    total_items = result.count if hasattr(result, 'count') and result.count is not None else 0
+    return {
+        'items': result.data,
+        'page': page,
+        'per_page': per_page,
+        'total_items': total_items,
+        'has_more': (page * per_page) < total_items
+    }
+
+
+# Подписчики на изменения blacklist_entry: fn(op, row), op — 'upsert' | 'delete'. Вызываются для записей
+# этого процесса сразу, для записей других воркеров — из invalidation.poll() в начале запроса.
+# Так локальные индексы (similarity.py) обновляются без перечитывания таблицы
+blacklist_listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+
+
+def _call_listeners(kind: str, listeners: List[Callable[[str, Dict[str, Any]], None]],
+                    op: str, row: Dict[str, Any]) -> None:
+    for listener in list(listeners):
+        try:
+            listener(op, row)
+        except Exception as e:
+            logger.error(f"{kind} listener {listener!r} failed on {op}: {e}")
+
+
+def _notify_blacklist(op: str, rows: Optional[List[Dict[str, Any]]]) -> None:
+    for row in rows or ():
+        # Файл зеркала общий для воркеров хоста — его обновляет только воркер, сделавший запись
+        if read_mirror is not None:
+            _call_listeners('Mirror', [read_mirror.on_blacklist_change], op, row)
+        _call_listeners('Blacklist', blacklist_listeners, op, row)
+        invalidation.publish('blacklist', op, row)
+
+
+# То же для whitelist_players: row = {'uuid': ...}
+whitelist_listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+
+
+def _notify_whitelist(op: str, uuid: str) -> None:
+    if read_mirror is not None:
+        _call_listeners('Mirror', [read_mirror.on_whitelist_change], op, {'uuid': uuid})
+    _call_listeners('Whitelist', whitelist_listeners, op, {'uuid': uuid})
+    invalidation.publish('whitelist', op, {'uuid': uuid})
+
+
+# Локальная копия blacklist_entry и whitelist_players (mirror.py ставит её при импорте); None — читаем из Supabase.
+# Свои записи процесс применяет к ней сам (_notify_*), чужие в ней уже есть — файл общий
+read_mirror = None
+_LIVE = object()
+
+
+class BackendUnavailable(Exception):
+    """Neither Supabase nor the local mirror could answer; must not be read as "not found"."""
+
+
+# Откуда отвечают чтения с зеркалом: 'fallback' — из Supabase, зеркало только при сбое; 'first' — из зеркала, пока оно синхронно
+MIRROR_FIRST = os.getenv('MIRROR_READS', 'fallback') == 'first'
+# Возраст зеркала, если последнее такое чтение в этом потоке/задаче ответило из него; None — ответил Supabase
+_served_by_mirror: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('served_by_mirror', default=None)
+
+
+def mirror_age() -> Optional[float]:
+    """Seconds the mirror lagged behind when the last blacklist read answered from it; None when Supabase did."""
+    return _served_by_mirror.get()
+
+
+def _mirror_read(method: str, *args: Any, fallback: bool = False) -> Any:
+    """
+    The mirror's answer, or _LIVE: the read goes to Supabase. The mirror is
+    asked first only with MIRROR_READS=first; otherwise ``fallback=True`` asks
+    it after Supabase has failed.
+    """
+    if read_mirror is None:
+        return _LIVE
+    if not (fallback or MIRROR_FIRST):
+        read_mirror.start()  # синхронизируется всегда, чтобы при сбое было чем ответить
+        return _LIVE
+    if not read_mirror.ready():
+        return _LIVE
+    try:
+        return getattr(read_mirror, method)(*args)
+    except sqlite3.Error as e:
+        logger.warning(f"Mirror read {method} failed: {e}")
+        return _LIVE
+
+
+async def _amirror_read(method: str, *args: Any, fallback: bool = False) -> Any:
+    """_mirror_read for the async tier: SQLite is read in a thread, not on the event loop."""
+    if read_mirror is None or not (fallback or MIRROR_FIRST):
+        return _mirror_read(method, *args, fallback=fallback)
+    return await asyncio.to_thread(_mirror_read, method, *args, fallback=fallback)
+
+
+def _note_source(found: Any) -> Any:
+    _served_by_mirror.set(None if found is _LIVE else read_mirror.age())
+    return found
+
+
+def _is_unreachable(error: Exception) -> bool:
+    """Supabase did not answer at all (connect error, timeout), as opposed to rejecting the request."""
+    return isinstance(error, httpx.TransportError)
+
+
+WHITELIST_TTL = 60  # секунд; список читает мод сервера на каждом входе игрока
+NICKNAME_HISTORY_TTL = 300  # секунд; записи любого воркера сбрасывают кэш сразу (invalidation.py), TTL — запасной путь
+PAGE_ROWS = 1000  # max-rows PostgREST в Supabase по умолчанию
+ADMIN_USER_TTL = 60  # секунд; создание/удаление в любом воркере сбрасывает кэш сразу (invalidation.py)
+
+
+def compact_uuid(uuid: str) -> str:
+    return uuid.replace('-', '').strip().lower()
+
+
+def _uuid_variants(uuid: str) -> List[str]:
+    """The compact form and the dashed one: blacklist_entry has rows in both."""
+    u = compact_uuid(uuid)
+    if len(u) != 32:
+        return [u]
+    return [u, f'{u[:8]}-{u[8:12]}-{u[12:16]}-{u[16:20]}-{u[20:]}']
+
+
 class SupabaseClient:
+    """
+    Clients are created on first use: importing ``supabase`` (gotrue, storage3,
+    realtime) and building two clients is the largest part of a cold start,
+    and a worker that only serves static files or cached pages never needs them.
+    """
     def __init__(self):
-        self.client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-        self.admin_client: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+        self._clients: Dict[str, 'Client'] = {}
+        self._clients_lock = threading.Lock()
+        self._whitelist: Optional[Tuple[float, List[str]]] = None  # (monotonic time, uuids)
+        self._missing_rpcs = set()  # RPC, для которых миграция ещё не применена — не дёргаем их повторно
+        self._nickname_history: Optional[Tuple[float, Dict[str, List[str]]]] = None  # (monotonic time, key -> uuids)
+        self._nickname_history_lock = threading.Lock()
+        self._admin_users: Dict[Tuple[str, Any], Tuple[float, Optional[Dict[str, Any]]]] = {}  # (column, value) -> (monotonic time, row)
+
+    def _client_for(self, key: str) -> 'Client':
+        client = self._clients.get(key)
+        if client is None:
+            with self._clients_lock:
+                client = self._clients.get(key)
+                if client is None:
+                    from supabase import create_client
+                    client = self._clients[key] = _use_shared_transport(create_client(SUPABASE_URL, key))
+        return client
+
+    @property
+    def client(self) -> 'Client':
+        return self._client_for(SUPABASE_KEY)
+
+    @property
+    def admin_client(self) -> 'Client':
+        return self._client_for(SUPABASE_SERVICE_KEY)
 
     # Blacklist operations
     def get_blacklist_entry(self, nickname: str) -> Optional[Dict[str, Any]]:
+        """
+        Entry for ``nickname`` or None; raises BackendUnavailable rather than answer None on an error.
+        mirror_age() then tells whether the answer came from the mirror.
+        """
+        entry = _note_source(_mirror_read('get_blacklist_entry', nickname))
+        if entry is not _LIVE:
+            return entry
         try:
-            result = self.client.table('blacklist_entry').select('*').ilike('nickname', nickname).execute()
+            result = _retry_on_missing_column(lambda: _match_nickname(
+                self.client.table('blacklist_entry').select('*'), nickname).limit(1).execute())
             entries = result.data
             return entries[0] if entries else None
         except Exception as e:
+            entry = _note_source(_mirror_read('get_blacklist_entry', nickname, fallback=True))
+            if entry is not _LIVE:
+                logger.warning(f"Supabase failed ({e}); blacklist entry answered from the mirror")
+                return entry
             logger.error(f"Error getting blacklist entry: {e}")
+            raise BackendUnavailable() from e
+
+    def get_blacklist_entries_by_nicknames(self, nicknames: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Lower-cased nickname -> entry for the given nicknames, in one request."""
+        if not nicknames:
+            return {}
+        found = _note_source(_mirror_read('get_blacklist_entries_by_nicknames', nicknames))
+        if found is not _LIVE:
+            return found
+        def run():
+            query = self.client.table('blacklist_entry').select('*')
+            if _schema['nickname_key']:
+                return query.in_('nickname_key', [nickname_key(n) for n in nicknames]).execute()
+            # Ники уже проверены (только [A-Za-z0-9_]); в or=(...) экранировать нечего, кроме '_' для ILIKE
+            return _or_filter(query, ','.join(f'nickname.ilike.{_escape_like(n)}' for n in nicknames)).execute()
+        try:
+            result = _retry_on_missing_column(run)
+        except Exception as e:
+            found = _note_source(_mirror_read('get_blacklist_entries_by_nicknames', nicknames, fallback=True))
+            if found is not _LIVE:
+                return found
+            logger.error(f"Error getting blacklist entries by nicknames: {e}")
+            return {}
+        wanted = {n.lower() for n in nicknames}
+        return {e['nickname'].lower(): e for e in result.data or [] if e['nickname'].lower() in wanted}
+
+    def get_blacklist_entry_by_uuid(self, uuid: str) -> Optional[Dict[str, Any]]:
+        entry = _mirror_read('get_blacklist_entry_by_uuid', uuid)
+        if entry is not _LIVE:
+            return entry
+        try:
+            result = self.client.table('blacklist_entry').select('*').in_('uuid', _uuid_variants(uuid)).limit(1).execute()
+            entries = result.data
+            return entries[0] if entries else None
+        except Exception as e:
+            entry = _mirror_read('get_blacklist_entry_by_uuid', uuid, fallback=True)
+            if entry is not _LIVE:
+                return entry
+            logger.error(f"Error getting blacklist entry by UUID: {e}")
             return None
 
+    def get_blacklist_entry_by_past_nickname(self, nickname: str) -> Optional[Dict[str, Any]]:
+        """Entry of a player who used to be called ``nickname``; no request unless the name is in the history."""
+        for uuid in self.find_uuids_by_past_nickname(nickname):
+            entry = self.get_blacklist_entry_by_uuid(uuid)
+            if entry:
+                return entry
+        return None
+
     def get_blacklist_entry_by_id(self, entry_id: int) -> Optional[Dict[str, Any]]:
         try:
             result = self.client.table('blacklist_entry').select('*').eq('id', entry_id).execute()
@@ -38,15 +414,81 @@ class SupabaseClient:
                 'reason': reason,
                 'created_at': datetime.utcnow().isoformat()
             }
-            result = self.admin_client.table('blacklist_entry').insert(data).execute()
+            result = _retry_on_missing_column(
+                lambda: self.admin_client.table('blacklist_entry').insert(_blacklist_row(data)).execute())
+            _notify_blacklist('upsert', result.data)
             return bool(result.data)
         except Exception as e:
             logger.error(f"Error adding blacklist entry: {e}")
             return False
 
+    def add_or_reject_blacklist_entry(self, nickname: str, uuid: str, reason: str,
+                                      admin_username: Optional[str] = None, queue: bool = True) -> Dict[str, Any]:
+        """
+        Add an entry unless its UUID or nickname is already blacklisted, and write the
+        ADD_BLACKLIST audit record, in one round trip (RPC from migrations/001).
+        Returns {'status': 'added' | 'exists' | 'error', 'conflict': None | 'uuid' | 'nickname', 'entry': ...}.
+        While Supabase is unreachable the addition is checked against the mirror and queued
+        there ('queued'). With ``queue=False`` (the replay itself) BackendUnavailable is raised
+        instead, so an outage is not mistaken for a rejection.
+        """
+        params = {'p_nickname': nickname, 'p_uuid': uuid, 'p_reason': reason, 'p_admin_username': admin_username}
+        if 'add_or_reject_blacklist_entry' not in self._missing_rpcs:
+            try:
+                result = self.admin_client.rpc('add_or_reject_blacklist_entry', params).execute()
+                outcome = result.data[0]
+                if outcome.get('status') == 'added':
+                    _notify_blacklist('upsert', [outcome['entry']])
+                return outcome
+            except Exception as e:
+                if _is_unreachable(e):
+                    if not queue:
+                        raise BackendUnavailable() from e
+                    if read_mirror is not None:
+                        return read_mirror.queue_add(nickname, uuid, reason, admin_username)
+                if not _is_missing_function(e):
+                    logger.error(f"Error in add_or_reject_blacklist_entry: {e}")
+                    return {'status': 'error', 'conflict': None, 'entry': None}
+                logger.warning("RPC add_or_reject_blacklist_entry not found (apply migrations/001); using plain insert")
+                self._missing_rpcs.add('add_or_reject_blacklist_entry')
+
+        # Без миграции: проверки дубликатов, вставка и отдельная запись аудита. Уникального индекса может ещё не быть,
+        # поэтому ник и UUID проверяем сами, как это делал admin_panel до RPC; индекс, если есть, ловит гонку
+        try:
+            for conflict, existing in (('nickname', self.get_blacklist_entry(nickname)),
+                                       ('uuid', self.get_blacklist_entry_by_uuid(uuid))):
+                if existing:
+                    return {'status': 'exists', 'conflict': conflict, 'entry': existing}
+        except BackendUnavailable:
+            if not queue:
+                raise
+            return {'status': 'error', 'conflict': None, 'entry': None}
+        data = {'nickname': nickname, 'uuid': uuid, 'reason': reason, 'created_at': datetime.utcnow().isoformat()}
+        try:
+            result = _retry_on_missing_column(
+                lambda: self.admin_client.table('blacklist_entry').insert(_blacklist_row(data)).execute())
+        except Exception as e:
+            if getattr(e, 'code', None) == '23505':
+                conflict = 'nickname' if 'nickname_key' in str(e) else 'uuid'
+                return {'status': 'exists', 'conflict': conflict, 'entry': None}
+            if _is_unreachable(e):
+                if not queue:
+                    raise BackendUnavailable() from e
+                if read_mirror is not None:
+                    return read_mirror.queue_add(nickname, uuid, reason, admin_username)
+            logger.error(f"Error adding blacklist entry: {e}")
+            return {'status': 'error', 'conflict': None, 'entry': None}
+        if admin_username:
+            self.add_audit_log(admin_username, 'ADD_BLACKLIST', target_type='blacklist_entry',
+                               target_identifier=nickname, details=f"UUID: {uuid}, Reason: {reason}")
+        _notify_blacklist('upsert', result.data)
+        return {'status': 'added', 'conflict': None, 'entry': result.data[0] if result.data else data}
+
     def update_blacklist_entry(self, entry_id: int, data: Dict[str, Any]) -> bool:
         try:
-            result = self.admin_client.table('blacklist_entry').update(data).eq('id', entry_id).execute()
+            result = _retry_on_missing_column(lambda: self.admin_client.table('blacklist_entry')
+                                              .update(_blacklist_row(data)).eq('id', entry_id).execute())
+            _notify_blacklist('upsert', result.data)
             return bool(result.data)
         except Exception as e:
             logger.error(f"Error updating blacklist entry: {e}")
@@ -54,60 +496,100 @@ class SupabaseClient:
 
     def update_blacklist_entry_nickname(self, entry_id: int, new_nickname: str) -> bool:
         try:
-            result = self.admin_client.table('blacklist_entry').update({'nickname': new_nickname}).eq('id', entry_id).execute()
+            result = _retry_on_missing_column(lambda: self.admin_client.table('blacklist_entry')
+                                              .update(_blacklist_row({'nickname': new_nickname}))
+                                              .eq('id', entry_id).execute())
+            _notify_blacklist('upsert', result.data)
             return bool(result.data)
         except Exception as e:
             logger.error(f"Error updating blacklist entry nickname for id {entry_id}: {e}")
             return False
 
+    # Nickname history (migrations/004): прошлые ники игроков, uuid хранится без дефисов
+    def add_nickname_history(self, uuid: str, nickname: str) -> bool:
+        """Record that ``uuid`` used to be called ``nickname`` (a repeat of the same pair is ignored)."""
+        data = {'uuid': compact_uuid(uuid), 'nickname': nickname, 'nickname_key': nickname_key(nickname),
+                'changed_at': datetime.now(timezone.utc).isoformat()}
+        try:
+            self.admin_client.table('nickname_history') \
+                .upsert(data, on_conflict='uuid,nickname_key', ignore_duplicates=True).execute()
+        except Exception as e:
+            logger.error(f"Error adding nickname history: {e}")
+            return False
+        self._nickname_history = None
+        invalidation.publish('profiles', 'upsert', {'uuid': data['uuid'], 'nickname': nickname})
+        return True
+
+    def get_nickname_history(self, uuid: str) -> List[Dict[str, Any]]:
+        """Past nicknames of a player, most recent change first."""
+        try:
+            result = self.client.table('nickname_history').select('nickname, changed_at') \
+                .eq('uuid', compact_uuid(uuid)).order('changed_at', desc=True).execute()
+            return result.data or []
+        except Exception as e:
+            logger.error(f"Error getting nickname history: {e}")
+            return []
+
+    def find_uuids_by_past_nickname(self, nickname: str) -> List[str]:
+        """UUIDs that have used ``nickname`` before, from an in-process index of the whole history."""
+        return list(self._nickname_history_index().get(nickname_key(nickname), ()))
+
+    def _nickname_history_index(self) -> Dict[str, List[str]]:
+        cached = self._nickname_history
+        if cached is not None and time.monotonic() - cached[0] < NICKNAME_HISTORY_TTL:
+            return cached[1]
+        with self._nickname_history_lock:
+            cached = self._nickname_history
+            if cached is not None and time.monotonic() - cached[0] < NICKNAME_HISTORY_TTL:
+                return cached[1]
+            index: Dict[str, List[str]] = {}
+            try:
+                last_id = 0
+                while True:
+                    rows = self.client.table('nickname_history').select('id, uuid, nickname_key') \
+                        .gt('id', last_id).order('id').limit(PAGE_ROWS).execute().data or []
+                    for row in rows:
+                        index.setdefault(row['nickname_key'], []).append(row['uuid'])
+                    if len(rows) < PAGE_ROWS:
+                        break
+                    last_id = rows[-1]['id']
+            except Exception as e:
+                # Нет таблицы (миграция 004 не применена) или Supabase недоступен — считаем историю пустой до TTL
+                logger.error(f"Error loading nickname history: {e}")
+            self._nickname_history = (time.monotonic(), index)
+            return index
+
+    def backfill_nickname_keys(self, batch_size: int = 500) -> int:
+        """
+        Set nickname_key on rows where it is missing or stale (written by code that
+        predates migrations/002). Walks the table by id; returns the number of rows fixed.
+        """
+        fixed, last_id = 0, 0
+        while True:
+            rows = self.admin_client.table('blacklist_entry').select('id, nickname, nickname_key') \
+                .gt('id', last_id).order('id').limit(batch_size).execute().data or []
+            for row in rows:
+                key = nickname_key(row['nickname'] or '')
+                if row.get('nickname_key') != key:
+                    self.admin_client.table('blacklist_entry').update({'nickname_key': key}).eq('id', row['id']).execute()
+                    fixed += 1
+            if len(rows) < batch_size:
+                return fixed
+            last_id = rows[-1]['id']
+
     def delete_blacklist_entry(self, entry_id: int) -> bool:
         try:
             result = self.admin_client.table('blacklist_entry').delete().eq('id', entry_id).execute()
+            _notify_blacklist('delete', result.data)
             return bool(result.data)
         except Exception as e:
             logger.error(f"Error deleting blacklist entry: {e}")
             return False
 
-    def get_all_blacklist_entries(self, page: int = 1, per_page: int = 20, search: str = None, sort_by: str = 'created_at', sort_order: str = 'desc', date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, Any]:
-        try:
-            query = self.client.table('blacklist_entry').select('*', count='exact')
-            
-            if search:
-                query = query.or_(f'nickname.ilike.%{search}%,reason.ilike.%{search}%')
-            
-            # Date filtering
-            if date_from:
-                query = query.gte('created_at', date_from)
-            if date_to:
-                # Add 1 day to date_to to make the range inclusive of the end date
-                try:
-                    end_date = datetime.fromisoformat(date_to.replace('Z', '+00:00')) + timedelta(days=1)
-                    query = query.lte('created_at', end_date.isoformat())
-                except ValueError:
-                    logger.warning(f"Invalid date_to format: {date_to}. Skipping date_to filter.")
-
-            # Sorting
-            if sort_by and sort_order:
-                is_desc = sort_order.lower() == 'desc'
-                query = query.order(sort_by, desc=is_desc)
-            else: # Default sort if not specified
-                query = query.order('created_at', desc=True)
-
-            # Pagination
-            start_index = (page - 1) * per_page
-            query = query.range(start_index, start_index + per_page - 1)
-            
-            result = query.execute()
-            
-            total_items = result.count if hasattr(result, 'count') and result.count is not None else 0
-            
-            return {
-                'items': result.data,
-                'page': page,
-                'per_page': per_page,
-                'total_items': total_items, 
-                'has_more': (page * per_page) < total_items
-            }
+    def get_all_blacklist_entries(self, page: int = 1, per_page: int = 20, search: str = None, sort_by: str = 'created_at', sort_order: str = 'desc', date_from: Optional[str] = None, date_to: Optional[str] = None, created_after: Optional[str] = None) -> Dict[str, Any]:
+        try:
+            query = _blacklist_page_query(self.client.table('blacklist_entry'), page, per_page, search, sort_by, sort_order, date_from, date_to, created_after)
+            return _page_result(query.execute(), page, per_page)
         except Exception as e:
             logger.error(f"Error getting blacklist entries: {e}")
             return {'items': [], 'page': page, 'per_page': per_page, 'total_items': 0, 'has_more': False}
@@ -122,20 +604,27 @@ class SupabaseClient:
             return 0
 
     # Admin user operations
+    def _admin_user_by(self, column: str, value: Any) -> Optional[Dict[str, Any]]:
+        cached = self._admin_users.get((column, value))
+        if cached is not None and time.monotonic() - cached[0] < ADMIN_USER_TTL:
+            return cached[1]
+        result = self.admin_client.table('admin_user').select('*').eq(column, value).execute()
+        user = result.data[0] if result.data else None
+        if len(self._admin_users) > 1000:
+            self._admin_users.clear()
+        self._admin_users[(column, value)] = (time.monotonic(), user)
+        return user
+
     def get_admin_user(self, username: str) -> Optional[Dict[str, Any]]:
         try:
-            result = self.admin_client.table('admin_user').select('*').eq('username', username).execute()
-            users = result.data
-            return users[0] if users else None
+            return self._admin_user_by('username', username)
         except Exception as e:
             logger.error(f"Error getting admin user: {e}")
             return None
 
     def get_admin_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
         try:
-            result = self.admin_client.table('admin_user').select('*').eq('id', user_id).execute()
-            users = result.data
-            return users[0] if users else None
+            return self._admin_user_by('id', user_id)
         except Exception as e:
             logger.error(f"Error getting admin user by ID: {e}")
             return None
@@ -148,6 +637,9 @@ class SupabaseClient:
                 'role': role
             }
             result = self.admin_client.table('admin_user').insert(data).execute()
+            self._admin_users.clear()
+            for row in result.data or ():
+                invalidation.publish('admin_users', 'upsert', {'id': row.get('id'), 'username': row.get('username')})
             return bool(result.data)
         except Exception as e:
             logger.error(f"Error creating admin user: {e}")
@@ -164,6 +656,10 @@ class SupabaseClient:
     def delete_admin_user(self, user_id: int) -> bool:
         try:
             result = self.admin_client.table('admin_user').delete().eq('id', user_id).execute()
+            self._admin_users.clear()
+            for row in result.data or ():
+                invalidation.publish('admin_users', 'delete', {'id': row.get('id'), 'username': row.get('username'),
+                                                               'deleted_at': time.time()})
             return bool(result.data)
         except Exception as e:
             logger.error(f"Error deleting admin user: {e}")
@@ -186,27 +682,80 @@ class SupabaseClient:
             logger.error(f"Error adding audit log: {e}")
             return False
 
-    def get_audit_logs(self, page: int = 1, per_page: int = 50) -> Dict[str, Any]:
-        try:
-            query = self.admin_client.table('audit_log').select('*', count='exact')
-            
-            start = (page - 1) * per_page
-            query = query.range(start, start + per_page - 1).order('timestamp', desc=True)
-            
-            result = query.execute()
-            
-            total_items = result.count if hasattr(result, 'count') and result.count is not None else 0
-            
-            return {
-                'items': result.data,
-                'page': page,
-                'per_page': per_page,
-                'total_items': total_items,
-                'has_more': (page * per_page) < total_items
-            }
+    def add_audit_logs(self, rows: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        """Insert audit records in one request; the inserted rows in the same order, None on error."""
+        try:
+            return self.admin_client.table('audit_log').insert(rows).execute().data or []
+        except Exception as e:
+            logger.error(f"Error adding audit logs: {e}")
+            return None
+
+    def add_audit_log_items(self, items: List[Dict[str, Any]]) -> bool:
+        """Insert per-item rows of bulk audit records (migrations/005), PAGE_ROWS per request."""
+        try:
+            for start in range(0, len(items), PAGE_ROWS):
+                self.admin_client.table('audit_log_item').insert(items[start:start + PAGE_ROWS]).execute()
+            return True
+        except Exception as e:
+            logger.error(f"Error adding audit log items: {e}")
+            return False
+
+    def get_audit_logs(self, before: Optional[str] = None, after: Optional[str] = None,
+                       admin_username: Optional[str] = None, action_type: Optional[str] = None,
+                       target_identifier: Optional[str] = None, limit: int = 50) -> Dict[str, Any]:
+        """
+        One page of the audit log, newest first, keyed by (timestamp, id) instead of an offset.
+        ``before``/``after`` are audit_cursor() values: the page older than that row, or the
+        one newer than it. Returns {'items', 'older', 'newer', 'total'}; 'older'/'newer' are
+        the cursors for the neighbouring pages (None at the ends), 'total' is the planner's
+        estimate, given for the first page only.
+        """
+        newer = after is not None and before is None
+        cursor = _parse_audit_cursor(after if newer else before)
+        try:
+            query = self.admin_client.table('audit_log').select('*', count=None if cursor else 'estimated')
+            for column, value in (('admin_username', admin_username), ('action_type', action_type),
+                                  ('target_identifier', target_identifier)):
+                if value:
+                    query = query.eq(column, value)
+            if cursor:
+                entry_id, timestamp = cursor
+                op = 'gt' if newer else 'lt'
+                # (timestamp, id) > / < курсора; первое условие отдельно, чтобы индекс работал как диапазон
+                query = query.filter('timestamp', f'{op}e', timestamp)
+                query = _or_filter(query, f'timestamp.{op}.{timestamp},id.{op}.{entry_id}')
+            direction = '' if newer else '.desc'
+            result = _order_by(query, f'timestamp{direction}', f'id{direction}').limit(limit + 1).execute()
         except Exception as e:
             logger.error(f"Error getting audit logs: {e}")
-            return {'items': [], 'page': page, 'per_page': per_page, 'total_items': 0, 'has_more': False}
+            return {'items': [], 'older': None, 'newer': None, 'total': None}
+
+        rows = result.data or []
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if newer:
+            if not more:
+                # Дошли до самых новых — это первая страница, с оценкой числа записей
+                return self.get_audit_logs(admin_username=admin_username, action_type=action_type,
+                                           target_identifier=target_identifier, limit=limit)
+            rows.reverse()
+        has_older = more or newer
+        has_newer = cursor is not None
+        return {
+            'items': rows,
+            'older': audit_cursor(rows[-1]) if rows and has_older else None,
+            'newer': audit_cursor(rows[0]) if rows and has_newer else None,
+            'total': None if cursor else getattr(result, 'count', None),
+        }
+
+    def archive_audit_log(self, keep_days: int) -> int:
+        """Move audit records older than ``keep_days`` to audit_log_archive (RPC from migrations/006)."""
+        try:
+            result = self.admin_client.rpc('archive_audit_log', {'p_keep_days': keep_days}).execute()
+            return result.data[0]['moved'] if result.data else 0
+        except Exception as e:
+            logger.error(f"Error archiving audit log: {e}")
+            return 0
 
     # Check Log Operations
     def add_check_log(self, check_source: str) -> bool:
@@ -215,6 +764,10 @@ class SupabaseClient:
                 'timestamp': datetime.utcnow().isoformat(),
                 'check_source': check_source 
             }
+            if read_mirror is not None:
+                # Проверка не ждёт Supabase: запись уйдёт из очереди зеркала пачкой
+                read_mirror.enqueue('insert', 'check_log', data)
+                return True
             result = self.admin_client.table('check_log').insert(data).execute()
             return bool(result.data)
         except Exception as e:
@@ -259,6 +812,27 @@ class SupabaseClient:
             logger.error(f"Error getting latest N blacklist entries: {e}")
             return []
 
+    # Player location operations
+    def get_recent_player_locations(self, limit: int = 100) -> List[Dict[str, Any]]:
+        try:
+            result = self.client.table('player_locations') \
+                .select('uuid, x, y, z, client_timestamp, created_at') \
+                .order('created_at', desc=True) \
+                .limit(limit) \
+                .execute()
+            return result.data if result.data else []
+        except Exception as e:
+            logger.error(f"Error getting player locations: {e}")
+            return []
+
+    def add_player_location(self, record: Dict[str, Any]) -> bool:
+        try:
+            result = self.client.table('player_locations').insert(record).execute()
+            return bool(result.data)
+        except Exception as e:
+            logger.error(f"Error adding player location: {e}")
+            return False
+
     # Whitelist Operations
     def get_all_whitelist_entries(self) -> List[Dict[str, Any]]:
         try:
@@ -269,19 +843,36 @@ class SupabaseClient:
             return []
 
     def get_all_whitelisted_uuids(self) -> List[str]:
+        uuids = _mirror_read('whitelisted_uuids')
+        if uuids is not _LIVE:
+            return uuids
+        cached = self._whitelist
+        if cached is not None and time.monotonic() - cached[0] < WHITELIST_TTL:
+            return list(cached[1])
         try:
             # Optimized to fetch only UUIDs if that's all that's needed by the mod
             result = self.client.table('whitelist_players').select('uuid').execute()
-            return [item['uuid'] for item in result.data] if result.data else []
+            uuids = [item['uuid'] for item in result.data] if result.data else []
         except Exception as e:
+            uuids = _mirror_read('whitelisted_uuids', fallback=True)
+            if uuids is not _LIVE:
+                return uuids
             logger.error(f"Error getting all whitelisted UUIDs: {e}")
             return []
+        self._whitelist = (time.monotonic(), uuids)
+        return list(uuids)
 
     def is_whitelisted(self, uuid_to_check: str) -> bool:
+        found = _mirror_read('is_whitelisted', uuid_to_check)
+        if found is not _LIVE:
+            return found
         try:
             result = self.client.table('whitelist_players').select('uuid').eq('uuid', uuid_to_check).limit(1).execute()
             return bool(result.data)
         except Exception as e:
+            found = _mirror_read('is_whitelisted', uuid_to_check, fallback=True)
+            if found is not _LIVE:
+                return found
             logger.error(f"Error checking if UUID is whitelisted: {e}")
             return False
 
@@ -290,6 +881,8 @@ class SupabaseClient:
             data = {'uuid': uuid_to_add, 'added_by': added_by}
             # Use admin_client for whitelist modifications
             result = self.admin_client.table('whitelist_players').insert(data).execute()
+            self._whitelist = None
+            _notify_whitelist('upsert', uuid_to_add)
             return bool(result.data)
         except Exception as e:
             # Could be a duplicate UUID violation (UNIQUE constraint on uuid column)
@@ -302,10 +895,151 @@ class SupabaseClient:
     def remove_from_whitelist(self, uuid_to_remove: str) -> bool:
         try:
             result = self.admin_client.table('whitelist_players').delete().eq('uuid', uuid_to_remove).execute()
-            return bool(result.data) 
+            self._whitelist = None
+            _notify_whitelist('delete', uuid_to_remove)
+            return bool(result.data)
         except Exception as e:
             logger.error(f"Error removing UUID from whitelist: {e}")
             return False
 
-# Create a global instance
-db = SupabaseClient() 
\ No newline at end of file
+class AsyncSupabaseClient:
+    """
+    Async counterpart of SupabaseClient for the asyncio API tier (async_api.py).
+    Covers only the calls made by the async endpoints; same tables, same error handling.
+    """
+    def __init__(self):
+        self._clients: Dict[str, 'AsyncPostgrestClient'] = {}
+
+    def _client_for(self, key: str) -> 'AsyncPostgrestClient':
+        # Без блокировки: создаётся из одного event loop, гонка максимум даст лишний объект
+        client = self._clients.get(key)
+        if client is None:
+            client = self._clients[key] = _async_postgrest(key)
+        return client
+
+    @property
+    def client(self) -> 'AsyncPostgrestClient':
+        return self._client_for(SUPABASE_KEY)
+
+    @property
+    def admin_client(self) -> 'AsyncPostgrestClient':
+        return self._client_for(SUPABASE_SERVICE_KEY)
+
+    async def get_blacklist_entry(self, nickname: str) -> Optional[Dict[str, Any]]:
+        entry = _note_source(await _amirror_read('get_blacklist_entry', nickname))
+        if entry is not _LIVE:
+            return entry
+        try:
+            result = await _aretry_on_missing_column(lambda: _match_nickname(
+                self.client.table('blacklist_entry').select('*'), nickname).limit(1).execute())
+            entries = result.data
+            return entries[0] if entries else None
+        except Exception as e:
+            entry = _note_source(await _amirror_read('get_blacklist_entry', nickname, fallback=True))
+            if entry is not _LIVE:
+                logger.warning(f"Supabase failed ({e}); blacklist entry answered from the mirror")
+                return entry
+            logger.error(f"Error getting blacklist entry: {e}")
+            raise BackendUnavailable() from e
+
+    async def get_blacklist_entry_by_past_nickname(self, nickname: str) -> Optional[Dict[str, Any]]:
+        # Индекс истории общий с синхронным клиентом; перестраивается раз в NICKNAME_HISTORY_TTL — в потоке
+        for uuid in await asyncio.to_thread(db.find_uuids_by_past_nickname, nickname):
+            try:
+                result = await self.client.table('blacklist_entry').select('*') \
+                    .in_('uuid', _uuid_variants(uuid)).limit(1).execute()
+            except Exception as e:
+                logger.error(f"Error getting blacklist entry by UUID: {e}")
+                return None
+            if result.data:
+                return result.data[0]
+        return None
+
+    async def get_all_blacklist_entries(self, page: int = 1, per_page: int = 20, search: str = None, sort_by: str = 'created_at', sort_order: str = 'desc', date_from: Optional[str] = None, date_to: Optional[str] = None, created_after: Optional[str] = None) -> Dict[str, Any]:
+        try:
+            query = _blacklist_page_query(self.client.table('blacklist_entry'), page, per_page, search, sort_by, sort_order, date_from, date_to, created_after)
+            return _page_result(await query.execute(), page, per_page)
+        except Exception as e:
+            logger.error(f"Error getting blacklist entries: {e}")
+            return {'items': [], 'page': page, 'per_page': per_page, 'total_items': 0, 'has_more': False}
+
+    async def add_check_log(self, check_source: str) -> bool:
+        try:
+            data = {
+                'timestamp': datetime.utcnow().isoformat(),
+                'check_source': check_source
+            }
+            if read_mirror is not None:
+                await asyncio.to_thread(read_mirror.enqueue, 'insert', 'check_log', data)  # запись в SQLite
+                return True
+            result = await self.admin_client.table('check_log').insert(data).execute()
+            return bool(result.data)
+        except Exception as e:
+            logger.error(f"Error adding check log: {e}")
+            return False
+
+    async def get_recent_player_locations(self, limit: int = 100) -> List[Dict[str, Any]]:
+        try:
+            result = await self.client.table('player_locations') \
+                .select('uuid, x, y, z, client_timestamp, created_at') \
+                .order('created_at', desc=True) \
+                .limit(limit) \
+                .execute()
+            return result.data if result.data else []
+        except Exception as e:
+            logger.error(f"Error getting player locations: {e}")
+            return []
+
+    async def add_player_location(self, record: Dict[str, Any]) -> bool:
+        try:
+            result = await self.client.table('player_locations').insert(record).execute()
+            return bool(result.data)
+        except Exception as e:
+            logger.error(f"Error adding player location: {e}")
+            return False
+
+
+def _async_postgrest(key: str) -> 'AsyncPostgrestClient':
+    from postgrest import AsyncPostgrestClient
+    client = AsyncPostgrestClient(
+        f"{SUPABASE_URL}/rest/v1",
+        headers={'apiKey': key, 'Accept': 'application/json', 'Content-Type': 'application/json'},
+    ).auth(key)
+    old_session = client.session
+    client.session = outbound.async_session(
+        base_url=str(old_session.base_url),
+        headers=old_session.headers,
+        session_cls=type(old_session),
+    )
+    return client
+
+
+# Every public method is timed into upstream_call_duration_seconds{upstream="supabase"}
+instrument_methods(SupabaseClient, 'supabase')
+instrument_methods(AsyncSupabaseClient, 'supabase')
+
+# Global instances; the underlying clients are built on first use
+db = SupabaseClient()
+async_db = AsyncSupabaseClient()
+
+
+# Изменения, сделанные другими воркерами (invalidation.py): свои кэши сбрасываем, подписчикам передаём
+# строку, но заново не публикуем
+def _remote_whitelist(op: str, row: Dict[str, Any]) -> None:
+    db._whitelist = None
+    _call_listeners('Whitelist', whitelist_listeners, op, row)
+
+
+def _remote_profiles(op: str, row: Dict[str, Any]) -> None:
+    db._nickname_history = None
+
+
+invalidation.subscribe('blacklist', lambda op, row: _call_listeners('Blacklist', blacklist_listeners, op, row))
+invalidation.subscribe('whitelist', _remote_whitelist)
+invalidation.subscribe('admin_users', lambda op, row: db._admin_users.clear())
+invalidation.subscribe('profiles', _remote_profiles)
+
+if __name__ == '__main__':
+    # Деплой: python -m supabase_client — дописывает nickname_key строкам, вставленным до миграции 002
+    logging.basicConfig(level=logging.INFO)
+    print(f"nickname_key backfilled for {db.backfill_nickname_keys()} blacklist entries")
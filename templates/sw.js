@@ -0,0 +1,413 @@
+// Рендерится Flask-ом (маршрут /sw.js): версия кэша и ссылки на статику берутся из манифеста ассетов,
+// так что любой изменённый файл сам по себе даёт новый CACHE_VERSION.
+const CACHE_VERSION = '{{ asset_version }}';
+const STATIC_CACHE  = `static-cache-${CACHE_VERSION}`;
+const RUNTIME_CACHE = `runtime-cache-${CACHE_VERSION}`;
+const FONT_CACHE    = `font-cache-${CACHE_VERSION}`;
+// Данные API и аватарки не зависят от версии статики и переживают деплой
+const API_CACHE     = 'api-cache-v1';
+const AVATAR_CACHE  = 'avatar-cache-v1';
+const PAGE_CACHE    = 'page-cache-v1';
+const OFFLINE_URL   = '/offline';
+
+const PRECACHE_URLS = [
+  '/', OFFLINE_URL,
+{%- for filename in precache_assets %}
+  {{ asset_url(filename) | tojson }},
+{%- endfor %}
+];
+
+const CACHE_LIMITS = {
+  [RUNTIME_CACHE]: 50,
+  [FONT_CACHE]: 10,
+  [API_CACHE]: 60,
+  [AVATAR_CACHE]: 300,
+  [PAGE_CACHE]: 20,
+};
+const AVATAR_MAX_AGE_MS = 7 * 24 * 60 * 60 * 1000;
+const API_TIMEOUT_MS = 3000;
+const CACHED_AT_HEADER = 'sw-cached-at';
+
+// Первая страница списка, как её запрашивает infinite-scroll.js, и лента свежих записей
+const FULLIST_FIRST_PAGE = '/api/fullist?page=1&per_page=20&sort_by=created_at&sort_order=desc';
+const LATEST_DATA_URL = '/api/latest-data?limit=100';
+const DELTA_SYNC_TAG = 'latest-data-sync';
+
+// ─────────────── Обрезка кэшей ───────────────
+// Cache API отдаёт ключи в порядке записи; SWR и cache-first перезаписывают запись при каждом
+// обновлении, так что первые ключи — давно не обновлявшиеся. Удаляем лишнее одной пачкой
+// и не чаще одного раза за TRIM_DELAY_MS на кэш.
+const TRIM_DELAY_MS = 2000;
+const pendingTrims = new Map();
+
+function scheduleTrim(cacheName) {
+  const maxEntries = CACHE_LIMITS[cacheName];
+  if (!maxEntries || pendingTrims.has(cacheName)) return;
+  pendingTrims.set(cacheName, setTimeout(() => {
+    pendingTrims.delete(cacheName);
+    trimCache(cacheName, maxEntries);
+  }, TRIM_DELAY_MS));
+}
+
+async function trimCache(cacheName, maxEntries) {
+  const cache = await caches.open(cacheName);
+  const keys = await cache.keys();
+  const excess = keys.length - maxEntries;
+  if (excess > 0) {
+    await Promise.all(keys.slice(0, excess).map(key => cache.delete(key)));
+  }
+}
+
+async function putWithTimestamp(cacheName, request, response) {
+  // Копия ответа с отметкой времени — по ней считается срок жизни записи
+  const headers = new Headers(response.headers);
+  headers.set(CACHED_AT_HEADER, String(Date.now()));
+  const body = await response.clone().blob();
+  const cache = await caches.open(cacheName);
+  await cache.put(request, new Response(body, { status: response.status, statusText: response.statusText, headers }));
+  scheduleTrim(cacheName);
+}
+
+function cachedAt(response) {
+  return Number(response.headers.get(CACHED_AT_HEADER) || 0);
+}
+
+function withTimeout(promise, ms) {
+  return Promise.race([promise, new Promise((_, reject) => setTimeout(() => reject(new Error('timeout')), ms))]);
+}
+
+// ─────────────── IndexedDB: очередь POST и метаданные синхронизации ───────────────
+function openDatabase() {
+  return new Promise((resolve, reject) => {
+    const req = indexedDB.open('sw-db', 2);
+    req.onupgradeneeded = e => {
+      const db = e.target.result;
+      if (!db.objectStoreNames.contains('post-requests')) {
+        db.createObjectStore('post-requests', { autoIncrement: true });
+      }
+      if (!db.objectStoreNames.contains('meta')) {
+        db.createObjectStore('meta');
+      }
+    };
+    req.onsuccess = () => resolve(req.result);
+    req.onerror   = () => reject(req.error);
+  });
+}
+
+async function getMeta(key) {
+  const db = await openDatabase();
+  return new Promise((resolve, reject) => {
+    const req = db.transaction('meta').objectStore('meta').get(key);
+    req.onsuccess = () => resolve(req.result);
+    req.onerror = () => reject(req.error);
+  });
+}
+
+async function setMeta(key, value) {
+  const db = await openDatabase();
+  return new Promise((resolve, reject) => {
+    const tx = db.transaction('meta', 'readwrite');
+    tx.objectStore('meta').put(value, key);
+    tx.oncomplete = () => resolve();
+    tx.onerror = () => reject(tx.error);
+  });
+}
+
+async function saveRequestToQueue(request) {
+  const db = await openDatabase();
+  const tx = db.transaction('post-requests', 'readwrite');
+  const store = tx.objectStore('post-requests');
+
+  let body;
+  try {
+    body = await request.clone().json();
+  } catch {
+    body = await request.clone().text();
+  }
+
+  store.put({
+    url: request.url,
+    method: request.method,
+    headers: [...request.headers],
+    body
+  });
+
+  return new Promise((resolve, reject) => {
+    tx.oncomplete = () => resolve();
+    tx.onerror = () => reject(tx.error);
+  });
+}
+
+async function processQueue() {
+  const db = await openDatabase();
+  const tx = db.transaction('post-requests', 'readwrite');
+  const store = tx.objectStore('post-requests');
+
+  const requests = await new Promise((resolve, reject) => {
+    const getAll = store.getAll();
+    getAll.onsuccess = () => resolve(getAll.result.map((req, i) => [i + 1, req])); // keys start from 1
+    getAll.onerror = () => reject(getAll.error);
+  });
+
+  for (const [key, entry] of requests) {
+    try {
+      const response = await fetch(entry.url, {
+        method: entry.method,
+        headers: new Headers(entry.headers),
+        body: typeof entry.body === 'string' ? entry.body : JSON.stringify(entry.body),
+        mode: 'no-cors' // для Cloudflare
+      });
+      if (response.ok || response.type === 'opaque') {
+        store.delete(key);
+      }
+    } catch (err) {
+      console.warn('Replay failed', err);
+    }
+  }
+
+  return new Promise((resolve, reject) => {
+    tx.oncomplete = () => resolve();
+    tx.onerror = () => reject(tx.error);
+  });
+}
+
+// ─────────────── Стратегии ───────────────
+async function notifyClients(message) {
+  const clientList = await self.clients.matchAll({ type: 'window' });
+  clientList.forEach(client => client.postMessage(message));
+}
+
+// Ревалидация по ETag: 304 только продлевает запись, 200 заменяет её и сообщает вкладкам
+async function revalidate(request, cached) {
+  const headers = new Headers(request.headers);
+  const etag = cached && cached.headers.get('ETag');
+  if (etag) headers.set('If-None-Match', etag);
+  const response = await fetch(request.url, { headers, credentials: 'same-origin', cache: 'no-store' });
+  if (response.status === 304 && cached) {
+    await putWithTimestamp(API_CACHE, request, cached);
+    return cached;
+  }
+  if (response.ok) {
+    await putWithTimestamp(API_CACHE, request, response);
+    if (cached) notifyClients({ type: 'api-updated', url: request.url });
+  }
+  return response;
+}
+
+async function staleWhileRevalidate(event) {
+  const { request } = event;
+  const cache = await caches.open(API_CACHE);
+  const cached = await cache.match(request);
+  const network = revalidate(request, cached);
+  if (cached) {
+    event.waitUntil(network.catch(() => {}));
+    return cached.clone(); // оригинал ещё нужен revalidate() для 304
+  }
+  try {
+    return await withTimeout(network, API_TIMEOUT_MS);
+  } catch {
+    return new Response(JSON.stringify({ error: 'offline' }), {
+      status: 503, headers: { 'Content-Type': 'application/json' }
+    });
+  }
+}
+
+async function cacheFirstWithExpiry(event, cacheName, maxAgeMs) {
+  const { request } = event;
+  const cache = await caches.open(cacheName);
+  const cached = await cache.match(request);
+  // У opaque-ответов (картинки Minotar) нет своих заголовков — такие живут до вытеснения из кэша
+  if (cached && (!cachedAt(cached) || Date.now() - cachedAt(cached) < maxAgeMs)) return cached;
+  try {
+    const response = await fetch(request);
+    if (response.ok) {
+      event.waitUntil(putWithTimestamp(cacheName, request, response));
+    } else if (response.type === 'opaque') {
+      const copy = response.clone();
+      event.waitUntil(caches.open(cacheName).then(cache => cache.put(request, copy)).then(() => scheduleTrim(cacheName)));
+    }
+    return response;
+  } catch (err) {
+    if (cached) return cached; // просроченная аватарка лучше, чем никакой
+    throw err;
+  }
+}
+
+async function networkFirstPage(event) {
+  const { request } = event;
+  try {
+    const preload = await event.preloadResponse;
+    const response = preload || await fetch(request);
+    if (response.ok) {
+      event.waitUntil(putWithTimestamp(PAGE_CACHE, request, response));
+      return response;
+    }
+    throw new Error(`HTTP ${response.status}`);
+  } catch {
+    const cached = await caches.match(request, { cacheName: PAGE_CACHE });
+    return cached || caches.match(OFFLINE_URL);
+  }
+}
+
+async function networkFirstApi(event) {
+  const { request } = event;
+  try {
+    const response = await withTimeout(fetch(request), API_TIMEOUT_MS);
+    if (response.ok) {
+      event.waitUntil(putWithTimestamp(RUNTIME_CACHE, request, response));
+      return response;
+    }
+    throw new Error(`HTTP ${response.status}`);
+  } catch {
+    return caches.match(request);
+  }
+}
+
+async function cacheFirst(event, cacheName) {
+  const cached = await caches.match(event.request);
+  if (cached) return cached;
+  const response = await fetch(event.request);
+  if (response.ok || response.type === 'opaque') {
+    const copy = response.clone();
+    event.waitUntil(caches.open(cacheName).then(cache => cache.put(event.request, copy)).then(() => scheduleTrim(cacheName)));
+  }
+  return response;
+}
+
+function isAvatar(url) {
+  return url.hostname === 'minotar.net'
+    || url.pathname.startsWith('/api/avatar/')
+    || url.pathname.startsWith('/api/player-details/');
+}
+
+// ─────────────── Фоновая догрузка изменений ───────────────
+// Забираем только записи новее последней синхронизации и, если они есть,
+// обновляем кэш ленты и первой страницы списка — следующий визит отрисуется сразу.
+async function syncLatestData() {
+  const since = await getMeta('latest-data-since');
+  const url = since ? `${LATEST_DATA_URL}&since=${encodeURIComponent(since)}` : LATEST_DATA_URL;
+  const response = await fetch(url, { credentials: 'same-origin', cache: 'no-store' });
+  if (!response.ok) return;
+  const delta = await response.json();
+  if (!Array.isArray(delta) || delta.length === 0) return;
+
+  const newest = delta.reduce((max, e) => (e.created_at && e.created_at > max ? e.created_at : max), since || '');
+  await setMeta('latest-data-since', newest);
+  if (since) {
+    // Дельта меняет содержимое кэшированных ответов — ревалидируем их по ETag
+    const cache = await caches.open(API_CACHE);
+    await Promise.all([LATEST_DATA_URL, FULLIST_FIRST_PAGE].map(async path => {
+      const request = new Request(path);
+      return revalidate(request, await cache.match(request)).catch(() => {});
+    }));
+  }
+}
+
+self.addEventListener('install', event => {
+  event.waitUntil(
+    caches.open(STATIC_CACHE)
+      .then(cache => cache.addAll(PRECACHE_URLS))
+      .then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener('activate', event => {
+  const current = [STATIC_CACHE, RUNTIME_CACHE, FONT_CACHE, API_CACHE, AVATAR_CACHE, PAGE_CACHE];
+  event.waitUntil(
+    Promise.all([
+      caches.keys().then(keys =>
+        Promise.all(keys.map(key => {
+          if (!current.includes(key)) return caches.delete(key);
+        }))
+      ),
+      self.registration.navigationPreload.enable()
+    ]).then(() => self.clients.claim())
+  );
+});
+
+self.addEventListener('fetch', event => {
+  const { request } = event;
+  const url = new URL(request.url);
+
+  // Исключаем Cloudflare Insights
+  if (url.hostname.includes('cloudflareinsights.com')) return;
+
+  // Исключаем админку
+  if (request.mode === 'navigate' && url.pathname.startsWith('/admin')) {
+    return event.respondWith(fetch(request));
+  }
+
+  // Навигация → network-first, при офлайне — последняя сохранённая версия страницы
+  if (request.mode === 'navigate') {
+    event.respondWith(networkFirstPage(event));
+    return;
+  }
+
+  // POST → если ошибка, ставим в очередь
+  if (request.method === 'POST') {
+    event.respondWith(
+      fetch(request.clone())
+        .catch(() =>
+          saveRequestToQueue(request).then(() =>
+            new Response(JSON.stringify({ queued: true }), {
+              headers: { 'Content-Type': 'application/json' }
+            })
+          )
+        )
+    );
+    return;
+  }
+
+  if (request.method !== 'GET') return;
+
+  // Аватарки → cache-first со сроком жизни
+  if (isAvatar(url)) {
+    event.respondWith(cacheFirstWithExpiry(event, AVATAR_CACHE, AVATAR_MAX_AGE_MS));
+    return;
+  }
+
+  // Список и лента → stale-while-revalidate с ETag
+  if (url.origin === self.location.origin
+      && (url.pathname === '/api/fullist' || url.pathname === '/api/latest-data')) {
+    event.respondWith(staleWhileRevalidate(event));
+    return;
+  }
+
+  // Остальное API → network-first
+  if (url.pathname.startsWith('/api/')) {
+    event.respondWith(networkFirstApi(event));
+    return;
+  }
+
+  // Google Fonts → cache-first
+  if (url.hostname === 'fonts.googleapis.com' || url.hostname === 'fonts.gstatic.com') {
+    event.respondWith(cacheFirst(event, FONT_CACHE));
+    return;
+  }
+
+  // Остальное → cache-first
+  event.respondWith(cacheFirst(event, RUNTIME_CACHE));
+});
+
+// Фоновая синхронизация очереди при выходе в онлайн
+self.addEventListener('sync', event => {
+  if (event.tag === 'post-queue-sync') {
+    event.waitUntil(processQueue());
+  }
+});
+
+// Периодическая синхронизация (Chromium, установленное PWA): только новые записи
+self.addEventListener('periodicsync', event => {
+  if (event.tag === DELTA_SYNC_TAG) {
+    event.waitUntil(syncLatestData());
+  }
+});
+
+// Сразу обработать очередь при старте
+self.addEventListener('message', event => {
+  if (event.data === 'syncPosts') {
+    processQueue();
+  } else if (event.data === 'syncLatestData') {
+    event.waitUntil(syncLatestData());
+  }
+});